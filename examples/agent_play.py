@@ -108,7 +108,7 @@ class agent:
     def initialize(self):
         # Initialize the environment and start state
         self.env.reset()
-        self.s = get_state(self.env.state())
+        self.s = get_state(self.env)
         self.is_terminated = False
 
         self.G = 0
@@ -127,7 +127,7 @@ class agent:
         action = self.select_action()
         reward, self.is_terminated = self.env.act(action)
         self.G += reward
-        s_prime = get_state(self.env.state())
+        s_prime = get_state(self.env)
 
         # Progress the game
         self.s = s_prime
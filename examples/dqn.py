@@ -11,6 +11,8 @@
 #   -s, --save: save model data every 1000 episodes                                                            #
 #   -r, --replayoff: disable the replay buffer and train on each state transition                              #
 #   -t, --targetoff: disable the target network                                                                #
+#   -d, --replaydir <directory>: keep the replay buffer in memory-mapped files in this directory                #
+#   -p, --prioritized: sample the replay buffer with proportional prioritized experience replay                #
 #                                                                                                              #
 # References used for this implementation:                                                                     #
 #   https://pytorch.org/docs/stable/nn.html#                                                                   #
@@ -27,7 +29,7 @@ import time
 import random, numpy, argparse, logging, os
 
 from collections import namedtuple
-from minatar import Environment
+from minatar import Environment, pack_state, unpack_state, packed_size
 
 ################################################################################################################
 # Constants
@@ -47,6 +49,9 @@ SQUARED_GRAD_MOMENTUM = 0.95
 MIN_SQUARED_GRAD = 0.01
 GAMMA = 0.99
 EPSILON = 1.0
+PRIORITY_ALPHA = 0.6
+PRIORITY_BETA_START = 0.4
+PRIORITY_EPSILON = 1e-6
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -103,42 +108,253 @@ class QNetwork(nn.Module):
 # tuple of state, next_state, action, reward, is_terminal.  The boolean is_terminal is used to indicate
 # whether if the next state is a terminal state or not.
 #
+# Transitions are stored in preallocated numpy columns.  States are bit-packed (see minatar.pack_state) and stored
+# once: the next state of the transition in row i is the state in row i+1.  When a transition is added its next
+# state is written provisionally into the following row, where it is overwritten by the state of the next
+# transition.  The two only differ when the transition ended an episode, in which case the next state is never used.
+# The rows form a ring of buffer_size+1 entries so that the newest buffer_size transitions always have their next
+# state available.  Sampling gathers a batch with fancy indexing into reusable arrays that are shared with the
+# returned tensors, so the returned batch is only valid until the next call to sample.
+#
+# If a directory is given the columns are np.memmap'ed .npy files in that directory instead of arrays in memory, so
+# the buffer can be larger than RAM.  Pickling such a buffer (e.g. in a torch.save checkpoint) flushes the files and
+# stores only a small header with the directory and write cursor, unpickling reopens the files in place.
+# Checkpoints written before the buffer was packed into columns hold a list of transitions instead, unpickling one
+# refills an in-memory buffer from the list in insertion order.
+#
 ###########################################################################################################
 transition = namedtuple('transition', 'state, next_state, action, reward, is_terminal')
 class replay_buffer:
-    def __init__(self, buffer_size):
+    def __init__(self, buffer_size, in_channels, directory=None):
         self.buffer_size = buffer_size
+        self.in_channels = in_channels
+        self.directory = directory
         self.location = 0
-        self.buffer = []
+        self.size = 0
+        self.num_rows = buffer_size + 1
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._open_columns('w+')
+        self.batch_size = None
+
+    def _open_columns(self, mode):
+        columns = {
+            'states': (numpy.uint8, (self.num_rows, packed_size(self.in_channels))),
+            'actions': (numpy.int64, (self.num_rows,)),
+            'rewards': (numpy.float32, (self.num_rows,)),
+            'is_terminal': (numpy.bool_, (self.num_rows,)),
+        }
+        for name, (dtype, shape) in columns.items():
+            if self.directory is None:
+                column = numpy.zeros(shape, dtype=dtype)
+            elif mode == 'w+':
+                column = numpy.lib.format.open_memmap(os.path.join(self.directory, name + '.npy'), mode='w+',
+                                                      dtype=dtype, shape=shape)
+            else:
+                column = numpy.lib.format.open_memmap(os.path.join(self.directory, name + '.npy'), mode='r+')
+                if column.shape != shape:
+                    raise ValueError("Replay file " + name + ".npy has shape " + str(column.shape) + ", expected " +
+                                     str(shape))
+            setattr(self, name, column)
+
+    # Write the rows modified since the last flush back to the memory-mapped files
+    def flush(self):
+        if self.directory is not None:
+            for column in [self.states, self.actions, self.rewards, self.is_terminal]:
+                column.flush()
+
+    def __getstate__(self):
+        state = {k: v for k, v in self.__dict__.items() if not k.startswith('batch_')}
+        state['batch_size'] = None
+        if self.directory is not None:
+            self.flush()
+            for name in ['states', 'actions', 'rewards', 'is_terminal']:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        if 'buffer' in state:
+            self._migrate(state)
+            return
+        self.__dict__.update(state)
+        if self.directory is not None:
+            self._open_columns('r+')
+
+    # Refill an in-memory buffer from the header of a checkpoint written before the buffer was packed into columns,
+    # which holds the transitions as a list with location pointing at the oldest one once the list is full
+    def _migrate(self, state):
+        transitions = state['buffer'][state['location']:] + state['buffer'][:state['location']]
+        if not transitions:
+            raise ValueError("Checkpoint holds an empty list-based replay buffer from an older version of dqn.py, "
+                             "the number of input channels cannot be recovered from it")
+        self.__init__(state['buffer_size'], transitions[0].state.shape[1])
+        for t in transitions:
+            self.add(*t)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, next_state, action, reward, is_terminal):
+        # state and next_state are (1, in_channel, 10, 10) tensors as returned by get_state
+        self.states[self.location] = pack_state(state.cpu().numpy()[0], channels_first=True)
+        self.states[(self.location + 1) % self.num_rows] = pack_state(next_state.cpu().numpy()[0], channels_first=True)
+        self.actions[self.location] = action.item()
+        self.rewards[self.location] = reward.item()
+        self.is_terminal[self.location] = is_terminal.item()
+
+        # Increment the buffer location, the oldest transition is dropped once the buffer is full
+        self.location = (self.location + 1) % self.num_rows
+        self.size = min(self.size + 1, self.buffer_size)
+
+    def _allocate_batch(self, batch_size):
+        self.batch_size = batch_size
+        self.batch_index = numpy.zeros(batch_size, dtype=numpy.int64)
+        self.batch_next_index = numpy.zeros(batch_size, dtype=numpy.int64)
+        self.batch_packed = numpy.zeros((batch_size, self.states.shape[1]), dtype=numpy.uint8)
+        self.batch_states = numpy.zeros((batch_size, self.in_channels, 10, 10), dtype=numpy.float32)
+        self.batch_next_states = numpy.zeros((batch_size, self.in_channels, 10, 10), dtype=numpy.float32)
+        self.batch_actions = numpy.zeros((batch_size, 1), dtype=numpy.int64)
+        self.batch_rewards = numpy.zeros((batch_size, 1), dtype=numpy.float32)
+        self.batch_is_terminal = numpy.zeros((batch_size, 1), dtype=numpy.bool_)
+        self.batch_tensors = transition(*[torch.from_numpy(x) for x in [self.batch_states, self.batch_next_states,
+                                          self.batch_actions, self.batch_rewards, self.batch_is_terminal]])
+
+    # Draw the rows of batch_size transitions uniformly (with replacement) among the stored ones
+    def sample_index(self, batch_size):
+        age = numpy.random.randint(self.size, size=batch_size)
+        return (self.location - 1 - age) % self.num_rows
+
+    # Gather the transitions in the given rows into the reusable batch arrays and return them as a transition of
+    # tensors of size (batch_size, in_channel, 10, 10) for the states and (batch_size, 1) for the rest
+    def gather(self, index):
+        if self.batch_size != len(index):
+            self._allocate_batch(len(index))
+        self.batch_index[:] = index
+        numpy.add(self.batch_index, 1, out=self.batch_next_index)
+        self.batch_next_index[self.batch_next_index == self.num_rows] = 0
+        numpy.take(self.states, self.batch_index, axis=0, out=self.batch_packed)
+        unpack_state(self.batch_packed, self.in_channels, channels_first=True, out=self.batch_states)
+        numpy.take(self.states, self.batch_next_index, axis=0, out=self.batch_packed)
+        unpack_state(self.batch_packed, self.in_channels, channels_first=True, out=self.batch_next_states)
+        numpy.take(self.actions, self.batch_index, out=self.batch_actions[:, 0])
+        numpy.take(self.rewards, self.batch_index, out=self.batch_rewards[:, 0])
+        numpy.take(self.is_terminal, self.batch_index, out=self.batch_is_terminal[:, 0])
+        return transition(*[x.to(device) for x in self.batch_tensors])
 
-    def add(self, *args):
-        # Append when the buffer is not full but overwrite when the buffer is full
-        if len(self.buffer) < self.buffer_size:
-            self.buffer.append(transition(*args))
-        else:
-            self.buffer[self.location] = transition(*args)
+    def sample(self, batch_size):
+        return self.gather(self.sample_index(batch_size))
 
-        # Increment the buffer location
-        self.location = (self.location + 1) % self.buffer_size
 
-    def sample(self, batch_size):
-        return random.sample(self.buffer, batch_size)
+###########################################################################################################
+# class sum_min_tree
+#
+# Binary segment trees over capacity leaves stored as flat numpy arrays: node i has children 2i and 2i+1 and the
+# leaves start at index leaf_start.  sums holds the sum and mins the minimum (ignoring zero priorities) of the
+# leaves below every node.  Both update and find work on whole batches, one vectorized operation per tree level,
+# so they cost O(batch * log N).
+#
+###########################################################################################################
+class sum_min_tree:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.depth = max(int(numpy.ceil(numpy.log2(capacity))), 1)
+        self.leaf_start = 2 ** self.depth
+        self.sums = numpy.zeros(2 * self.leaf_start)
+        self.mins = numpy.full(2 * self.leaf_start, numpy.inf)
+
+    def total(self):
+        return self.sums[1]
+
+    def min(self):
+        return self.mins[1]
+
+    # Priorities of the given leaves
+    def get(self, index):
+        return self.sums[index + self.leaf_start]
+
+    # Set the priorities of the given leaves, with duplicate indices the last priority wins
+    def update(self, index, priority):
+        index = numpy.asarray(index)
+        priority = numpy.broadcast_to(numpy.asarray(priority, dtype=numpy.float64), index.shape)
+        index, last = numpy.unique(index[::-1], return_index=True)
+        priority = priority[::-1][last]
+        nodes = index + self.leaf_start
+        self.sums[nodes] = priority
+        self.mins[nodes] = numpy.where(priority > 0, priority, numpy.inf)
+        for level in range(self.depth):
+            # Duplicate parents are fine here since they all get the same value written
+            nodes = nodes // 2
+            self.sums[nodes] = self.sums[2 * nodes] + self.sums[2 * nodes + 1]
+            self.mins[nodes] = numpy.minimum(self.mins[2 * nodes], self.mins[2 * nodes + 1])
+
+    # For every value in [0, total) return the leaf where the running sum of priorities passes it
+    def find(self, values):
+        values = numpy.array(values, dtype=numpy.float64)
+        nodes = numpy.ones(len(values), dtype=numpy.int64)
+        for level in range(self.depth):
+            left = 2 * nodes
+            # Never descend into an empty subtree, which rounding in values close to total could otherwise cause
+            go_right = (values >= self.sums[left]) & (self.sums[left + 1] > 0)
+            values -= self.sums[left] * go_right
+            nodes = left + go_right
+        return nodes - self.leaf_start
+
+
+###########################################################################################################
+# class prioritized_replay_buffer
+#
+# replay_buffer with proportional prioritized sampling (Schaul et al. 2016).  Every row has priority p^alpha in a
+# sum_min_tree.  New transitions get the largest priority seen so far and the row past the cursor, whose state
+# belongs to the dropped oldest transition, gets priority 0 so it is never sampled.  sample draws one transition
+# from each of batch_size equal slices of the total priority and also returns importance-sampling weights,
+# normalized by the largest possible weight, and the sampled rows for update_priorities.
+#
+###########################################################################################################
+class prioritized_replay_buffer(replay_buffer):
+    def __init__(self, buffer_size, in_channels, directory=None, alpha=PRIORITY_ALPHA):
+        super(prioritized_replay_buffer, self).__init__(buffer_size, in_channels, directory)
+        self.alpha = alpha
+        self.max_priority = 1.0
+        self.tree = sum_min_tree(self.num_rows)
+
+    def add(self, *args):
+        row = self.location
+        super(prioritized_replay_buffer, self).add(*args)
+        self.tree.update(numpy.array([row, self.location]), numpy.array([self.max_priority ** self.alpha, 0.0]))
+
+    def sample(self, batch_size, beta=PRIORITY_BETA_START):
+        total = self.tree.total()
+        values = (numpy.arange(batch_size) + numpy.random.random_sample(batch_size)) * (total / batch_size)
+        index = self.tree.find(numpy.minimum(values, numpy.nextafter(total, 0)))
+        probabilities = self.tree.get(index) / total
+        weights = (self.size * probabilities) ** -beta
+        weights /= (self.size * self.tree.min() / total) ** -beta
+        weights = torch.from_numpy(weights.astype(numpy.float32)).view(-1, 1).to(device)
+        return self.gather(index), weights, index
+
+    # Set the priorities of the sampled rows from their new absolute TD errors
+    def update_priorities(self, index, td_errors):
+        priorities = numpy.abs(td_errors) + PRIORITY_EPSILON
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(index, priorities ** self.alpha)
 
 
 ################################################################################################################
 # get_state
 #
-# Converts the state given by the environment to a tensor of size (in_channel, 10, 10), and then
-# unsqueeze to expand along the 0th dimension so the function returns a tensor of size (1, in_channel, 10, 10).
+# Writes the current state of the environment directly into a new float32 tensor of size (1, in_channel, 10, 10),
+# channel first as expected by the network, without building an intermediate numpy array.
 #
 # Input:
-#   s: current state as numpy array
+#   env: environment to take the current state from
 #
-# Output: current state as tensor, permuted to match expected dimensions
+# Output: current state as tensor
 #
 ################################################################################################################
-def get_state(s):
-    return (torch.tensor(s, device=device).permute(2, 0, 1)).unsqueeze(0).float()
+def get_state(env):
+    s = torch.empty(1, env.state_shape()[2], 10, 10)
+    env.state(out=s.numpy()[0], channels_first=True)
+    return s.to(device)
 
 
 ################################################################################################################
@@ -184,7 +400,7 @@ def world_dynamics(t, replay_start_size, num_actions, s, env, policy_net):
     reward, terminated = env.act(action)
 
     # Obtain s_prime
-    s_prime = get_state(env.state())
+    s_prime = get_state(env)
 
     return s_prime, action, torch.tensor([[reward]], device=device).float(), torch.tensor([[terminated]], device=device)
 
@@ -196,23 +412,19 @@ def world_dynamics(t, replay_start_size, num_actions, s, env, policy_net):
 # using huber loss.
 #
 # Inputs:
-#   sample: a batch of size 1 or 32 transitions
+#   sample: a transition of batched tensors, holding 1 or 32 transitions
 #   policy_net: an instance of QNetwork
 #   target_net: an instance of QNetwork
 #   optimizer: centered RMSProp
+#   weights: importance-sampling weights of the transitions of size (BATCH_SIZE, 1), or None
+#
+# Output: absolute TD errors of the transitions, of size (BATCH_SIZE, 1)
 #
 ################################################################################################################
-def train(sample, policy_net, target_net, optimizer):
-    # Batch is a list of namedtuple's, the following operation returns samples grouped by keys
-    batch_samples = transition(*zip(*sample))
-
+def train(sample, policy_net, target_net, optimizer, weights=None):
     # states, next_states are of tensor (BATCH_SIZE, in_channel, 10, 10) - inline with pytorch NCHW format
     # actions, rewards, is_terminal are of tensor (BATCH_SIZE, 1)
-    states = torch.cat(batch_samples.state)
-    next_states = torch.cat(batch_samples.next_state)
-    actions = torch.cat(batch_samples.action)
-    rewards = torch.cat(batch_samples.reward)
-    is_terminal = torch.cat(batch_samples.is_terminal)
+    states, next_states, actions, rewards, is_terminal = sample
 
     # Obtain a batch of Q(S_t, A_t) and compute the forward pass.
     # Note: policy_network output Q-values for all the actions of a state, but all we need is the A_t taken at time t
@@ -226,25 +438,30 @@ def train(sample, policy_net, target_net, optimizer):
     # to prevent the computation of its gradient automatically.  Q_s_prime_a_prime is of size (BATCH_SIZE, 1).
 
     # Get the indices of next_states that are not terminal
-    none_terminal_next_state_index = torch.tensor([i for i, is_term in enumerate(is_terminal) if is_term == 0], dtype=torch.int64, device=device)
+    none_terminal_next_state_index = torch.nonzero(is_terminal.view(-1) == 0).view(-1)
     # Select the indices of each row
     none_terminal_next_states = next_states.index_select(0, none_terminal_next_state_index)
 
-    Q_s_prime_a_prime = torch.zeros(len(sample), 1, device=device)
+    Q_s_prime_a_prime = torch.zeros(len(states), 1, device=device)
     if len(none_terminal_next_states) != 0:
         Q_s_prime_a_prime[none_terminal_next_state_index] = target_net(none_terminal_next_states).detach().max(1)[0].unsqueeze(1)
 
     # Compute the target
     target = rewards + GAMMA * Q_s_prime_a_prime
 
-    # Huber loss
-    loss = f.smooth_l1_loss(target, Q_s_a)
+    # Huber loss, weighted per transition for prioritized replay
+    if weights is None:
+        loss = f.smooth_l1_loss(target, Q_s_a)
+    else:
+        loss = (weights * f.smooth_l1_loss(target, Q_s_a, reduction='none')).mean()
 
     # Zero gradients, backprop, update the weights of policy_net
     optimizer.zero_grad()
     loss.backward()
     optimizer.step()
 
+    return (target - Q_s_a).detach().abs()
+
 
 ################################################################################################################
 # dqn
@@ -261,9 +478,12 @@ def train(sample, policy_net, target_net, optimizer):
 #       to a file named <output_file_name>_checkpoint
 #   load_path: file path for a checkpoint to load, and continue training from
 #   step_size: step-size for RMSProp optimizer
+#   replay_dir: directory for a memory-mapped replay buffer, None keeps the buffer in memory
+#   prioritized: use prioritized experience replay, with beta annealed linearly to 1 over NUM_FRAMES
 #
 #################################################################################################################
-def dqn(env, replay_off, target_off, output_file_name, store_intermediate_result=False, load_path=None, step_size=STEP_SIZE):
+def dqn(env, replay_off, target_off, output_file_name, store_intermediate_result=False, load_path=None, step_size=STEP_SIZE,
+        replay_dir=None, prioritized=False):
 
     # Get channels and number of actions specific to each game
     in_channels = env.state_shape()[2]
@@ -276,8 +496,8 @@ def dqn(env, replay_off, target_off, output_file_name, store_intermediate_result
         target_net = QNetwork(in_channels, num_actions).to(device)
         target_net.load_state_dict(policy_net.state_dict())
 
+    r_buffer = None
     if not replay_off:
-        r_buffer = replay_buffer(REPLAY_BUFFER_SIZE)
         replay_start_size = REPLAY_START_SIZE
 
     optimizer = optim.RMSprop(policy_net.parameters(), lr=step_size, alpha=SQUARED_GRAD_MOMENTUM, centered=True, eps=MIN_SQUARED_GRAD)
@@ -299,7 +519,13 @@ def dqn(env, replay_off, target_off, output_file_name, store_intermediate_result
             target_net.load_state_dict(checkpoint['target_net_state_dict'])
 
         if not replay_off:
+            # A memory-mapped buffer is reopened from the directory it was created in
             r_buffer = checkpoint['replay_buffer']
+            buffer_class = prioritized_replay_buffer if prioritized else replay_buffer
+            if type(r_buffer) is not buffer_class:
+                raise ValueError("Checkpoint " + load_path + " holds a " + type(r_buffer).__name__ + " as replay "
+                                 "buffer but this run uses a " + buffer_class.__name__ + ", resume with the "
+                                 "--prioritized and --replayoff settings the checkpoint was written with")
 
         optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
         e_init = checkpoint['episode']
@@ -314,6 +540,14 @@ def dqn(env, replay_off, target_off, output_file_name, store_intermediate_result
         if not target_off:
             target_net.train()
 
+    # Create the replay buffer unless it was restored from the checkpoint.  This comes after loading since creating a
+    # memory-mapped buffer truncates the files in replay_dir.
+    if not replay_off and r_buffer is None:
+        if prioritized:
+            r_buffer = prioritized_replay_buffer(REPLAY_BUFFER_SIZE, in_channels, replay_dir)
+        else:
+            r_buffer = replay_buffer(REPLAY_BUFFER_SIZE, in_channels, replay_dir)
+
     # Data containers for performance measure and model related data
     data_return = data_return_init
     frame_stamp = frame_stamp_init
@@ -330,31 +564,39 @@ def dqn(env, replay_off, target_off, output_file_name, store_intermediate_result
 
         # Initialize the environment and start state
         env.reset()
-        s = get_state(env.state())
+        s = get_state(env)
         is_terminated = False
         while(not is_terminated) and t < NUM_FRAMES:
             # Generate data
             s_prime, action, reward, is_terminated = world_dynamics(t, replay_start_size, num_actions, s, env, policy_net)
 
             sample = None
+            weights = None
             if replay_off:
-                sample = [transition(s, s_prime, action, reward, is_terminated)]
+                sample = transition(s, s_prime, action, reward, is_terminated)
             else:
                 # Write the current frame to replay buffer
                 r_buffer.add(s, s_prime, action, reward, is_terminated)
 
                 # Start learning when there's enough data and when we can sample a batch of size BATCH_SIZE
-                if t > REPLAY_START_SIZE and len(r_buffer.buffer) >= BATCH_SIZE:
+                if t > REPLAY_START_SIZE and len(r_buffer) >= BATCH_SIZE:
                     # Sample a batch
-                    sample = r_buffer.sample(BATCH_SIZE)
+                    if prioritized:
+                        beta = PRIORITY_BETA_START + (1.0 - PRIORITY_BETA_START) * t / NUM_FRAMES
+                        sample, weights, sample_index = r_buffer.sample(BATCH_SIZE, beta)
+                    else:
+                        sample = r_buffer.sample(BATCH_SIZE)
 
             # Train every n number of frames defined by TRAINING_FREQ
             if t % TRAINING_FREQ == 0 and sample is not None:
                 if target_off:
-                    train(sample, policy_net, policy_net, optimizer)
+                    td_errors = train(sample, policy_net, policy_net, optimizer, weights)
                 else:
                     policy_net_update_counter += 1
-                    train(sample, policy_net, target_net, optimizer)
+                    td_errors = train(sample, policy_net, target_net, optimizer, weights)
+
+                if weights is not None:
+                    r_buffer.update_priorities(sample_index, td_errors.cpu().numpy()[:, 0])
 
             # Update the target network only after some number of policy network updates
             if not target_off and policy_net_update_counter > 0 and policy_net_update_counter % TARGET_NETWORK_UPDATE_FREQ == 0:
@@ -416,6 +658,8 @@ def main():
     parser.add_argument("--save", "-s", action="store_true")
     parser.add_argument("--replayoff", "-r", action="store_true")
     parser.add_argument("--targetoff", "-t", action="store_true")
+    parser.add_argument("--replaydir", "-d", type=str)
+    parser.add_argument("--prioritized", "-p", action="store_true")
     args = parser.parse_args()
 
     if args.verbose:
@@ -435,7 +679,8 @@ def main():
     env = Environment(args.game)
 
     print('Cuda available?: ' + str(torch.cuda.is_available()))
-    dqn(env, args.replayoff, args.targetoff, file_name, args.save, load_file_path, args.alpha)
+    dqn(env, args.replayoff, args.targetoff, file_name, args.save, load_file_path, args.alpha, args.replaydir,
+        args.prioritized)
 
 
 if __name__ == '__main__':
@@ -5,50 +5,41 @@
 #                                                                                                              #
 # python3 random_play.py -g <game>                                                                             #                                                              #
 ################################################################################################################
-import random, numpy, argparse
-from minatar import Environment
+import numpy, argparse
+from minatar import VecEnvironment
 
 NUM_EPISODES = 1000
+NUM_ENVS = 20
+# Every game contributes the same number of episodes, taking whichever episodes finish first across the batch would
+# favour short episodes and bias the average return
+EPISODES_PER_ENV = NUM_EPISODES//NUM_ENVS
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--game", "-g", type=str)
 args = parser.parse_args()
 
-env = Environment(args.game)
+# Finished games are reset inside step, so the loop below never has to handle an episode boundary itself
+env = VecEnvironment(args.game, NUM_ENVS, auto_reset=True)
 
-e = 0
 returns = []
+episode_counts = numpy.zeros(NUM_ENVS, dtype=int)
 num_actions = env.num_actions()
+rng = numpy.random.default_rng()
 
-# Run NUM_EPISODES episodes and log all returns
-while e < NUM_EPISODES:
-    # Initialize the return for every episode
-    G = 0.0
+#Obtain first states, unused by random agent, but inluded for illustration
+s = env.reset()
 
-    # Initialize the environment
-    env.reset()
-    terminated = False
+# Run until every game has finished EPISODES_PER_ENV episodes and log their returns
+while (episode_counts < EPISODES_PER_ENV).any():
+    # Select an action uniformly at random for every game
+    actions = rng.integers(num_actions, size=NUM_ENVS)
 
-    #Obtain first state, unused by random agent, but inluded for illustration
-    s = env.state()
-    while(not terminated):
-        # Select an action uniformly at random
-        action = random.randrange(num_actions)
+    # Act according to the actions and observe the transitions and rewards. s_prime holds the start states of the new
+    # episodes of games that just terminated, the last states of the finished episodes are in env.final_observations.
+    s_prime, rewards, terminated = env.step(actions)
 
-        # Act according to the action and observe the transition and reward
-        reward, terminated = env.act(action)
-
-        # Obtain s_prime, unused by random agent, but inluded for illustration
-        s_prime = env.state()
-
-        G += reward
-
-    # Increment the episodes
-    e += 1
-
-    # Store the return for each episode
-    returns.append(G)
+    # Store the return of each episode that just finished in a game that has not reached its quota yet
+    returns.extend(env.episode_returns[terminated & (episode_counts < EPISODES_PER_ENV)])
+    episode_counts += terminated
 
 print("Avg Return: " + str(numpy.mean(returns))+"+/-"+str(numpy.std(returns)/numpy.sqrt(NUM_EPISODES)))
-
-
@@ -1 +1,19 @@
-from .environment import Environment
+from .environment import Environment, EnvironmentPool
+from .vec_environment import VecEnvironment
+from .packing import pack_state, unpack_state, packed_size
+from .replay import Replay
+
+# Classes whose modules pull in multiprocessing or threading, which are only needed by code that actually starts
+# worker processes or records to disk, so they are imported on first access rather than with the package
+lazy_imports = {
+    'SubprocVecEnvironment': 'subproc_vec_environment',
+    'Recorder': 'recording',
+    'RecordingReader': 'recording',
+}
+
+
+def __getattr__(name):
+    if(name in lazy_imports):
+        from importlib import import_module
+        return getattr(import_module('.'+lazy_imports[name], __name__), name)
+    raise AttributeError('module '+repr(__name__)+' has no attribute '+repr(name))
@@ -0,0 +1,210 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+#                                                                                                              #
+# minatar-benchmark [-g <game> ...]                                                                            #
+#   -f, --frames <number>: frames per trial                                                                    #
+#   -t, --trials <number>: number of timed trials                                                              #
+#   -w, --warmup <number>: untimed frames played before the trials                                             #
+#   -s, --seed <number>: seed for the environments and the random policy                                       #
+#   -n, --num-envs <number>: number of instances stepped by VecEnvironment                                     #
+#   -o, --output <file>: write the JSON results to this file instead of stdout                                 #
+#   -i, --import-trials <number>: number of fresh interpreters in which the import time is measured            #
+#   -b, --import-budget <seconds>: exit with status 1 if importing numpy and minatar takes longer than this    #
+#   --import-only: only measure the import time                                                                #
+################################################################################################################
+import argparse, json, platform, subprocess, sys, time
+import numpy as np
+
+from minatar.environment import Environment
+from minatar.vec_environment import VecEnvironment
+
+GAMES = ['asterix', 'breakout', 'freeway', 'seaquest', 'space_invaders']
+
+# Default limit in seconds on the cold start time of import minatar, including NumPy
+IMPORT_BUDGET = 0.5
+
+# Modules that the core package must not import, they belong to the optional extras or are only needed on demand
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'pandas', 'scipy', 'torch', 'multiprocessing', 'tkinter']
+
+# Run in a fresh interpreter, prints the time to import numpy, the time to import minatar on top of it and the heavy
+# modules that ended up imported
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import numpy
+middle = time.perf_counter()
+import minatar
+end = time.perf_counter()
+print(middle-start, end-middle, ','.join(m for m in %r if m in sys.modules))
+''' % (HEAVY_MODULES,)
+
+# Number of object slots per channel used when timing continuous_state_array, enough for a full wall of bricks
+MAX_OBJECTS = 32
+
+# Operations timed per frame of a single Environment, each is called once per frame of a random rollout
+OPERATIONS = {
+    'act': None,
+    'state': lambda env, snapshot: env.state(),
+    'continuous_state': lambda env, snapshot: env.continuous_state(),
+    'continuous_state_array': lambda env, snapshot: env.continuous_state_array(MAX_OBJECTS),
+    'save_state': lambda env, snapshot: env.save_state(),
+    'load_state': lambda env, snapshot: env.load_state(snapshot['string']),
+    'save_state_binary': lambda env, snapshot: env.save_state(binary=True),
+    'load_state_binary': lambda env, snapshot: env.load_state(snapshot['binary']),
+    'clone': lambda env, snapshot: env.clone(),
+    'restore': lambda env, snapshot: env.restore(snapshot['clone']),
+}
+
+
+#####################################################################################################################
+# run_trial
+#
+# Play frames frames of env with the given actions (resetting on termination) and accumulate the wall time of every
+# operation. Each call is timed separately with time.perf_counter, which adds a constant overhead of roughly a tenth
+# of a microsecond per call to every measurement. Returns the frames per second of every operation.
+#
+#####################################################################################################################
+def run_trial(env, actions):
+    clock = time.perf_counter
+    totals = dict.fromkeys(OPERATIONS, 0.0)
+    snapshot = {}
+    for a in actions:
+        start = clock()
+        _, terminal = env.act(a)
+        totals['act'] += clock()-start
+        snapshot['string'] = env.save_state()
+        snapshot['binary'] = env.save_state(binary=True)
+        snapshot['clone'] = env.clone()
+        for name, op in OPERATIONS.items():
+            if(op is None):
+                continue
+            start = clock()
+            op(env, snapshot)
+            totals[name] += clock()-start
+        if(terminal):
+            env.reset()
+    return {name: len(actions)/total for name, total in totals.items()}
+
+
+# Frames per second of VecEnvironment.step over one trial, counting every instance
+def run_vec_trial(env, actions):
+    start = time.perf_counter()
+    for a in actions:
+        _, _, terminals = env.step(a)
+        if(terminals.any()):
+            env.reset(terminals)
+    return actions.size/(time.perf_counter()-start)
+
+
+# Mean, standard deviation and best of the frames per second of a list of trials
+def summarize(fps):
+    fps = np.array(fps)
+    return {'fps_mean': float(fps.mean()), 'fps_std': float(fps.std()), 'fps_max': float(fps.max()),
+            'trials': [float(x) for x in fps]}
+
+
+#####################################################################################################################
+# benchmark_game
+#
+# Benchmark a single game under a uniform random policy with fixed seeds, so repeated runs (e.g. on different
+# commits) play the same frames. Returns a dictionary mapping every operation to its summarized frames per second.
+#
+#####################################################################################################################
+def benchmark_game(game, frames=2000, trials=5, warmup=200, seed=0, num_envs=64):
+    rng = np.random.RandomState(seed)
+    env = Environment(game, random_seed=seed)
+    run_trial(env, rng.randint(6, size=warmup))
+    fps = {name: [] for name in OPERATIONS}
+    for _ in range(trials):
+        for name, value in run_trial(env, rng.randint(6, size=frames)).items():
+            fps[name].append(value)
+    results = {name: summarize(values) for name, values in fps.items()}
+
+    if(num_envs>0):
+        vec_env = VecEnvironment(game, num_envs, random_seed=seed)
+        steps = max(frames//num_envs, 1)
+        run_vec_trial(vec_env, rng.randint(6, size=(max(warmup//num_envs, 1), num_envs)))
+        results['vec_step'] = summarize([run_vec_trial(vec_env, rng.randint(6, size=(steps, num_envs)))
+                                         for _ in range(trials)])
+        results['vec_step']['num_envs'] = num_envs
+        results['vec_step']['engine'] = vec_env.engine
+    return results
+
+
+#####################################################################################################################
+# import_time
+#
+# Measure the cold start of import minatar in trials fresh interpreters, split into the time spent importing NumPy and
+# the time spent in minatar itself. Only the best trial is compared against a budget, since the others mostly measure
+# how busy the machine is. Also lists the heavy modules that the import pulled in, which should be none.
+#
+#####################################################################################################################
+def import_time(trials=5):
+    numpy_times, minatar_times, heavy = [], [], set()
+    for _ in range(trials):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True).stdout.split()
+        numpy_times.append(float(output[0]))
+        minatar_times.append(float(output[1]))
+        if(len(output)>2):
+            heavy.update(output[2].split(','))
+    total = np.add(numpy_times, minatar_times)
+    return {'total_min': float(total.min()), 'total_mean': float(total.mean()),
+            'numpy_min': float(min(numpy_times)), 'minatar_min': float(min(minatar_times)),
+            'heavy_modules': sorted(heavy), 'trials': [float(x) for x in total]}
+
+
+# Benchmark every game in games and return the results with the settings and platform they were measured on
+def run(games=GAMES, frames=2000, trials=5, warmup=200, seed=0, num_envs=64, import_trials=5):
+    results = {
+        'settings': {'frames': frames, 'trials': trials, 'warmup': warmup, 'seed': seed, 'num_envs': num_envs,
+                     'import_trials': import_trials},
+        'platform': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                     'processor': platform.processor(), 'system': platform.platform()},
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'games': {},
+    }
+    if(import_trials>0):
+        results['import'] = import_time(import_trials)
+    for game in games:
+        results['games'][game] = benchmark_game(game, frames, trials, warmup, seed, num_envs)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the frames per second of the MinAtar games.')
+    parser.add_argument("--games", "-g", type=str, nargs='+', default=GAMES, choices=GAMES)
+    parser.add_argument("--frames", "-f", type=int, default=2000)
+    parser.add_argument("--trials", "-t", type=int, default=5)
+    parser.add_argument("--warmup", "-w", type=int, default=200)
+    parser.add_argument("--seed", "-s", type=int, default=0)
+    parser.add_argument("--num-envs", "-n", type=int, default=64)
+    parser.add_argument("--output", "-o", type=str)
+    parser.add_argument("--import-trials", "-i", type=int, default=5)
+    parser.add_argument("--import-budget", "-b", type=float)
+    parser.add_argument("--import-only", action="store_true")
+    args = parser.parse_args()
+
+    games = [] if args.import_only else args.games
+    results = run(games, args.frames, args.trials, args.warmup, args.seed, args.num_envs, max(args.import_trials, 1))
+    if(args.output):
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    # The import budget is only enforced when asked for, so that a throughput run does not fail on import timing noise
+    budget = args.import_budget
+    if(budget is None and args.import_only):
+        budget = IMPORT_BUDGET
+    timing = results['import']
+    if(budget is not None and timing['total_min']>budget):
+        sys.stderr.write('import minatar took %.3fs, over the budget of %.3fs\n' % (timing['total_min'], budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
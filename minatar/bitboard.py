@@ -0,0 +1,71 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import numpy as np
+
+
+#####################################################################################################################
+# Bitboards
+#
+# A 10x10 map stored as a Python int of 100 bits, cell (y,x) is bit 10*y+x. Moving every cell one row down or up is a
+# shift by 10, one column right or left a shift by 1 with the cells that cross the edge masked out, and counts and
+# membership tests are popcounts and ands. On a grid this small the bit operations cost far less than the call
+# overhead of the equivalent NumPy operations on 100 element arrays.
+#
+#####################################################################################################################
+full = (1<<100)-1
+row_masks = [((1<<10)-1)<<(10*y) for y in range(10)]
+col_masks = [sum(1<<(10*y+x) for y in range(10)) for x in range(10)]
+
+# Number of set bits, int.bit_count is only available from Python 3.10
+if(hasattr(int, 'bit_count')):
+    popcount = int.bit_count
+else:
+    def popcount(bits):
+        return bin(bits).count('1')
+
+
+# Mask of the cells in rows [y0,y1) and columns [x0,x1)
+def rect(y0, y1, x0, x1):
+    return sum(1<<(10*y+x) for y in range(y0, y1) for x in range(x0, x1))
+
+
+# Bitboard of the nonzero cells of a 10x10 array
+def to_bits(array):
+    packed = np.packbits(np.asarray(array).reshape(100)!=0, bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+# Stack of the given bitboards as an nx10x10 uint8 array of zeros and ones, converted with a single unpackbits
+def to_planes(boards):
+    data = b''.join(bits.to_bytes(13, 'little') for bits in boards)
+    packed = np.frombuffer(data, dtype=np.uint8).reshape(len(boards),13)
+    return np.unpackbits(packed, axis=1, count=100, bitorder='little').reshape(len(boards),10,10)
+
+
+# 10x10 array of the given dtype with ones at the set bits of bits
+def to_array(bits, dtype=float):
+    return to_planes([bits])[0].astype(dtype)
+
+
+# (x,y) coordinates of the set bits in row major order
+def cells(bits):
+    result = []
+    while(bits):
+        low = bits&-bits
+        i = low.bit_length()-1
+        result.append((i%10, i//10))
+        bits ^= low
+    return result
+
+
+# Update channel c of flat, a flattened 10x10xn array whose channel c shows the bitboard old, to show new instead by
+# writing only the cells where the two differ
+def paint_changes(flat, n, c, old, new):
+    changed = old^new
+    while(changed):
+        low = changed&-changed
+        flat[(low.bit_length()-1)*n+c] = (new&low)!=0
+        changed ^= low
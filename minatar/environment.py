@@ -3,8 +3,13 @@
 # Kenny Young (kjyoung@ualberta.ca)                                                                            #
 # Tian Tian (ttian@ualberta.ca)                                                                                #
 ################################################################################################################
-from importlib import import_module
 import numpy as np
+from minatar.environments import load_game
+from minatar.snapshot import is_snapshot, pack_snapshot, unpack_snapshot, pcg64_to_ints, ints_to_pcg64
+from minatar.profiling import PhaseTimer
+
+# Number of uniform samples drawn at once for deciding sticky actions
+sticky_block_size = 256
 
 
 #####################################################################################################################
@@ -13,32 +18,121 @@ import numpy as np
 # Wrapper for all the specific game environments. Imports the environment specified by the user and then acts as a
 # minimal interface. Also defines code for displaying the environment for a human user. 
 #
+# Sticky actions are decided by the environment's own generator (np.random.default_rng(random_seed)), drawn
+# sticky_block_size samples at a time, so random_seed fully determines the trajectory for a given action sequence.
+#
+# With incremental_state=True the environment keeps a persistent observation array that act updates by writing only the
+# cells that changed, and state returns a read-only view of it instead of rebuilding it. This needs a game that tracks
+# its changes, which the bitboard backend does. state_is_consistent compares the array against a full rebuild.
+#
+# backend selects the implementation of the game. 'numpy' is the reference Env of every game, 'bitboard' is the
+# BitboardEnv of breakout and space_invaders which holds the 10x10 maps as 100 bit integers (see minatar.bitboard).
+# Both play identically and their states and snapshots are interchangeable.
+#
+# With profile=True the game accumulates wall time and call counts per phase of act and state (see
+# minatar.profiling), which are read with profile_stats.
+#
 #####################################################################################################################
 class Environment:
-    def __init__(self, env_name, sticky_action_prob = 0.1, difficulty_ramping = True, random_seed = None):
-        env_module = import_module('minatar.environments.'+env_name)
+    def __init__(self, env_name, sticky_action_prob = 0.1, difficulty_ramping = True, random_seed = None,
+                 incremental_state = False, profile = False, backend = 'numpy'):
+        env_module = load_game(env_name)
+        if(backend=='numpy'):
+            env_class = env_module.Env
+        elif(backend=='bitboard' and hasattr(env_module, 'BitboardEnv')):
+            env_class = env_module.BitboardEnv
+        else:
+            raise ValueError('Backend '+repr(backend)+' is not available for '+env_name)
         self.env_name = env_name
-        self.env = env_module.Env(ramping = difficulty_ramping, seed = random_seed)
+        self.backend = backend
+        self.env = env_class(ramping = difficulty_ramping, seed = random_seed)
         self.n_channels = self.env.state_shape()[2]
         self.sticky_action_prob = sticky_action_prob
         self.last_action = 0
+        self.sticky_random = np.random.default_rng(random_seed)
+        self._draw_sticky_block()
         self.visualized = False
         self.closed = False
+        if(profile):
+            self.env.timer = PhaseTimer()
+        self.observation = None
+        if(incremental_state):
+            if(not hasattr(self.env, '_paint_changes')):
+                raise ValueError('incremental_state is not available for the '+backend+' backend of '+env_name)
+            self.observation = np.zeros(self.env.state_shape(), dtype=bool)
+            self.observation_flat = self.observation.reshape(-1)
+            self.observation_view = self.observation.view()
+            self.observation_view.flags.writeable = False
+            self._rebuild_state()
+
+    # Draw the next block of samples for sticky action decisions. If block_state is given the generator is first set
+    # to it, which reproduces the block that was drawn from that state.
+    def _draw_sticky_block(self, block_state=None):
+        if(block_state is None):
+            block_state = self.sticky_random.bit_generator.state
+        else:
+            self.sticky_random.bit_generator.state = block_state
+        self.sticky_block_state = block_state
+        # The block state as snapshot ints, which only changes with the block
+        self.sticky_block_ints = tuple(pcg64_to_ints(block_state))
+        self.sticky_draws = self.sticky_random.random(sticky_block_size).tolist()
+        self.sticky_index = 0
 
     # Wrapper for env.act
     def act(self, a):
-        if(np.random.rand()<self.sticky_action_prob):
+        if(self.sticky_index==sticky_block_size):
+            self._draw_sticky_block()
+        sticky = self.sticky_draws[self.sticky_index]<self.sticky_action_prob
+        self.sticky_index += 1
+        if(sticky):
             a = self.last_action
         self.last_action = a
-        return self.env.act(a)
+        if(self.observation is None):
+            return self.env.act(a)
+        result = self.env.act(a)
+        self.env._paint_changes(self.observation_flat)
+        return result
+
+    # Wrapper for env.state. If out is given the state is written into it in place and out is returned. out can have
+    # any numeric dtype and shape 10x10xn, or nx10x10 if channels_first is True, e.g. a float32 array obtained from a
+    # torch tensor with .numpy().
+    def state(self, out=None, channels_first=False):
+        if(self.observation is not None):
+            if(out is None):
+                return self.observation_view.transpose(2,0,1) if channels_first else self.observation_view
+            np.copyto(out.transpose(1,2,0) if channels_first else out, self.observation)
+            return out
+        if(out is None):
+            state = self.env.state()
+            return state.transpose(2,0,1) if channels_first else state
+        self.env.state(out=out.transpose(1,2,0) if channels_first else out)
+        return out
 
-    # Wrapper for env.state
-    def state(self):
-        return self.env.state()
+    # True unless the incrementally maintained observation differs from a full rebuild of the state
+    def state_is_consistent(self):
+        return self.observation is None or np.array_equal(self.observation, self.env.state())
+
+    # Repaint the incrementally maintained observation from scratch after the game-state was replaced
+    def _rebuild_state(self):
+        if(self.observation is not None):
+            self.env._repaint(self.observation)
 
     # Wrapper for env.reset
     def reset(self):
-        return self.env.reset()
+        self.env.reset()
+        self._rebuild_state()
+
+    # Per phase timings of the game as a dictionary mapping phase names to total time in seconds, number of calls and
+    # mean time per call, None unless the environment was created with profile=True
+    def profile_stats(self):
+        if(self.env.timer is None):
+            return None
+        return self.env.timer.stats()
+
+    # Discard the timings accumulated so far
+    def reset_profile(self):
+        if(self.env.timer is not None):
+            self.env.timer.reset()
 
     # Wrapper for env.state_shape
     def state_shape(self):
@@ -91,17 +185,93 @@ class Environment:
 
     def continuous_state(self):
         return self.env.continuous_state()
+
+    # Wrapper for env.continuous_state_array, the objects of continuous_state as float32 coordinates of shape
+    # (n,max_objects,2) and a boolean mask of shape (n,max_objects) marking the slots in use (see minatar.objects)
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        return self.env.continuous_state_array(max_objects, coords, mask)
         
+    # Return an in-memory copy of the environment state (including last_action and the RNG states of the game and of
+    # the sticky actions) for restore, without going through save_state's string or binary formats
+    def clone(self):
+        return (self.last_action, self.env.clone(), self.sticky_block_state, self.sticky_index)
+
+    # Restore a copy returned by clone, the same copy can be restored any number of times
+    def restore(self, snapshot):
+        self.last_action, env_snapshot, block_state, sticky_index = snapshot
+        self.env.restore(env_snapshot)
+        if(block_state is not self.sticky_block_state):
+            self._draw_sticky_block(block_state)
+        self.sticky_index = sticky_index
+        self._rebuild_state()
+
     # Return a string that represents the current state of the environment
     # (Not including the RNG state)
-    def save_state(self):
+    # If binary is True, instead return a compact binary snapshot (see minatar.snapshot) which also includes the RNG
+    # states of the game and of the sticky actions, so that loading it reproduces the same trajectory given the same
+    # actions.
+    def save_state(self, binary=False):
+        if(binary):
+            ints = (self.last_action, self.sticky_index)+self.sticky_block_ints
+            return pack_snapshot(b'E', ints) + self.env.save_state(binary=True)
         return self.env.save_state() + ";" + str(self.last_action)
 
     # Take a string once returned by save_state and restore that state
     # Because RNG state is not restored, behavior will not necessarily be
     # the same every time the same state is loaded.
     # This means this function is suitable for planning using rollouts.
+    # Binary snapshots from save_state(binary=True) are also accepted and restore the RNG state exactly.
     def load_state(self, state_str):
-        spStr = state_str.split(";")
-        self.last_action = int(spStr[1])
-        self.env.load_state(spStr[0])
+        if(is_snapshot(state_str)):
+            ints, _, offset = unpack_snapshot(b'E', state_str)
+            self.last_action = ints[0]
+            if(ints[2:]!=self.sticky_block_ints):
+                self._draw_sticky_block(ints_to_pcg64(ints[2:]))
+            self.sticky_index = ints[1]
+            self.env.load_state(state_str[offset:])
+        else:
+            spStr = state_str.split(";")
+            self.last_action = int(spStr[1])
+            self.env.load_state(spStr[0])
+        self._rebuild_state()
+
+
+#####################################################################################################################
+# EnvironmentPool
+#
+# Preallocated set of Environments of one game for tree search and rollout planning. Instead of constructing a new
+# Environment for every branch, acquire one from the pool (optionally restored to a snapshot returned by clone) and
+# release it when the branch is done. If the pool runs dry it grows by one Environment.
+#
+#####################################################################################################################
+class EnvironmentPool:
+    def __init__(self, env_name, size, sticky_action_prob = 0.1, difficulty_ramping = True, random_seed = None,
+                 backend = 'numpy'):
+        self.env_name = env_name
+        self.backend = backend
+        self.sticky_action_prob = sticky_action_prob
+        self.difficulty_ramping = difficulty_ramping
+        self.random_seed = random_seed
+        self.num_created = 0
+        self.free = [self._make() for _ in range(size)]
+
+    def _make(self):
+        seed = None if self.random_seed is None else self.random_seed+self.num_created
+        self.num_created += 1
+        return Environment(self.env_name, sticky_action_prob = self.sticky_action_prob,
+                           difficulty_ramping = self.difficulty_ramping, random_seed = seed, backend = self.backend)
+
+    # Take an Environment out of the pool, restored to snapshot if one is given
+    def acquire(self, snapshot=None):
+        env = self.free.pop() if self.free else self._make()
+        if(snapshot is not None):
+            env.restore(snapshot)
+        return env
+
+    # Return an Environment obtained from acquire to the pool
+    def release(self, env):
+        self.free.append(env)
+
+    # Number of Environments currently available without growing the pool
+    def __len__(self):
+        return len(self.free)
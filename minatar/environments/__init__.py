@@ -1 +1,24 @@
-from . import *
\ No newline at end of file
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+from . import asterix, breakout, freeway, seaquest, space_invaders
+
+# Registry of the game modules by name. Every module is imported once with the package, so creating an environment
+# (or a worker process building its own) is a dictionary lookup rather than a call to import_module.
+games = {
+    'asterix': asterix,
+    'breakout': breakout,
+    'freeway': freeway,
+    'seaquest': seaquest,
+    'space_invaders': space_invaders,
+}
+
+
+# Module of the game called env_name
+def load_game(env_name):
+    try:
+        return games[env_name]
+    except KeyError:
+        raise ValueError('Unknown MinAtar game '+repr(env_name)+', expected one of '+', '.join(sorted(games))) from None
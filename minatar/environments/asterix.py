@@ -4,6 +4,8 @@
 # Tian Tian (ttian@ualberta.ca)                                                                                #
 ################################################################################################################
 import numpy as np
+from minatar.objects import object_arrays, put_object, scatter_objects
+from minatar.snapshot import is_snapshot, pack_snapshot, unpack_snapshot, rng_state, set_rng_state
 
 
 #####################################################################################################################
@@ -36,6 +38,7 @@ class Env:
         self.action_map = ['n','l','u','r','d','f']
         self.ramping = ramping
         self.random = np.random.RandomState(seed)
+        self.timer = None
         self.reset()
 
     # Update environment according to agent action
@@ -43,6 +46,10 @@ class Env:
         r = 0
         if(self.terminal):
             return r, self.terminal
+
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
             
         a = self.action_map[a]
 
@@ -50,6 +57,8 @@ class Env:
         if(self.spawn_timer==0):
             self._spawn_entity()
             self.spawn_timer = self.spawn_speed
+        if(timer is not None):
+            timer.lap('spawn')
 
         # Resolve player action
         if(a=='l'):
@@ -60,6 +69,8 @@ class Env:
             self.player_y = max(1, self.player_y-1)
         elif(a=='d'):
             self.player_y = min(8, self.player_y+1)
+        if(timer is not None):
+            timer.lap('player_move')
 
         # Update entities
         for i in range(len(self.entities)):     
@@ -71,6 +82,8 @@ class Env:
                         r+=1
                     else:
                         self.terminal = True
+        if(timer is not None):
+            timer.lap('collision')
         if(self.move_timer==0):
             self.move_timer = self.move_speed
             for i in range(len(self.entities)):
@@ -85,6 +98,8 @@ class Env:
                             r+=1
                         else:
                             self.terminal = True
+        if(timer is not None):
+            timer.lap('entity_update')
 
         # Update various timers
         self.spawn_timer -= 1
@@ -102,26 +117,44 @@ class Env:
                     self.spawn_speed-=1
                 self.ramp_index+=1
                 self.ramp_timer=ramp_interval
+        if(timer is not None):
+            timer.lap('ramp')
         return r, self.terminal
 
-    # Spawn a new enemy or treasure at a random location with random direction (if all rows are filled do nothing)
+    # Spawn a new enemy or treasure at a random location with random direction (if all rows are filled do nothing).
+    # The fields are stored as Python bools and ints rather than the NumPy scalars drawn, which struct packs directly.
     def _spawn_entity(self):
-        lr = self.random.choice([True,False])
-        is_gold = self.random.choice([True,False], p=[1/3,2/3])
+        lr = bool(self.random.choice([True,False]))
+        is_gold = bool(self.random.choice([True,False], p=[1/3,2/3]))
         x = 0 if lr else 9
         slot_options = [i for i in range(len(self.entities)) if self.entities[i]==None]
         if(not slot_options):
             return
-        slot = self.random.choice(slot_options)
+        slot = int(self.random.choice(slot_options))
         self.entities[slot] = [x,slot+1,lr,is_gold]
 
     # Query the current level of the difficulty ramp, could be used as additional input to agent for example
     def difficulty_ramp(self):
         return self.ramp_index
 
-    # Process the game-state into the 10x10xn state provided to the agent and return
-    def state(self):
-        state = np.zeros((10,10,len(self.channels)),dtype=bool)
+    # Process the game-state into the 10x10xn state provided to the agent and return. If out is given the state is
+    # written into it in place instead, out can be any array (or view) of shape 10x10xn and any numeric dtype.
+    def state(self, out=None):
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+        if(out is None):
+            state = np.zeros((10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        self._paint(state)
+        if(timer is not None):
+            timer.lap('observation')
+        return state
+
+    # Set the cells of the zeroed state occupied by the current game objects
+    def _paint(self, state):
         state[self.player_y,self.player_x,self.channels['player']] = 1
         for x in self.entities:
             if(x is not None):
@@ -130,7 +163,6 @@ class Env:
                 back_x = x[0]-1 if x[2] else x[0]+1
                 if(back_x>=0 and back_x<=9):
                     state[x[1], back_x, self.channels['trail']] = 1
-        return state
 
     # Reset to start state for new episode
     def reset(self):
@@ -168,7 +200,45 @@ class Env:
                     objByColor[self.channels['trail']].append((float(back_x), float(x[1])))
         return objByColor
     
-    def save_state(self):
+    # Fixed size array form of continuous_state (see minatar.objects), returns float32 coordinates of shape
+    # (n,max_objects,2) and a boolean mask of shape (n,max_objects), written into coords and mask if given
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        coords, mask = object_arrays(len(self.channels), max_objects, coords, mask)
+        counts = [0]*len(self.channels)
+        put_object(coords, mask, counts, self.channels['player'], self.player_x, self.player_y)
+        for x in self.entities:
+            if x is not None:
+                c = self.channels['gold'] if x[3] else self.channels['enemy']
+                entityX = x[0] + (-1 if x[2] else 1)*self.move_timer/(self.move_speed)
+                put_object(coords, mask, counts, c, entityX, x[1])
+                back_x = entityX-1 if x[2] else entityX+1
+                if(back_x>=0 and back_x<=9):
+                    put_object(coords, mask, counts, self.channels['trail'], back_x, x[1])
+        return coords, mask
+
+    # Return an in-memory copy of the game state, including the RNG state, that can be passed to restore any number of
+    # times. Cheaper than save_state/load_state since nothing is serialized.
+    def clone(self):
+        return (self.player_x, self.player_y, [None if e is None else list(e) for e in self.entities], self.shot_timer,
+                self.spawn_speed, self.spawn_timer, self.move_speed, self.move_timer, self.ramp_timer, self.ramp_index,
+                self.terminal, rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.player_x, self.player_y, entities, self.shot_timer, self.spawn_speed, self.spawn_timer, self.move_speed, \
+            self.move_timer, self.ramp_timer, self.ramp_index, self.terminal, rng = snapshot
+        self.entities = [None if e is None else list(e) for e in entities]
+        set_rng_state(self.random, rng)
+
+    # Return a string that represents the current state of the game (not including the RNG state), or if binary is
+    # True a compact binary snapshot (see minatar.snapshot) that also includes the RNG state
+    def save_state(self, binary=False):
+        if(binary):
+            ints = [self.player_x, self.player_y, self.shot_timer, self.spawn_speed, self.spawn_timer, self.move_speed,
+                    self.move_timer, self.ramp_timer, self.ramp_index, self.terminal]
+            for e in self.entities:
+                ints.extend([0,0,0,0,0] if e is None else [1]+e)
+            return pack_snapshot(b'a', ints, random=self.random)
         state_str  = str(self.player_x) + " "
         state_str += str(self.player_y) + " "
         for e in self.entities:
@@ -187,7 +257,19 @@ class Env:
         state_str += str(int(self.terminal))
         return state_str
 
+    # Restore a state returned by save_state, binary snapshots also restore the RNG state
     def load_state(self, state_str):
+        if(is_snapshot(state_str)):
+            ints, _, _ = unpack_snapshot(b'a', state_str, self.random)
+            self.player_x, self.player_y, self.shot_timer, self.spawn_speed, self.spawn_timer, self.move_speed, \
+                self.move_timer, self.ramp_timer, self.ramp_index, terminal = ints[:10]
+            self.terminal = bool(terminal)
+            self.entities = [None]*8
+            for e_idx in range(8):
+                present, x, y, lr, is_gold = ints[10+5*e_idx:15+5*e_idx]
+                if(present):
+                    self.entities[e_idx] = [x, y, bool(lr), bool(is_gold)]
+            return
         state_lst = state_str.split()
         state_iter = iter(state_lst)
         self.player_x = int(next(state_iter))
@@ -213,3 +295,177 @@ class Env:
         self.ramp_index = int(next(state_iter))
         self.terminal = bool(int(next(state_iter)))
         
+
+
+#####################################################################################################################
+# BatchEnv
+#
+# Steps num_envs games of Asterix at once. Since each entity slot maps to exactly one row, the entities of every game
+# are held as occupancy, x, direction and gold flags in arrays of shape (num_envs,8), and the player, spawn, move and
+# ramp timers in arrays of shape (num_envs,) so that ramping stays independent per game. Collisions only need the
+# slot in the player's row, so they are resolved with one lookup per game. Only spawning draws random numbers, so
+# spawns are done per game from its own RandomState seeded with seeds[i], which makes game i reproduce
+# Env(seed=seeds[i]) frame for frame given the same actions.
+#
+#####################################################################################################################
+class BatchEnv:
+    def __init__(self, num_envs, ramping = True, seeds = None):
+        self.channels ={
+            'player':0,
+            'enemy':1,
+            'trail':2,
+            'gold':3
+        }
+        self.action_map = ['n','l','u','r','d','f']
+        self.ramping = ramping
+        self.num_envs = num_envs
+        if(seeds is None):
+            seeds = [None]*num_envs
+        self.randoms = [np.random.RandomState(s) for s in seeds]
+        self.index = np.arange(num_envs)
+        self.player_x = np.zeros(num_envs, dtype=np.int64)
+        self.player_y = np.zeros(num_envs, dtype=np.int64)
+        self.occupied = np.zeros((num_envs,8), dtype=bool)
+        self.entity_x = np.zeros((num_envs,8), dtype=np.int64)
+        self.entity_lr = np.zeros((num_envs,8), dtype=bool)
+        self.entity_gold = np.zeros((num_envs,8), dtype=bool)
+        self.shot_timer = np.zeros(num_envs, dtype=np.int64)
+        self.spawn_speed = np.zeros(num_envs, dtype=np.int64)
+        self.spawn_timer = np.zeros(num_envs, dtype=np.int64)
+        self.move_speed = np.zeros(num_envs, dtype=np.int64)
+        self.move_timer = np.zeros(num_envs, dtype=np.int64)
+        self.ramp_timer = np.zeros(num_envs, dtype=np.int64)
+        self.ramp_index = np.zeros(num_envs, dtype=np.int64)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        self.reset()
+
+    # Update every game according to the corresponding entry of a, returns (rewards, terminals)
+    def act(self, a):
+        a = np.asarray(a)
+        live = ~self.terminal
+        r = np.zeros(self.num_envs, dtype=np.int64)
+
+        # Spawn enemy if timer is up
+        spawn = live&(self.spawn_timer==0)
+        for i in self.index[spawn]:
+            self._spawn_entity(i)
+        self.spawn_timer = np.where(spawn, self.spawn_speed, self.spawn_timer)
+
+        # Resolve player action
+        self.player_x = np.where(live&(a==1), np.maximum(0, self.player_x-1), self.player_x)
+        self.player_x = np.where(live&(a==3), np.minimum(9, self.player_x+1), self.player_x)
+        self.player_y = np.where(live&(a==2), np.maximum(1, self.player_y-1), self.player_y)
+        self.player_y = np.where(live&(a==4), np.minimum(8, self.player_y+1), self.player_y)
+
+        # Update entities
+        lane = self.player_y-1
+        r += self._collide(live, lane)
+        move = live&(self.move_timer==0)
+        self.move_timer = np.where(move, self.move_speed, self.move_timer)
+        moving = move[:,None]&self.occupied
+        self.entity_x = np.where(moving, self.entity_x+np.where(self.entity_lr, 1, -1), self.entity_x)
+        self.occupied &= ~(moving&((self.entity_x<0)|(self.entity_x>9)))
+        r += self._collide(move, lane)
+
+        # Update various timers
+        self.spawn_timer -= live
+        self.move_timer -= live
+
+        #Ramp difficulty if interval has elapsed
+        if self.ramping:
+            ramp = live&((self.spawn_speed>1)|(self.move_speed>1))
+            tick = ramp&(self.ramp_timer>=0)
+            self.ramp_timer -= tick
+            step = ramp&~tick
+            self.move_speed -= step&(self.move_speed>1)&(self.ramp_index%2==1)
+            self.spawn_speed -= step&(self.spawn_speed>1)
+            self.ramp_index += step
+            self.ramp_timer = np.where(step, ramp_interval, self.ramp_timer)
+        return r, self.terminal.copy()
+
+    # Resolve contact between the player and the entity in its row for the games selected by the boolean mask,
+    # treasure is picked up and any other entity ends the game, returns the reward for each game
+    def _collide(self, mask, lane):
+        contact = mask&self.occupied[self.index,lane]&(self.entity_x[self.index,lane]==self.player_x)
+        gold = contact&self.entity_gold[self.index,lane]
+        self.occupied[self.index[gold],lane[gold]] = False
+        self.terminal |= contact&~gold
+        return gold
+
+    # Spawn a new enemy or treasure in game i at a random location with random direction (if all rows are filled
+    # do nothing)
+    def _spawn_entity(self, i):
+        lr = self.randoms[i].choice([True,False])
+        is_gold = self.randoms[i].choice([True,False], p=[1/3,2/3])
+        x = 0 if lr else 9
+        slot_options = [s for s in range(8) if not self.occupied[i,s]]
+        if(not slot_options):
+            return
+        slot = self.randoms[i].choice(slot_options)
+        self.occupied[i,slot] = True
+        self.entity_x[i,slot] = x
+        self.entity_lr[i,slot] = lr
+        self.entity_gold[i,slot] = is_gold
+
+    # Query the current level of the difficulty ramp of every game
+    def difficulty_ramp(self):
+        return self.ramp_index.copy()
+
+    # Process the game-states into the num_envsx10x10xn states provided to the agent, writing into out if given
+    def state(self, out=None):
+        if(out is None):
+            state = np.zeros((self.num_envs,10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        state[self.index,self.player_y,self.player_x,self.channels['player']] = 1
+        games, slots = np.nonzero(self.occupied)
+        x = self.entity_x[games,slots]
+        lr = self.entity_lr[games,slots]
+        c = np.where(self.entity_gold[games,slots], self.channels['gold'], self.channels['enemy'])
+        state[games,slots+1,x,c] = 1
+        back_x = np.where(lr, x-1, x+1)
+        trail = (back_x>=0)&(back_x<=9)
+        state[games[trail],slots[trail]+1,back_x[trail],self.channels['trail']] = 1
+        return state
+
+    # Fixed size array form of continuous_state for every game (see minatar.objects), returns float32 coordinates of
+    # shape (num_envs,n,max_objects,2) and a boolean mask of shape (num_envs,n,max_objects)
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        n = self.num_envs
+        entity_x = self.entity_x+np.where(self.entity_lr, -1, 1)*self.move_timer[:,None]/self.move_speed[:,None]
+        entity_y = np.tile(np.arange(1,9), (n,1))
+        back_x = np.where(self.entity_lr, entity_x-1, entity_x+1)
+        channel = np.concatenate([np.full((n,1), self.channels['player']),
+                                  np.where(self.entity_gold, self.channels['gold'], self.channels['enemy']),
+                                  np.full((n,8), self.channels['trail'])], axis=1)
+        x = np.concatenate([self.player_x[:,None], entity_x, back_x], axis=1)
+        y = np.concatenate([self.player_y[:,None], entity_y, entity_y], axis=1)
+        valid = np.concatenate([np.ones((n,1), dtype=bool), self.occupied,
+                                self.occupied&(back_x>=0)&(back_x<=9)], axis=1)
+        return scatter_objects(channel, x, y, valid, len(self.channels), max_objects, coords, mask)
+
+    # Reset the games selected by the boolean mask (all games if mask is None) to the start state for a new episode
+    def reset(self, mask=None):
+        if(mask is None):
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.player_x[mask] = 5
+        self.player_y[mask] = 5
+        self.occupied[mask] = False
+        self.shot_timer[mask] = 0
+        self.spawn_speed[mask] = init_spawn_speed
+        self.spawn_timer[mask] = init_spawn_speed
+        self.move_speed[mask] = init_move_interval
+        self.move_timer[mask] = init_move_interval
+        self.ramp_timer[mask] = ramp_interval
+        self.ramp_index[mask] = 0
+        self.terminal[mask] = False
+
+    # Dimensionality of the game-state of a single game (10x10xn)
+    def state_shape(self):
+        return [10,10,len(self.channels)]
+
+    # Subset of actions that actually have a unique impact in this environment
+    def minimal_action_set(self):
+        minimal_actions = ['n','l','u','r','d']
+        return [self.action_map.index(x) for x in minimal_actions]
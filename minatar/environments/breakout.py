@@ -4,6 +4,9 @@
 # Tian Tian (ttian@ualberta.ca)                                                                                #
 ################################################################################################################
 import numpy as np
+from minatar import bitboard
+from minatar.objects import object_arrays, grid_objects, scatter_objects
+from minatar.snapshot import is_snapshot, pack_snapshot, unpack_snapshot, rng_state, set_rng_state
 
 
 #####################################################################################################################
@@ -26,6 +29,7 @@ class Env:
         }
         self.action_map = ['n','l','u','r','d','f']
         self.random = np.random.RandomState(seed)
+        self.timer = None
         self.reset()
 
     # Update environment according to agent action
@@ -33,6 +37,10 @@ class Env:
         r = 0
         if(self.terminal):
             return r, self.terminal
+
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
             
         a = self.action_map[a]
 
@@ -41,6 +49,8 @@ class Env:
             self.pos = max(0, self.pos-1)
         elif(a=='r'):
             self.pos = min(9,self.pos+1)
+        if(timer is not None):
+            timer.lap('player_move')
 
         # Update ball position
         self.last_x = self.ball_x
@@ -58,6 +68,8 @@ class Env:
             new_x = self.ball_x-1
             new_y = self.ball_y+1
 
+        if(timer is not None):
+            timer.lap('ball_move')
         strike_toggle = False
         if(new_x<0 or new_x>9):
             if(new_x<0):
@@ -93,20 +105,36 @@ class Env:
 
         self.ball_x = new_x
         self.ball_y = new_y
+        if(timer is not None):
+            timer.lap('collision')
         return r, self.terminal
 
     # Query the current level of the difficulty ramp, difficulty does not ramp in this game, so return None
     def difficulty_ramp(self):
         return None  
 
-    # Process the game-state into the 10x10xn state provided to the agent and return
-    def state(self):
-        state = np.zeros((10,10,len(self.channels)),dtype=bool)
+    # Process the game-state into the 10x10xn state provided to the agent and return. If out is given the state is
+    # written into it in place instead, out can be any array (or view) of shape 10x10xn and any numeric dtype.
+    def state(self, out=None):
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+        if(out is None):
+            state = np.zeros((10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        self._paint(state)
+        if(timer is not None):
+            timer.lap('observation')
+        return state
+
+    # Set the cells of the zeroed state occupied by the current game objects
+    def _paint(self, state):
         state[self.ball_y,self.ball_x,self.channels['ball']] = 1
         state[9,self.pos, self.channels['paddle']] = 1
         state[self.last_y,self.last_x,self.channels['trail']] = 1
         state[:,:,self.channels['brick']] = self.brick_map
-        return state
 
     # Reset to start state for new episode
     def reset(self):
@@ -141,7 +169,36 @@ class Env:
                     objByColor[self.channels['brick']].append((float(c), float(r))) # Bricks
         return objByColor;
     
-    def save_state(self):
+    # Fixed size array form of continuous_state (see minatar.objects), returns float32 coordinates of shape
+    # (n,max_objects,2) and a boolean mask of shape (n,max_objects), written into coords and mask if given
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        coords, mask = object_arrays(len(self.channels), max_objects, coords, mask)
+        coords[self.channels['paddle'],0] = self.pos, 9
+        coords[self.channels['ball'],0] = self.ball_x, self.ball_y
+        coords[self.channels['trail'],0] = self.last_x, self.last_y
+        mask[[self.channels['paddle'], self.channels['ball'], self.channels['trail']],0] = True
+        grid_objects(coords, mask, self.channels['brick'], self.brick_map)
+        return coords, mask
+
+    # Return an in-memory copy of the game state, including the RNG state, that can be passed to restore any number of
+    # times. Cheaper than save_state/load_state since nothing is serialized.
+    def clone(self):
+        return (self.ball_x, self.ball_y, self.ball_dir, self.pos, self.brick_map.copy(), self.strike, self.last_x,
+                self.last_y, self.terminal, rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.ball_x, self.ball_y, self.ball_dir, self.pos, brick_map, self.strike, self.last_x, self.last_y, \
+            self.terminal, rng = snapshot
+        self.brick_map = brick_map.copy()
+        set_rng_state(self.random, rng)
+
+    # Return a string that represents the current state of the game (not including the RNG state), or if binary is
+    # True a compact binary snapshot (see minatar.snapshot) that also includes the RNG state
+    def save_state(self, binary=False):
+        if(binary):
+            ints = [self.ball_x, self.ball_y, self.ball_dir, self.pos, self.strike, self.last_x, self.last_y, self.terminal]
+            return pack_snapshot(b'b', ints, [self.brick_map], self.random)
         state_str  = str(self.ball_x) + " "
         state_str += str(self.ball_y) + " "
         state_str += str(self.ball_dir) + " "
@@ -155,19 +212,347 @@ class Env:
         state_str += str(int(self.terminal))
         return state_str
         
+    # Restore a state returned by save_state, binary snapshots also restore the RNG state
     def load_state(self, state_str):
+        if(is_snapshot(state_str)):
+            ints, maps, _ = unpack_snapshot(b'b', state_str, self.random)
+            self.ball_x, self.ball_y, self.ball_dir, self.pos, strike, self.last_x, self.last_y, terminal = ints
+            self.strike = bool(strike)
+            self.terminal = bool(terminal)
+            self.brick_map = maps[0].astype(float)
+            return
         state_lst = state_str.split()
         state_iter = iter(state_lst)
         self.ball_x = int(next(state_iter))
         self.ball_y = int(next(state_iter))
         self.ball_dir = int(next(state_iter))
         self.pos = int(next(state_iter))
-        self.brick_map = np.zeros((10,10))        
+        brick_map = np.zeros((10,10))
         for r in range(10):
             for c in range(10):
-                self.brick_map[r, c] = float(next(state_iter))
+                brick_map[r, c] = float(next(state_iter))
+        self.brick_map = brick_map
         self.strike = bool(int(next(state_iter)))
         self.last_x = int(next(state_iter))
         self.last_y = int(next(state_iter))
         self.terminal = bool(int(next(state_iter)))
         
+
+
+# The 3 rows of bricks placed at the start of an episode and whenever the wall is cleared
+initial_bricks = bitboard.rect(1, 4, 0, 10)
+
+
+#####################################################################################################################
+# BitboardEnv
+#
+# Env with the bricks held as a 100 bit integer (see minatar.bitboard) instead of a float array, so brick lookups,
+# removals and the test for a cleared wall are single bit operations. Plays exactly like Env, including its draws
+# from the RandomState, and produces the same states, snapshots and save_state strings. brick_map is still available
+# as a property that converts to and from the array layout of Env.
+#
+#####################################################################################################################
+class BitboardEnv(Env):
+    # Bricks of the last unpacked brick plane, the wall changes only when a brick is hit so the plane is usually reused
+    plane_bits = None
+
+    @property
+    def brick_map(self):
+        return bitboard.to_array(self.bricks)
+
+    @brick_map.setter
+    def brick_map(self, brick_map):
+        self.bricks = bitboard.to_bits(brick_map)
+
+    # Update environment according to agent action
+    def act(self, a):
+        r = 0
+        if(self.terminal):
+            return r, self.terminal
+
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+
+        a = self.action_map[a]
+
+        # Resolve player action
+        if(a=='l'):
+            self.pos = max(0, self.pos-1)
+        elif(a=='r'):
+            self.pos = min(9,self.pos+1)
+        if(timer is not None):
+            timer.lap('player_move')
+
+        # Update ball position
+        self.last_x = self.ball_x
+        self.last_y = self.ball_y
+        if(self.ball_dir == 0):
+            new_x = self.ball_x-1
+            new_y = self.ball_y-1
+        elif(self.ball_dir == 1):
+            new_x = self.ball_x+1
+            new_y = self.ball_y-1
+        elif(self.ball_dir == 2):
+            new_x = self.ball_x+1
+            new_y = self.ball_y+1
+        elif(self.ball_dir == 3):
+            new_x = self.ball_x-1
+            new_y = self.ball_y+1
+
+        if(timer is not None):
+            timer.lap('ball_move')
+        strike_toggle = False
+        if(new_x<0 or new_x>9):
+            if(new_x<0):
+                new_x = 0
+            if(new_x>9):
+                new_x=9
+            self.ball_dir=[1,0,3,2][self.ball_dir]
+        if(new_y<0):
+            new_y = 0
+            self.ball_dir=[3,2,1,0][self.ball_dir]
+        elif((self.bricks>>(10*new_y+new_x))&1):
+            strike_toggle = True
+            if(not self.strike):
+                r+=1
+                self.strike = True
+                self.bricks &= ~(1<<(10*new_y+new_x))
+                new_y = self.last_y
+                self.ball_dir=[3,2,1,0][self.ball_dir]
+        elif(new_y == 9):
+            if(self.bricks==0):
+                self.bricks = initial_bricks
+            if(self.ball_x == self.pos):
+                self.ball_dir=[3,2,1,0][self.ball_dir]
+                new_y = self.last_y
+            elif(new_x == self.pos):
+                self.ball_dir=[2,3,0,1][self.ball_dir]
+                new_y = self.last_y
+            else:
+                self.terminal = True
+
+        if(not strike_toggle):
+            self.strike = False
+
+        self.ball_x = new_x
+        self.ball_y = new_y
+        if(timer is not None):
+            timer.lap('collision')
+        return r, self.terminal
+
+    # Set the cells of the zeroed state occupied by the current game objects, see Env._paint
+    def _paint(self, state):
+        state[self.ball_y,self.ball_x,self.channels['ball']] = 1
+        state[9,self.pos, self.channels['paddle']] = 1
+        state[self.last_y,self.last_x,self.channels['trail']] = 1
+        if(self.plane_bits!=self.bricks):
+            self.plane = bitboard.to_planes([self.bricks])[0]
+            self.plane_bits = self.bricks
+        state[:,:,self.channels['brick']] = self.plane
+
+    # Paint the state from scratch into the 10x10xn array state and remember what was painted for _paint_changes
+    def _repaint(self, state):
+        self.state(out=state)
+        self.painted = (self.pos, 10*self.ball_y+self.ball_x, 10*self.last_y+self.last_x, self.bricks)
+
+    # Bring flat, the flattened array last painted by _repaint or _paint_changes, up to date with the current
+    # game-state. The paddle, ball and trail each clear their old cell and set their new one when they move and only
+    # the cells of bricks that were hit or restored are written.
+    def _paint_changes(self, flat):
+        n = len(self.channels)
+        pos, ball, trail, bricks = self.painted
+        new_ball = 10*self.ball_y+self.ball_x
+        new_trail = 10*self.last_y+self.last_x
+        if(self.pos!=pos):
+            channel = self.channels['paddle']
+            flat[(90+pos)*n+channel] = 0
+            flat[(90+self.pos)*n+channel] = 1
+        if(new_ball!=ball):
+            channel = self.channels['ball']
+            flat[ball*n+channel] = 0
+            flat[new_ball*n+channel] = 1
+        if(new_trail!=trail):
+            channel = self.channels['trail']
+            flat[trail*n+channel] = 0
+            flat[new_trail*n+channel] = 1
+        if(self.bricks!=bricks):
+            bitboard.paint_changes(flat, n, self.channels['brick'], bricks, self.bricks)
+        self.painted = (self.pos, new_ball, new_trail, self.bricks)
+
+    # Reset to start state for new episode
+    def reset(self):
+        self.ball_y = 3
+        ball_start = self.random.choice(2)
+        self.ball_x, self.ball_dir = [(0,2),(9,3)][ball_start]
+        self.pos = 4
+        self.bricks = initial_bricks
+        self.strike = False
+        self.last_x = self.ball_x
+        self.last_y = self.ball_y
+        self.terminal = False
+
+    def continuous_state(self):
+        objByColor = [[] for i in range(len(self.channels))]
+        objByColor[self.channels['paddle']].append((float(self.pos), 9.0)) # Paddle
+        objByColor[self.channels['ball']].append((float(self.ball_x), float(self.ball_y))) # Ball
+        objByColor[self.channels['trail']].append((float(self.last_x), float(self.last_y))) # Trail
+        for x, y in bitboard.cells(self.bricks):
+            objByColor[self.channels['brick']].append((float(x), float(y))) # Bricks
+        return objByColor
+
+    # Return an in-memory copy of the game state, see Env.clone
+    def clone(self):
+        return (self.ball_x, self.ball_y, self.ball_dir, self.pos, self.bricks, self.strike, self.last_x,
+                self.last_y, self.terminal, rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.ball_x, self.ball_y, self.ball_dir, self.pos, self.bricks, self.strike, self.last_x, self.last_y, \
+            self.terminal, rng = snapshot
+        set_rng_state(self.random, rng)
+
+
+#####################################################################################################################
+# BatchEnv
+#
+# Steps num_envs games of Breakout at once. The state of every game is held in arrays of shape (num_envs,) and
+# (num_envs,10,10) and each frame is resolved for all games with masked array operations instead of branching on a
+# single ball. Games that have reached a terminal state are left untouched until they are reset. Game i draws from
+# its own RandomState seeded with seeds[i], so it reproduces Env(seed=seeds[i]) frame for frame given the same actions.
+#
+#####################################################################################################################
+class BatchEnv:
+    # Ball displacement for each ball_dir, and ball_dir after reflecting off a vertical wall, a horizontal surface, or
+    # the corner of the paddle
+    dx = np.array([-1,1,1,-1])
+    dy = np.array([-1,-1,1,1])
+    flip_x = np.array([1,0,3,2])
+    flip_y = np.array([3,2,1,0])
+    flip_xy = np.array([2,3,0,1])
+
+    def __init__(self, num_envs, ramping = None, seeds = None):
+        self.channels ={
+            'paddle':0,
+            'ball':1,
+            'trail':2,
+            'brick':3,
+        }
+        self.action_map = ['n','l','u','r','d','f']
+        self.num_envs = num_envs
+        if(seeds is None):
+            seeds = [None]*num_envs
+        self.randoms = [np.random.RandomState(s) for s in seeds]
+        self.index = np.arange(num_envs)
+        self.ball_x = np.zeros(num_envs, dtype=np.int64)
+        self.ball_y = np.zeros(num_envs, dtype=np.int64)
+        self.ball_dir = np.zeros(num_envs, dtype=np.int64)
+        self.pos = np.zeros(num_envs, dtype=np.int64)
+        self.brick_map = np.zeros((num_envs,10,10), dtype=bool)
+        self.strike = np.zeros(num_envs, dtype=bool)
+        self.last_x = np.zeros(num_envs, dtype=np.int64)
+        self.last_y = np.zeros(num_envs, dtype=np.int64)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        self.reset()
+
+    # Update every game according to the corresponding entry of a, returns (rewards, terminals)
+    def act(self, a):
+        a = np.asarray(a)
+        live = ~self.terminal
+
+        # Resolve player action
+        self.pos = np.where(live&(a==1), np.maximum(0, self.pos-1), self.pos)
+        self.pos = np.where(live&(a==3), np.minimum(9, self.pos+1), self.pos)
+
+        # Update ball position
+        ball_x = self.ball_x
+        ball_y = self.ball_y
+        ball_dir = self.ball_dir
+        new_x = ball_x+self.dx[ball_dir]
+        new_y = ball_y+self.dy[ball_dir]
+
+        wall = (new_x<0)|(new_x>9)
+        new_x = np.clip(new_x, 0, 9)
+        ball_dir = np.where(wall, self.flip_x[ball_dir], ball_dir)
+        top = new_y<0
+        new_y = np.where(top, 0, new_y)
+        ball_dir = np.where(top, self.flip_y[ball_dir], ball_dir)
+
+        # Games whose terminal ball sits on the bottom row can look past the grid, they are masked out by live
+        brick = live&~top&self.brick_map[self.index, np.minimum(new_y, 9), new_x]
+        hit = brick&~self.strike
+        self.brick_map[self.index[hit], new_y[hit], new_x[hit]] = False
+        new_y = np.where(hit, ball_y, new_y)
+        ball_dir = np.where(hit, self.flip_y[ball_dir], ball_dir)
+
+        bottom = live&~top&~brick&(new_y==9)
+        refill = bottom&~self.brick_map.any(axis=(1,2))
+        self.brick_map[refill,1:4,:] = True
+        straight = bottom&(ball_x==self.pos)
+        angled = bottom&~straight&(new_x==self.pos)
+        ball_dir = np.where(straight, self.flip_y[ball_dir], ball_dir)
+        ball_dir = np.where(angled, self.flip_xy[ball_dir], ball_dir)
+        new_y = np.where(straight|angled, ball_y, new_y)
+
+        self.terminal = self.terminal|(bottom&~straight&~angled)
+        self.strike = np.where(live, brick, self.strike)
+        self.last_x = np.where(live, ball_x, self.last_x)
+        self.last_y = np.where(live, ball_y, self.last_y)
+        self.ball_x = np.where(live, new_x, ball_x)
+        self.ball_y = np.where(live, new_y, ball_y)
+        self.ball_dir = np.where(live, ball_dir, self.ball_dir)
+        return hit.astype(np.int64), self.terminal.copy()
+
+    # Query the current level of the difficulty ramp, difficulty does not ramp in this game, so return None
+    def difficulty_ramp(self):
+        return None
+
+    # Process the game-states into the num_envsx10x10xn states provided to the agent, writing into out if given
+    def state(self, out=None):
+        if(out is None):
+            state = np.zeros((self.num_envs,10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        state[self.index,self.ball_y,self.ball_x,self.channels['ball']] = 1
+        state[self.index,9,self.pos,self.channels['paddle']] = 1
+        state[self.index,self.last_y,self.last_x,self.channels['trail']] = 1
+        state[:,:,:,self.channels['brick']] = self.brick_map
+        return state
+
+    # Fixed size array form of continuous_state for every game (see minatar.objects), returns float32 coordinates of
+    # shape (num_envs,n,max_objects,2) and a boolean mask of shape (num_envs,n,max_objects)
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        n = self.num_envs
+        cells = np.arange(100)
+        channel = np.concatenate([np.tile([self.channels['paddle'], self.channels['ball'], self.channels['trail']], (n,1)),
+                                  np.full((n,100), self.channels['brick'])], axis=1)
+        x = np.concatenate([np.stack([self.pos, self.ball_x, self.last_x], axis=1), np.tile(cells%10, (n,1))], axis=1)
+        y = np.concatenate([np.stack([np.full(n, 9), self.ball_y, self.last_y], axis=1), np.tile(cells//10, (n,1))],
+                           axis=1)
+        valid = np.concatenate([np.ones((n,3), dtype=bool), self.brick_map.reshape(n,100)], axis=1)
+        return scatter_objects(channel, x, y, valid, len(self.channels), max_objects, coords, mask)
+
+    # Reset the games selected by the boolean mask (all games if mask is None) to the start state for a new episode
+    def reset(self, mask=None):
+        games = self.index if mask is None else self.index[mask]
+        for i in games:
+            ball_start = self.randoms[i].choice(2)
+            self.ball_x[i], self.ball_dir[i] = [(0,2),(9,3)][ball_start]
+        self.ball_y[games] = 3
+        self.pos[games] = 4
+        self.brick_map[games] = False
+        self.brick_map[games,1:4,:] = True
+        self.strike[games] = False
+        self.last_x[games] = self.ball_x[games]
+        self.last_y[games] = self.ball_y[games]
+        self.terminal[games] = False
+
+    # Dimensionality of the game-state of a single game (10x10xn)
+    def state_shape(self):
+        return [10,10,len(self.channels)]
+
+    # Subset of actions that actually have a unique impact in this environment
+    def minimal_action_set(self):
+        minimal_actions = ['n','l','r']
+        return [self.action_map.index(x) for x in minimal_actions]
@@ -4,6 +4,8 @@
 # Tian Tian (ttian@ualberta.ca)                                                                                #
 ################################################################################################################
 import numpy as np
+from minatar.objects import object_arrays, put_object, scatter_objects
+from minatar.snapshot import is_snapshot, pack_snapshot, unpack_snapshot, rng_state, set_rng_state
 
 
 #####################################################################################################################
@@ -40,6 +42,7 @@ class Env:
         }
         self.action_map = ['n','l','u','r','d','f']
         self.random = np.random.RandomState(seed)
+        self.timer = None
         self.reset()
 
     # Update environment according to agent action
@@ -47,6 +50,10 @@ class Env:
         r = 0
         if(self.terminal):
             return r, self.terminal
+
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
             
         a = self.action_map[a]
 
@@ -61,12 +68,16 @@ class Env:
                 self.playerDir = 1
             else:
                 self.playerDir = 0
+        if(timer is not None):
+            timer.lap('player_move')
 
         # Win condition
         if(self.pos==0):
             r+=1
             self._randomize_cars(initialize=False)
             self.pos = 9
+        if(timer is not None):
+            timer.lap('spawn')
 
         # Update cars
         for car in self.cars:
@@ -83,21 +94,40 @@ class Env:
                     self.pos = 9
             else:
                 car[2]-=1
+        if(timer is not None):
+            timer.lap('entity_update')
 
         # Update various timers
         self.move_timer-=self.move_timer>0
         self.terminate_timer-=1
         if(self.terminate_timer<0):
             self.terminal = True
+        if(timer is not None):
+            timer.lap('timers')
         return r, self.terminal
 
     # Query the current level of the difficulty ramp, difficulty does not ramp in this game, so return None
     def difficulty_ramp(self):
         return None        
 
-    # Process the game-state into the 10x10xn state provided to the agent and return
-    def state(self):
-        state = np.zeros((10,10,len(self.channels)),dtype=bool)
+    # Process the game-state into the 10x10xn state provided to the agent and return. If out is given the state is
+    # written into it in place instead, out can be any array (or view) of shape 10x10xn and any numeric dtype.
+    def state(self, out=None):
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+        if(out is None):
+            state = np.zeros((10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        self._paint(state)
+        if(timer is not None):
+            timer.lap('observation')
+        return state
+
+    # Set the cells of the zeroed state occupied by the current game objects
+    def _paint(self, state):
         state[self.pos,4,self.channels['chicken']] = 1
         for car in self.cars:
             state[car[1],car[0], self.channels['car']] = 1
@@ -117,13 +147,12 @@ class Env:
             elif(abs(car[3])==5):
                 trail = self.channels['speed5']
             state[car[1],back_x, trail] = 1
-        return state
 
     # Randomize car speeds and directions, also reset their position if initialize=True
     def _randomize_cars(self, initialize=False):
         speeds = self.random.randint(1,6,8)
         directions = self.random.choice([-1,1],8)
-        speeds*=directions
+        speeds = (speeds*directions).tolist()
         if(initialize):
             self.cars = []
             for i in range(8):
@@ -177,7 +206,46 @@ class Env:
             objByColor[trail].append((float(back_x), float(car[1])))
         return objByColor
     
-    def save_state(self):
+    # Fixed size array form of continuous_state (see minatar.objects), returns float32 coordinates of shape
+    # (n,max_objects,2) and a boolean mask of shape (n,max_objects), written into coords and mask if given
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        coords, mask = object_arrays(len(self.channels), max_objects, coords, mask)
+        counts = [0]*len(self.channels)
+        chickenX = self.pos - self.playerDir*self.move_timer/player_speed
+        put_object(coords, mask, counts, self.channels['chicken'], 4.0, chickenX)
+        for car in self.cars:
+            carX = car[0] + (1 if car[3]>0 else -1)*(1.0 - car[2]/(abs(car[3]) + 1))
+            if carX < 0:
+                carX = 10 + carX
+            put_object(coords, mask, counts, self.channels['car'], carX, car[1])
+            back_x = carX-1 if car[3]>0 else carX+1
+            if(back_x<0):
+                back_x=10 + back_x
+            elif(back_x>10):
+                back_x=back_x - 10
+            put_object(coords, mask, counts, self.channels['speed'+str(abs(car[3]))], back_x, car[1])
+        return coords, mask
+
+    # Return an in-memory copy of the game state, including the RNG state, that can be passed to restore any number of
+    # times. Cheaper than save_state/load_state since nothing is serialized.
+    def clone(self):
+        return (self.pos, self.move_timer, self.terminate_timer, [list(c) for c in self.cars], self.terminal,
+                self.playerDir, rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.pos, self.move_timer, self.terminate_timer, cars, self.terminal, self.playerDir, rng = snapshot
+        self.cars = [list(c) for c in cars]
+        set_rng_state(self.random, rng)
+
+    # Return a string that represents the current state of the game (not including the RNG state), or if binary is
+    # True a compact binary snapshot (see minatar.snapshot) that also includes the RNG state
+    def save_state(self, binary=False):
+        if(binary):
+            ints = [self.pos, self.move_timer, self.terminate_timer, self.terminal, self.playerDir]
+            for c in self.cars:
+                ints.extend(c)
+            return pack_snapshot(b'f', ints, random=self.random)
         state_str  = str(self.pos) + " "
         state_str += str(self.move_timer) + " "
         state_str += str(self.terminate_timer) + " "
@@ -188,7 +256,14 @@ class Env:
         state_str += str(self.playerDir)
         return state_str
 
+    # Restore a state returned by save_state, binary snapshots also restore the RNG state
     def load_state(self, state_str):
+        if(is_snapshot(state_str)):
+            ints, _, _ = unpack_snapshot(b'f', state_str, self.random)
+            self.pos, self.move_timer, self.terminate_timer, terminal, self.playerDir = ints[:5]
+            self.terminal = bool(terminal)
+            self.cars = [list(ints[5+4*i:9+4*i]) for i in range(8)]
+            return
         state_lst = state_str.split()
         state_iter = iter(state_lst)
         self.pos = int(next(state_iter))
@@ -203,3 +278,152 @@ class Env:
         self.terminal = bool(int(next(state_iter)))
         self.playerDir = int(next(state_iter))
         
+
+
+#####################################################################################################################
+# BatchEnv
+#
+# Steps num_envs games of Freeway at once. The cars of every game are held in an array of shape (num_envs,8,4) where
+# each row is [x, y, timer, speed] for the car in lane row+1, and the chicken position and timers in arrays of shape
+# (num_envs,). All cars of all games are updated with array operations each frame. Since lane i only ever holds car
+# i, a collision can only come from the car in the chicken's lane, so it is resolved with a single lookup per game.
+# Game i draws from its own RandomState seeded with seeds[i], so it reproduces Env(seed=seeds[i]) frame for frame
+# given the same actions.
+#
+#####################################################################################################################
+class BatchEnv:
+    def __init__(self, num_envs, ramping = None, seeds = None):
+        self.channels ={
+            'chicken':0,
+            'car':1,
+            'speed1':2,
+            'speed2':3,
+            'speed3':4,
+            'speed4':5,
+            'speed5':6,
+        }
+        self.action_map = ['n','l','u','r','d','f']
+        self.num_envs = num_envs
+        if(seeds is None):
+            seeds = [None]*num_envs
+        self.randoms = [np.random.RandomState(s) for s in seeds]
+        self.index = np.arange(num_envs)
+        self.cars = np.zeros((num_envs,8,4), dtype=np.int64)
+        self.cars[:,:,1] = np.arange(1,9)
+        self.pos = np.zeros(num_envs, dtype=np.int64)
+        self.move_timer = np.zeros(num_envs, dtype=np.int64)
+        self.terminate_timer = np.zeros(num_envs, dtype=np.int64)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        self.playerDir = np.zeros(num_envs, dtype=np.int64)
+        self.reset()
+
+    # Update every game according to the corresponding entry of a, returns (rewards, terminals)
+    def act(self, a):
+        a = np.asarray(a)
+        live = ~self.terminal
+
+        can_move = live&(self.move_timer==0)
+        up = can_move&(a==2)
+        down = can_move&(a==4)
+        self.move_timer = np.where(up|down, player_speed, self.move_timer)
+        self.pos = np.where(up, np.maximum(0, self.pos-1), self.pos)
+        self.pos = np.where(down, np.minimum(9, self.pos+1), self.pos)
+        self.playerDir = np.where(can_move, up*-1+down*1, self.playerDir)
+
+        # Win condition
+        win = live&(self.pos==0)
+        if(win.any()):
+            self._randomize_cars(win, initialize=False)
+            self.pos[win] = 9
+
+        # Update cars, the chicken is hit if the car in its lane is on column 4 before or after moving
+        car_x = self.cars[:,:,0]
+        timer = self.cars[:,:,2]
+        speed = self.cars[:,:,3]
+        lane = np.clip(self.pos-1, 0, 7)
+        in_lane = live&(self.pos>=1)&(self.pos<=8)
+        hit = in_lane&(car_x[self.index,lane]==4)
+        moving = live[:,None]&(timer==0)
+        car_x[...] = np.where(moving, (car_x+np.sign(speed))%10, car_x)
+        timer[...] = np.where(moving, np.abs(speed), timer-live[:,None])
+        hit |= in_lane&(car_x[self.index,lane]==4)
+        self.pos = np.where(hit, 9, self.pos)
+
+        # Update various timers
+        self.move_timer -= live&(self.move_timer>0)
+        self.terminate_timer -= live
+        self.terminal = self.terminal|(live&(self.terminate_timer<0))
+        return win.astype(np.int64), self.terminal.copy()
+
+    # Query the current level of the difficulty ramp, difficulty does not ramp in this game, so return None
+    def difficulty_ramp(self):
+        return None
+
+    # Process the game-states into the num_envsx10x10xn states provided to the agent, writing into out if given
+    def state(self, out=None):
+        if(out is None):
+            state = np.zeros((self.num_envs,10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        state[self.index,self.pos,4,self.channels['chicken']] = 1
+        car_x = self.cars[:,:,0]
+        car_y = self.cars[:,:,1]
+        speed = self.cars[:,:,3]
+        games = self.index[:,None]
+        state[games,car_y,car_x,self.channels['car']] = 1
+        back_x = (car_x-np.sign(speed))%10
+        state[games,car_y,back_x,self.channels['speed1']-1+np.abs(speed)] = 1
+        return state
+
+    # Fixed size array form of continuous_state for every game (see minatar.objects), returns float32 coordinates of
+    # shape (num_envs,n,max_objects,2) and a boolean mask of shape (num_envs,n,max_objects)
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        n = self.num_envs
+        car_x = self.cars[:,:,0]
+        car_y = self.cars[:,:,1]
+        timer = self.cars[:,:,2]
+        speed = self.cars[:,:,3]
+        chicken_x = self.pos-self.playerDir*self.move_timer/player_speed
+        x = car_x+np.where(speed>0, 1, -1)*(1.0-timer/(np.abs(speed)+1))
+        x = np.where(x<0, 10+x, x)
+        back_x = np.where(speed>0, x-1, x+1)
+        back_x = np.where(back_x<0, 10+back_x, np.where(back_x>10, back_x-10, back_x))
+        channel = np.concatenate([np.full((n,1), self.channels['chicken']), np.full((n,8), self.channels['car']),
+                                  self.channels['speed1']-1+np.abs(speed)], axis=1)
+        x = np.concatenate([np.full((n,1), 4.0), x, back_x], axis=1)
+        y = np.concatenate([chicken_x[:,None], car_y, car_y], axis=1)
+        valid = np.ones((n,17), dtype=bool)
+        return scatter_objects(channel, x, y, valid, len(self.channels), max_objects, coords, mask)
+
+    # Randomize car speeds and directions of the games selected by the boolean mask, also reset their position if
+    # initialize=True
+    def _randomize_cars(self, mask, initialize=False):
+        for i in self.index[mask]:
+            speeds = self.randoms[i].randint(1,6,8)
+            directions = self.randoms[i].choice([-1,1],8)
+            speeds*=directions
+            self.cars[i,:,2] = np.abs(speeds)
+            self.cars[i,:,3] = speeds
+        if(initialize):
+            self.cars[mask,:,0] = 0
+
+    # Reset the games selected by the boolean mask (all games if mask is None) to the start state for a new episode
+    def reset(self, mask=None):
+        if(mask is None):
+            mask = np.ones(self.num_envs, dtype=bool)
+        self._randomize_cars(mask, initialize=True)
+        self.pos[mask] = 9
+        self.move_timer[mask] = player_speed
+        self.terminate_timer[mask] = time_limit
+        self.terminal[mask] = False
+        self.playerDir[mask] = 0
+
+    # Dimensionality of the game-state of a single game (10x10xn)
+    def state_shape(self):
+        return [10,10,len(self.channels)]
+
+    # Subset of actions that actually have a unique impact in this environment
+    def minimal_action_set(self):
+        minimal_actions = ['n','u','d']
+        return [self.action_map.index(x) for x in minimal_actions]
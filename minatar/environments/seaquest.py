@@ -4,6 +4,8 @@
 # Tian Tian (ttian@ualberta.ca)                                                                                #
 ################################################################################################################
 import numpy as np
+from minatar.objects import object_arrays, put_object, scatter_objects
+from minatar.snapshot import is_snapshot, pack_snapshot, unpack_snapshot, rng_state, set_rng_state
 
 
 #####################################################################################################################
@@ -56,6 +58,7 @@ class Env:
         self.action_map = ['n','l','u','r','d','f']
         self.ramping = ramping
         self.random = np.random.RandomState(seed)
+        self.timer = None
         self.reset()
 
     # Update environment according to agent action
@@ -63,6 +66,10 @@ class Env:
         r = 0
         if(self.terminal):
             return r, self.terminal
+
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
             
         a = self.action_map[a]
 
@@ -74,6 +81,8 @@ class Env:
         if(self.d_spawn_timer==0):
             self._spawn_diver()
             self.d_spawn_timer = diver_spawn_speed
+        if(timer is not None):
+            timer.lap('spawn')
 
         # Resolve player action
         if(a=='f' and self.shot_timer == 0):
@@ -89,6 +98,8 @@ class Env:
             self.sub_y = max(0, self.sub_y-1)
         elif(a=='d'):
             self.sub_y = min(8, self.sub_y+1)
+        if(timer is not None):
+            timer.lap('player_move')
 
         # Update friendly Bullets
         for bullet in reversed(self.f_bullets):
@@ -111,6 +122,8 @@ class Env:
                             self.f_bullets.remove(bullet)
                             r+=1
                             break
+        if(timer is not None):
+            timer.lap('friendly_bullets')
 
         # Update divers
         for diver in reversed(self.divers):
@@ -128,6 +141,8 @@ class Env:
                         self.diver_count+=1
                 else:
                     diver[3]-=1
+        if(timer is not None):
+            timer.lap('divers')
 
         # Update enemy subs
         for sub in reversed(self.e_subs):
@@ -154,6 +169,8 @@ class Env:
                 self.e_bullets+=[[sub[0] if sub[2] else sub[0], sub[1], sub[2]]]
             else:
                 sub[4]-=1
+        if(timer is not None):
+            timer.lap('enemy_subs')
 
         # Update enemy bullets
         for bullet in reversed(self.e_bullets):
@@ -165,6 +182,8 @@ class Env:
             else:
                 if(bullet[0:2]==[self.sub_x,self.sub_y]):
                     self.terminal = True
+        if(timer is not None):
+            timer.lap('enemy_bullets')
 
         # Update enemy fish
         for fish in reversed(self.e_fish):
@@ -186,6 +205,8 @@ class Env:
                             break
             else:
                 fish[3]-=1
+        if(timer is not None):
+            timer.lap('enemy_fish')
 
         # Update various timers
         self.e_spawn_timer -= self.e_spawn_timer>0
@@ -202,6 +223,8 @@ class Env:
                     self.terminal = True
                 else:
                     r+=self._surface()
+        if(timer is not None):
+            timer.lap('oxygen_and_ramp')
         return r, self.terminal
 
     # Called when player hits surface (top row) if they have no divers, this ends the game, 
@@ -225,12 +248,13 @@ class Env:
         return r
 
     # Spawn an enemy fish or submarine in random row and random direction,
-    # if the resulting row and direction would lead to a collision, do nothing instead
+    # if the resulting row and direction would lead to a collision, do nothing instead. Fields are stored as Python
+    # bools and ints rather than the NumPy scalars drawn, which struct packs directly.
     def _spawn_enemy(self):
-        lr = self.random.choice([True,False])
+        lr = bool(self.random.choice([True,False]))
         is_sub = self.random.choice([True,False], p=[1/3,2/3])
         x = 0 if lr else 9
-        y = self.random.choice(np.arange(1,9))
+        y = int(self.random.choice(np.arange(1,9)))
 
         # Do not spawn in same row an opposite direction as existing
         if(any([z[1]==y and z[2]!=lr for z in self.e_subs+self.e_fish])):
@@ -242,18 +266,33 @@ class Env:
 
     # Spawn a diver in random row with random direction
     def _spawn_diver(self):
-        lr = self.random.choice([True,False])
+        lr = bool(self.random.choice([True,False]))
         x = 0 if lr else 9
-        y = self.random.choice(np.arange(1,9))
+        y = int(self.random.choice(np.arange(1,9)))
         self.divers+=[[x,y,lr,diver_move_interval]]
 
     # Query the current level of the difficulty ramp, could be used as additional input to agent for example
     def difficulty_ramp(self):
         return self.ramp_index
 
-    # Process the game-state into the 10x10xn state provided to the agent and return
-    def state(self):
-        state = np.zeros((10,10,len(self.channels)),dtype=bool)
+    # Process the game-state into the 10x10xn state provided to the agent and return. If out is given the state is
+    # written into it in place instead, out can be any array (or view) of shape 10x10xn and any numeric dtype.
+    def state(self, out=None):
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+        if(out is None):
+            state = np.zeros((10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        self._paint(state)
+        if(timer is not None):
+            timer.lap('observation')
+        return state
+
+    # Set the cells of the zeroed state occupied by the current game objects
+    def _paint(self, state):
         state[self.sub_y,self.sub_x,self.channels['sub_front']] = 1
         back_x = self.sub_x-1 if self.sub_or else self.sub_x+1
         state[self.sub_y,back_x,self.channels['sub_back']] = 1
@@ -279,8 +318,6 @@ class Env:
             if(back_x>=0 and back_x<=9):
                 state[diver[1],back_x, self.channels['trail']] = 1
 
-        return state
-
     # Reset to start state for new episode
     def reset(self):
         self.oxygen = max_oxygen
@@ -345,7 +382,76 @@ class Env:
                 objByColor[self.channels['trail']].append((float(back_x), float(diver[1])))
         return objByColor
 
-    def save_state(self):
+    # Fixed size array form of continuous_state (see minatar.objects), returns float32 coordinates of shape
+    # (n,max_objects,2) and a boolean mask of shape (n,max_objects), written into coords and mask if given
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        coords, mask = object_arrays(len(self.channels), max_objects, coords, mask)
+        counts = [0]*len(self.channels)
+        put_object(coords, mask, counts, self.channels['sub_front'], self.sub_x, self.sub_y)
+        back_x = self.sub_x-1 if self.sub_or else self.sub_x+1
+        put_object(coords, mask, counts, self.channels['sub_back'], back_x, self.sub_y)
+        for i in range(self.oxygen*10//max_oxygen):
+            put_object(coords, mask, counts, self.channels['oxygen_guage'], i, 9)
+        for i in range(9-self.diver_count, 9):
+            put_object(coords, mask, counts, self.channels['diver_guage'], i, 9)
+        for bullet in self.f_bullets:
+            put_object(coords, mask, counts, self.channels['friendly_bullet'], bullet[0], bullet[1])
+        for bullet in self.e_bullets:
+            put_object(coords, mask, counts, self.channels['enemy_bullet'], bullet[0], bullet[1])
+        trail = self.channels['trail']
+        for fish in self.e_fish:
+            fishX = fish[0] + (1 if fish[2] else -1)*(1.0 - fish[3]/(self.move_speed + 1))
+            put_object(coords, mask, counts, self.channels['enemy_fish'], fishX, fish[1])
+            back_x = fishX-1 if fish[2] else fishX+1
+            if(back_x>=0 and back_x<=9):
+                put_object(coords, mask, counts, trail, back_x, fish[1])
+        for sub in self.e_subs:
+            subX = sub[0] + (1 if sub[2] else -1)*(1.0 - sub[3]/(self.move_speed + 1))
+            put_object(coords, mask, counts, self.channels['enemy_sub'], subX, sub[1])
+            back_x = subX-1 if sub[2] else subX+1
+            if(back_x>=0 and back_x<=9):
+                put_object(coords, mask, counts, trail, back_x, sub[1])
+        for diver in self.divers:
+            diverX = diver[0] + (1 if diver[2] else -1)*(1.0 - diver[3]/(diver_move_interval + 1))
+            put_object(coords, mask, counts, self.channels['diver'], diverX, diver[1])
+            back_x = diverX-1 if diver[2] else diverX+1
+            if(back_x>=0 and back_x<=9):
+                put_object(coords, mask, counts, trail, back_x, diver[1])
+        return coords, mask
+
+    # Return an in-memory copy of the game state, including the RNG state, that can be passed to restore any number of
+    # times. Cheaper than save_state/load_state since nothing is serialized.
+    def clone(self):
+        return (self.oxygen, self.diver_count, self.sub_x, self.sub_y, self.sub_or,
+                [list(x) for x in self.f_bullets], [list(x) for x in self.e_bullets], [list(x) for x in self.e_fish],
+                [list(x) for x in self.e_subs], [list(x) for x in self.divers], self.e_spawn_speed,
+                self.e_spawn_timer, self.d_spawn_timer, self.move_speed, self.ramp_index, self.shot_timer, self.surface,
+                self.terminal, rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.oxygen, self.diver_count, self.sub_x, self.sub_y, self.sub_or, f_bullets, e_bullets, e_fish, e_subs, \
+            divers, self.e_spawn_speed, self.e_spawn_timer, self.d_spawn_timer, self.move_speed, self.ramp_index, \
+            self.shot_timer, self.surface, self.terminal, rng = snapshot
+        self.f_bullets = [list(x) for x in f_bullets]
+        self.e_bullets = [list(x) for x in e_bullets]
+        self.e_fish = [list(x) for x in e_fish]
+        self.e_subs = [list(x) for x in e_subs]
+        self.divers = [list(x) for x in divers]
+        set_rng_state(self.random, rng)
+
+    # Return a string that represents the current state of the game (not including the RNG state), or if binary is
+    # True a compact binary snapshot (see minatar.snapshot) that also includes the RNG state
+    def save_state(self, binary=False):
+        if(binary):
+            ints = [self.oxygen, self.diver_count, self.sub_x, self.sub_y, self.sub_or, self.e_spawn_speed,
+                    self.e_spawn_timer, self.d_spawn_timer, self.move_speed, self.ramp_index, self.shot_timer,
+                    self.surface, self.terminal]
+            for entities in [self.f_bullets, self.e_bullets, self.e_fish, self.e_subs, self.divers]:
+                ints.append(len(entities))
+                for e in entities:
+                    ints.extend(e)
+            return pack_snapshot(b's', ints, random=self.random)
         state_str  = str(self.oxygen) + " "
         state_str += str(self.diver_count) + " "
         state_str += str(self.sub_x) + " "
@@ -381,7 +487,28 @@ class Env:
         state_str += str(int(self.terminal))
         return state_str
 
+    # Restore a state returned by save_state, binary snapshots also restore the RNG state
     def load_state(self, state_str):
+        if(is_snapshot(state_str)):
+            ints, _, _ = unpack_snapshot(b's', state_str, self.random)
+            self.oxygen, self.diver_count, self.sub_x, self.sub_y, sub_or, self.e_spawn_speed, self.e_spawn_timer, \
+                self.d_spawn_timer, self.move_speed, self.ramp_index, self.shot_timer, surface, terminal = ints[:13]
+            self.sub_or = bool(sub_or)
+            self.surface = bool(surface)
+            self.terminal = bool(terminal)
+            pos = 13
+            lists = []
+            for n_props in [3, 3, 4, 5, 4]:
+                entities = []
+                for _ in range(ints[pos]):
+                    props = list(ints[pos+1:pos+1+n_props])
+                    props[2] = bool(props[2])
+                    entities.append(props)
+                    pos += n_props
+                pos += 1
+                lists.append(entities)
+            self.f_bullets, self.e_bullets, self.e_fish, self.e_subs, self.divers = lists
+            return
         state_lst = state_str.split()
         state_iter = iter(state_lst)
 
@@ -442,3 +569,412 @@ class Env:
         self.shot_timer = int(next(state_iter))
         self.surface = bool(int(next(state_iter)))
         self.terminal = bool(int(next(state_iter)))
+
+
+#####################################################################################################################
+# EntityPool
+#
+# Fixed-capacity storage for one kind of entity across a batch of games, used by BatchEnv in place of the growing
+# Python lists kept by Env. Each field is an int array of shape (num_envs,capacity). The active entities of game i
+# are kept compacted in slots 0..count[i]-1 in the same order as the corresponding list in Env, which is what makes
+# order dependent collision rules reproducible. The capacity is doubled whenever an append would overflow it.
+#
+#####################################################################################################################
+class EntityPool:
+    def __init__(self, num_envs, fields, capacity = 8):
+        self.fields = fields
+        self.capacity = capacity
+        self.count = np.zeros(num_envs, dtype=np.int64)
+        for f in fields:
+            setattr(self, f, np.zeros((num_envs,capacity), dtype=np.int64))
+
+    # Boolean mask of shape (num_envs,capacity) marking the slots holding an entity
+    def active(self):
+        return np.arange(self.capacity)[None,:]<self.count[:,None]
+
+    # Double the capacity of every field
+    def _grow(self, capacity):
+        while(self.capacity<capacity):
+            self.capacity*=2
+        for f in self.fields:
+            old = getattr(self, f)
+            new = np.zeros((old.shape[0],self.capacity), dtype=np.int64)
+            new[:,:old.shape[1]] = old
+            setattr(self, f, new)
+
+    # Append a single entity to the end of game i
+    def add(self, i, **values):
+        if(self.count[i]>=self.capacity):
+            self._grow(self.count[i]+1)
+        for f in self.fields:
+            getattr(self, f)[i,self.count[i]] = values[f]
+        self.count[i]+=1
+
+    # Append the entities selected by the (num_envs,k) mask new, in column order, taking each field from the
+    # corresponding (num_envs,k) array in values
+    def extend(self, new, **values):
+        games, cols = np.nonzero(new)
+        if(len(games)==0):
+            return
+        slots = self.count[games]+np.cumsum(new, axis=1)[games,cols]-1
+        if(slots.max()>=self.capacity):
+            self._grow(slots.max()+1)
+        for f in self.fields:
+            getattr(self, f)[games,slots] = np.broadcast_to(values[f], new.shape)[games,cols]
+        self.count += np.count_nonzero(new, axis=1)
+
+    # Remove the entities selected by the (num_envs,capacity) mask dead, keeping the survivors in order
+    def remove(self, dead):
+        games = np.flatnonzero(dead.any(axis=1))
+        if(len(games)==0):
+            return
+        keep = self.active()[games]&~dead[games]
+        order = np.argsort(~keep, axis=1, kind='stable')
+        for f in self.fields:
+            values = getattr(self, f)
+            values[games] = np.take_along_axis(values[games], order, axis=1)
+        self.count[games] = np.count_nonzero(keep, axis=1)
+
+    # Remove every entity of the games selected by the boolean mask
+    def clear(self, mask):
+        self.count[mask] = 0
+
+
+#####################################################################################################################
+# BatchEnv
+#
+# Steps num_envs games of Seaquest at once. Bullets, fish, subs and divers are held in fixed-capacity EntityPools and
+# collisions are resolved on grid cells: every entity is reduced to a cell index and the entities of two kinds that
+# interact are paired up by matching cells. Where Env resolves a collision by taking the first matching entry of a
+# list, the entities sharing a cell are ranked by their list order and the k-th entity of one kind is paired with
+# the k-th of the other, which reproduces the list based rules exactly. Surfacing, oxygen and ramping are vectorized
+# over games. Only spawning draws random numbers, so spawns are done per game from its own RandomState seeded with
+# seeds[i], which makes game i reproduce Env(seed=seeds[i]) frame for frame given the same actions.
+#
+#####################################################################################################################
+class BatchEnv:
+    def __init__(self, num_envs, ramping = True, seeds = None):
+        self.channels ={
+            'sub_front':0,
+            'sub_back':1,
+            'friendly_bullet':2,
+            'trail':3,
+            'enemy_bullet':4,
+            'enemy_fish':5,
+            'enemy_sub':6,
+            'oxygen_guage':7,
+            'diver_guage':8,
+            'diver':9
+        }
+        self.action_map = ['n','l','u','r','d','f']
+        self.ramping = ramping
+        self.num_envs = num_envs
+        if(seeds is None):
+            seeds = [None]*num_envs
+        self.randoms = [np.random.RandomState(s) for s in seeds]
+        self.index = np.arange(num_envs)
+        self.f_bullets = EntityPool(num_envs, ['x','y','lr'])
+        self.e_bullets = EntityPool(num_envs, ['x','y','lr'])
+        self.e_fish = EntityPool(num_envs, ['x','y','lr','move_timer'])
+        self.e_subs = EntityPool(num_envs, ['x','y','lr','move_timer','shot_timer'])
+        self.divers = EntityPool(num_envs, ['x','y','lr','move_timer'])
+        self.oxygen = np.zeros(num_envs, dtype=np.int64)
+        self.diver_count = np.zeros(num_envs, dtype=np.int64)
+        self.sub_x = np.zeros(num_envs, dtype=np.int64)
+        self.sub_y = np.zeros(num_envs, dtype=np.int64)
+        self.sub_or = np.zeros(num_envs, dtype=bool)
+        self.e_spawn_speed = np.zeros(num_envs, dtype=np.int64)
+        self.e_spawn_timer = np.zeros(num_envs, dtype=np.int64)
+        self.d_spawn_timer = np.zeros(num_envs, dtype=np.int64)
+        self.move_speed = np.zeros(num_envs, dtype=np.int64)
+        self.ramp_index = np.zeros(num_envs, dtype=np.int64)
+        self.shot_timer = np.zeros(num_envs, dtype=np.int64)
+        self.surface = np.zeros(num_envs, dtype=bool)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        self.reset()
+
+    # Update every game according to the corresponding entry of a, returns (rewards, terminals)
+    def act(self, a):
+        a = np.asarray(a)
+        live = ~self.terminal
+        r = np.zeros(self.num_envs, dtype=np.int64)
+
+        # Spawn enemy if timer is up
+        spawn = live&(self.e_spawn_timer==0)
+        for i in self.index[spawn]:
+            self._spawn_enemy(i)
+        self.e_spawn_timer = np.where(spawn, self.e_spawn_speed, self.e_spawn_timer)
+
+        spawn = live&(self.d_spawn_timer==0)
+        for i in self.index[spawn]:
+            self._spawn_diver(i)
+        self.d_spawn_timer = np.where(spawn, diver_spawn_speed, self.d_spawn_timer)
+
+        # Resolve player action
+        fire = live&(a==5)&(self.shot_timer==0)
+        self.f_bullets.extend(fire[:,None], x=self.sub_x[:,None], y=self.sub_y[:,None], lr=self.sub_or[:,None])
+        self.shot_timer = np.where(fire, shot_cool_down, self.shot_timer)
+        left = live&(a==1)
+        right = live&(a==3)
+        self.sub_x = np.where(left, np.maximum(0, self.sub_x-1), self.sub_x)
+        self.sub_x = np.where(right, np.minimum(9, self.sub_x+1), self.sub_x)
+        self.sub_or = np.where(left, False, np.where(right, True, self.sub_or))
+        self.sub_y = np.where(live&(a==2), np.maximum(0, self.sub_y-1), self.sub_y)
+        self.sub_y = np.where(live&(a==4), np.minimum(8, self.sub_y+1), self.sub_y)
+        player = (self.sub_y*10+self.sub_x)[:,None]
+
+        # Update friendly Bullets, the bullets are visited newest first and each one strikes the first fish in its
+        # cell, or failing that the first sub
+        fb = self.f_bullets
+        moving = fb.active()&live[:,None]
+        fb.x += np.where(moving, 2*fb.lr-1, 0)
+        out = moving&((fb.x<0)|(fb.x>9))
+        bullet_cell = np.where(moving&~out, fb.y*10+fb.x, -1)
+        fish_cell = np.where(self.e_fish.active(), self.e_fish.y*10+self.e_fish.x, -1)
+        sub_cell = np.where(self.e_subs.active(), self.e_subs.y*10+self.e_subs.x, -1)
+        enemy_cell = np.concatenate([fish_cell, sub_cell], axis=1)
+        enemy_order = np.arange(enemy_cell.shape[1])[None,:]
+        bullet_hit, enemy_hit = self._pair(bullet_cell, -np.arange(fb.capacity)[None,:], enemy_cell, enemy_order)
+        r += np.count_nonzero(bullet_hit, axis=1)
+        fb.remove(out|bullet_hit)
+        self.e_fish.remove(enemy_hit[:,:self.e_fish.capacity])
+        self.e_subs.remove(enemy_hit[:,self.e_fish.capacity:])
+
+        # Update divers, divers reached by the player are picked up newest first until 6 are on board
+        dv = self.divers
+        active = dv.active()&live[:,None]
+        before = active&(dv.y*10+dv.x==player)
+        moving = active&(dv.move_timer==0)
+        new_x = np.where(moving, dv.x+2*dv.lr-1, dv.x)
+        out = moving&((new_x<0)|(new_x>9))
+        after = moving&~out&(dv.y*10+new_x==player)
+        reached = before|after
+        later = np.cumsum(reached[:,::-1], axis=1)[:,::-1]-reached
+        picked = reached&(later<(6-self.diver_count)[:,None])
+        self.diver_count += np.count_nonzero(picked, axis=1)
+        dv.x = new_x
+        dv.move_timer = np.where(moving, diver_move_interval, dv.move_timer-active)
+        dv.remove(picked|out)
+
+        # Update enemy subs and fish
+        sub_moved, sub_out = self._move_enemies(self.e_subs, live, player)
+        fish_moved, fish_out = self._move_enemies(self.e_fish, live, player)
+
+        # Subs and then fish that moved onto friendly bullets, each visited newest first, strike the first bullet in
+        # their cell
+        fb = self.f_bullets
+        bullet_cell = np.where(fb.active(), fb.y*10+fb.x, -1)
+        sub_cell = np.where(sub_moved, self.e_subs.y*10+self.e_subs.x, -1)
+        fish_cell = np.where(fish_moved, self.e_fish.y*10+self.e_fish.x, -1)
+        enemy_cell = np.concatenate([sub_cell, fish_cell], axis=1)
+        enemy_order = np.concatenate([-np.arange(self.e_subs.capacity)-self.e_fish.capacity, -np.arange(self.e_fish.capacity)])
+        bullet_hit, enemy_hit = self._pair(bullet_cell, np.arange(fb.capacity)[None,:], enemy_cell, enemy_order[None,:])
+        r += np.count_nonzero(bullet_hit, axis=1)
+        fb.remove(bullet_hit)
+
+        # Subs fire even on the frame they are struck, those that left the screen fire out of bounds and their bullets
+        # are discarded below
+        es = self.e_subs
+        active = es.active()&live[:,None]
+        shoot = active&(es.shot_timer==0)
+        es.shot_timer = np.where(shoot, enemy_shot_interval, es.shot_timer-active)
+        self.e_bullets.extend(shoot&~sub_out, x=es.x, y=es.y, lr=es.lr)
+        es.remove(sub_out|enemy_hit[:,:es.capacity])
+        self.e_fish.remove(fish_out|enemy_hit[:,es.capacity:])
+
+        # Update enemy bullets
+        eb = self.e_bullets
+        moving = eb.active()&live[:,None]
+        self.terminal |= (moving&(eb.y*10+eb.x==player)).any(axis=1)
+        eb.x += np.where(moving, 2*eb.lr-1, 0)
+        out = moving&((eb.x<0)|(eb.x>9))
+        self.terminal |= (moving&~out&(eb.y*10+eb.x==player)).any(axis=1)
+        eb.remove(out)
+
+        # Update various timers
+        self.e_spawn_timer -= live&(self.e_spawn_timer>0)
+        self.d_spawn_timer -= live&(self.d_spawn_timer>0)
+        self.shot_timer -= live&(self.shot_timer>0)
+        self.terminal |= live&(self.oxygen<0)
+        below = live&(self.sub_y>0)
+        self.oxygen -= below
+        self.surface &= ~below
+        arrived = live&~below&~self.surface
+        self.terminal |= arrived&(self.diver_count==0)
+        surfacing = arrived&(self.diver_count!=0)
+        if(surfacing.any()):
+            r += self._surface(surfacing)
+        return r, self.terminal.copy()
+
+    # Pair up entities of two kinds that share a cell. cells are (num_envs,k) arrays holding -1 for entities that do
+    # not take part, and order gives the order in which entities of each kind are visited. Within a cell the n-th
+    # entity of kind a is paired with the n-th entity of kind b. Returns masks of the paired entities of each kind.
+    def _pair(self, cell_a, order_a, cell_b, order_b):
+        hit_a = np.zeros(cell_a.shape, dtype=bool)
+        hit_b = np.zeros(cell_b.shape, dtype=bool)
+        games = np.flatnonzero((cell_a>=0).any(axis=1)&(cell_b>=0).any(axis=1))
+        if(len(games)==0):
+            return hit_a, hit_b
+        cell_a = cell_a[games]
+        cell_b = cell_b[games]
+        order_a = np.broadcast_to(order_a, cell_a.shape)
+        order_b = np.broadcast_to(order_b, cell_b.shape)
+        rank_a = ((cell_a[:,:,None]==cell_a[:,None,:])&(order_a[:,None,:]<order_a[:,:,None])).sum(axis=2)
+        rank_b = ((cell_b[:,:,None]==cell_b[:,None,:])&(order_b[:,None,:]<order_b[:,:,None])).sum(axis=2)
+        pairs = (cell_a[:,:,None]==cell_b[:,None,:])&(cell_a[:,:,None]>=0)&(rank_a[:,:,None]==rank_b[:,None,:])
+        hit_a[games] = pairs.any(axis=2)
+        hit_b[games] = pairs.any(axis=1)
+        return hit_a, hit_b
+
+    # Move the subs or fish in pool, flagging games where one touches the player as terminal. Returns a mask of the
+    # entities that moved onto a cell other than the player's, and a mask of those that left the screen.
+    def _move_enemies(self, pool, live, player):
+        active = pool.active()&live[:,None]
+        self.terminal |= (active&(pool.y*10+pool.x==player)).any(axis=1)
+        moving = active&(pool.move_timer==0)
+        pool.move_timer = np.where(moving, self.move_speed[:,None], pool.move_timer-active)
+        pool.x += np.where(moving, 2*pool.lr-1, 0)
+        out = moving&((pool.x<0)|(pool.x>9))
+        caught = moving&~out&(pool.y*10+pool.x==player)
+        self.terminal |= caught.any(axis=1)
+        return moving&~out&~caught, out
+
+    # Called for the games in mask where the player hits the surface with divers on board, if they have 6 divers
+    # this gives reward proportional to the remaining oxygen, otherwise this reduces the number of divers, in both
+    # cases full oxygen is restored
+    def _surface(self, mask):
+        self.surface |= mask
+        full = mask&(self.diver_count==6)
+        r = np.where(full, self.oxygen*10//max_oxygen, 0)
+        self.diver_count = np.where(full, 0, self.diver_count)
+        self.oxygen = np.where(mask, max_oxygen, self.oxygen)
+        self.diver_count -= mask
+        if self.ramping:
+            ramp = mask&((self.e_spawn_speed>1)|(self.move_speed>2))
+            self.move_speed -= ramp&(self.move_speed>2)&(self.ramp_index%2==1)
+            self.e_spawn_speed -= ramp&(self.e_spawn_speed>1)
+            self.ramp_index += ramp
+        return r
+
+    # Spawn an enemy fish or submarine in game i in random row and random direction,
+    # if the resulting row and direction would lead to a collision, do nothing instead.
+    # RandomState.choice draws randint(len(a)) from the stream, or a single random_sample compared against the
+    # cumulative p when p is given, so the draws below consume the stream exactly as Env does with less overhead.
+    def _spawn_enemy(self, i):
+        random = self.randoms[i]
+        lr = random.randint(2)==0
+        is_sub = random.random_sample()<1/3
+        x = 0 if lr else 9
+        y = 1+random.randint(8)
+
+        # Do not spawn in same row an opposite direction as existing
+        for pool in [self.e_subs, self.e_fish]:
+            n = pool.count[i]
+            if(n and ((pool.y[i,:n]==y)&(pool.lr[i,:n]!=lr)).any()):
+                return
+        if(is_sub):
+            self.e_subs.add(i, x=x, y=y, lr=lr, move_timer=self.move_speed[i], shot_timer=enemy_shot_interval)
+        else:
+            self.e_fish.add(i, x=x, y=y, lr=lr, move_timer=self.move_speed[i])
+
+    # Spawn a diver in game i in random row with random direction
+    def _spawn_diver(self, i):
+        random = self.randoms[i]
+        lr = random.randint(2)==0
+        x = 0 if lr else 9
+        y = 1+random.randint(8)
+        self.divers.add(i, x=x, y=y, lr=lr, move_timer=diver_move_interval)
+
+    # Query the current level of the difficulty ramp of every game
+    def difficulty_ramp(self):
+        return self.ramp_index.copy()
+
+    # Process the game-states into the num_envsx10x10xn states provided to the agent, writing into out if given
+    def state(self, out=None):
+        if(out is None):
+            state = np.zeros((self.num_envs,10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        state[self.index,self.sub_y,self.sub_x,self.channels['sub_front']] = 1
+        back_x = np.where(self.sub_or, self.sub_x-1, self.sub_x+1)
+        state[self.index,self.sub_y,back_x,self.channels['sub_back']] = 1
+        # Gauge lengths follow Python slice semantics, a negative oxygen level fills all but the last cells
+        columns = np.arange(10)[None,:]
+        oxygen = self.oxygen*10//max_oxygen
+        oxygen = np.where(oxygen<0, np.maximum(0, oxygen+10), oxygen)
+        state[:,9,:,self.channels['oxygen_guage']] = columns<oxygen[:,None]
+        state[:,9,:,self.channels['diver_guage']] = (columns>=(9-self.diver_count)[:,None])&(columns<9)
+        for pool, channel, trail in [(self.f_bullets,'friendly_bullet',False), (self.e_bullets,'enemy_bullet',False),
+                                     (self.e_fish,'enemy_fish',True), (self.e_subs,'enemy_sub',True),
+                                     (self.divers,'diver',True)]:
+            games, slots = np.nonzero(pool.active())
+            x = pool.x[games,slots]
+            y = pool.y[games,slots]
+            state[games,y,x,self.channels[channel]] = 1
+            if(trail):
+                back_x = np.where(pool.lr[games,slots], x-1, x+1)
+                visible = (back_x>=0)&(back_x<=9)
+                state[games[visible],y[visible],back_x[visible],self.channels['trail']] = 1
+        return state
+
+    # Fixed size array form of continuous_state for every game (see minatar.objects), returns float32 coordinates of
+    # shape (num_envs,n,max_objects,2) and a boolean mask of shape (num_envs,n,max_objects)
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        n = self.num_envs
+        channels = [np.full((n,1), self.channels['sub_front']), np.full((n,1), self.channels['sub_back'])]
+        xs = [self.sub_x[:,None], np.where(self.sub_or, self.sub_x-1, self.sub_x+1)[:,None]]
+        ys = [self.sub_y[:,None], self.sub_y[:,None]]
+        valids = [np.ones((n,1), dtype=bool), np.ones((n,1), dtype=bool)]
+        gauge = np.tile(np.arange(10), (n,1))
+        channels += [np.full((n,10), self.channels['oxygen_guage']), np.full((n,10), self.channels['diver_guage'])]
+        xs += [gauge, gauge]
+        ys += [np.full((n,10), 9), np.full((n,10), 9)]
+        valids += [gauge<(self.oxygen*10//max_oxygen)[:,None], (gauge>=(9-self.diver_count)[:,None])&(gauge<9)]
+        for pool, c in [(self.f_bullets, 'friendly_bullet'), (self.e_bullets, 'enemy_bullet')]:
+            channels.append(np.full(pool.x.shape, self.channels[c]))
+            xs.append(pool.x)
+            ys.append(pool.y)
+            valids.append(pool.active())
+        for pool, c, interval in [(self.e_fish, 'enemy_fish', self.move_speed[:,None]+1),
+                                  (self.e_subs, 'enemy_sub', self.move_speed[:,None]+1),
+                                  (self.divers, 'diver', diver_move_interval+1)]:
+            x = pool.x+np.where(pool.lr, 1, -1)*(1.0-pool.move_timer/interval)
+            back_x = np.where(pool.lr, x-1, x+1)
+            active = pool.active()
+            channels += [np.full(pool.x.shape, self.channels[c]), np.full(pool.x.shape, self.channels['trail'])]
+            xs += [x, back_x]
+            ys += [pool.y, pool.y]
+            valids += [active, active&(back_x>=0)&(back_x<=9)]
+        return scatter_objects(np.concatenate(channels, axis=1), np.concatenate(xs, axis=1), np.concatenate(ys, axis=1),
+                               np.concatenate(valids, axis=1), len(self.channels), max_objects, coords, mask)
+
+    # Reset the games selected by the boolean mask (all games if mask is None) to the start state for a new episode
+    def reset(self, mask=None):
+        if(mask is None):
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.oxygen[mask] = max_oxygen
+        self.diver_count[mask] = 0
+        self.sub_x[mask] = 5
+        self.sub_y[mask] = 0
+        # 0=left, 1=right
+        self.sub_or[mask] = False
+        for pool in [self.f_bullets, self.e_bullets, self.e_fish, self.e_subs, self.divers]:
+            pool.clear(mask)
+        self.e_spawn_speed[mask] = init_spawn_speed
+        self.e_spawn_timer[mask] = init_spawn_speed
+        self.d_spawn_timer[mask] = diver_spawn_speed
+        self.move_speed[mask] = init_move_interval
+        self.ramp_index[mask] = 0
+        self.shot_timer[mask] = 0
+        self.surface[mask] = True
+        self.terminal[mask] = False
+
+    # Dimensionality of the game-state of a single game (10x10xn)
+    def state_shape(self):
+        return [10,10,len(self.channels)]
+
+    # Subset of actions that actually have a unique impact in this environment
+    def minimal_action_set(self):
+        minimal_actions = ['n','l','u','r','d','f']
+        return [self.action_map.index(x) for x in minimal_actions]
@@ -4,6 +4,9 @@
 # Tian Tian (ttian@ualberta.ca)                                                                                #
 ################################################################################################################
 import numpy as np
+from minatar import bitboard
+from minatar.objects import object_arrays, grid_objects, scatter_objects
+from minatar.snapshot import is_snapshot, pack_snapshot, unpack_snapshot, rng_state, set_rng_state
 
 
 #####################################################################################################################
@@ -41,6 +44,7 @@ class Env:
         self.action_map = ['n','l','u','r','d','f']
         self.ramping = ramping
         self.random = np.random.RandomState(seed)
+        self.timer = None
         self.reset()
 
     # Update environment according to agent action
@@ -49,6 +53,10 @@ class Env:
         if(self.terminal):
             return r, self.terminal
 
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+
         a = self.action_map[a]
 
         # Resolve player action
@@ -59,6 +67,8 @@ class Env:
             self.pos = max(0, self.pos-1)
         elif(a=='r'):
             self.pos = min(9, self.pos+1)
+        if(timer is not None):
+            timer.lap('player_move')
 
         # Update Friendly Bullets
         self.f_bullet_map = np.roll(self.f_bullet_map, -1, axis=0)
@@ -69,6 +79,8 @@ class Env:
         self.e_bullet_map[0,:] = 0
         if(self.e_bullet_map[9,self.pos]):
             self.terminal = True
+        if(timer is not None):
+            timer.lap('bullet_update')
 
         # Update aliens
         if(self.alien_map[9,self.pos]):
@@ -84,11 +96,15 @@ class Env:
                 self.alien_map = np.roll(self.alien_map, self.alien_dir, axis=1)
             if(self.alien_map[9,self.pos]):
                 self.terminal = True
+        if(timer is not None):
+            timer.lap('alien_move')
         if(self.alien_shot_timer==0):
             self.alien_shot_timer = enemy_shot_interval
             nearest_alien = self._nearest_alien(self.pos)
             self.e_bullet_map[nearest_alien[0], nearest_alien[1]] = 1
 
+        if(timer is not None):
+            timer.lap('alien_shot')
         kill_locations = np.logical_and(self.alien_map,self.alien_map==self.f_bullet_map)
 
         r+=np.sum(kill_locations)
@@ -104,6 +120,8 @@ class Env:
                 self.enemy_move_interval-=1
                 self.ramp_index+=1
             self.alien_map[0:4,2:8] = 1
+        if(timer is not None):
+            timer.lap('collision_and_ramp')
         return r, self.terminal
 
     # Find the alien closest to player in manhattan distance, currently used to decide which alien shoots
@@ -119,9 +137,24 @@ class Env:
     def difficulty_ramp(self):
         return self.ramp_index
             
-    # Process the game-state into the 10x10xn state provided to the agent and return
-    def state(self):
-        state = np.zeros((10,10,len(self.channels)),dtype=bool)
+    # Process the game-state into the 10x10xn state provided to the agent and return. If out is given the state is
+    # written into it in place instead, out can be any array (or view) of shape 10x10xn and any numeric dtype.
+    def state(self, out=None):
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+        if(out is None):
+            state = np.zeros((10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...] = 0
+        self._paint(state)
+        if(timer is not None):
+            timer.lap('observation')
+        return state
+
+    # Set the cells of the zeroed state occupied by the current game objects
+    def _paint(self, state):
         state[9,self.pos,self.channels['cannon']] = 1
         state[:,:, self.channels['alien']] = self.alien_map
         if(self.alien_dir<0):
@@ -130,7 +163,6 @@ class Env:
             state[:,:, self.channels['alien_right']] = self.alien_map
         state[:,:, self.channels['friendly_bullet']] = self.f_bullet_map
         state[:,:, self.channels['enemy_bullet']] = self.e_bullet_map
-        return state
 
     # Reset to start state for new episode
     def reset(self):
@@ -179,7 +211,48 @@ class Env:
                     objByColor[self.channels['enemy_bullet']].append((float(c), float(r)))
         return objByColor
     
-    def save_state(self):
+    # Fixed size array form of continuous_state (see minatar.objects), returns float32 coordinates of shape
+    # (n,max_objects,2) and a boolean mask of shape (n,max_objects), written into coords and mask if given
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        coords, mask = object_arrays(len(self.channels), max_objects, coords, mask)
+        coords[self.channels['cannon'],0] = self.pos, 9
+        mask[self.channels['cannon'],0] = True
+        alien_map = self.alien_map
+        offset = 1 - self.alien_move_timer/min(np.count_nonzero(alien_map),self.enemy_move_interval)
+        horiz = 1
+        if((np.sum(alien_map[:,0])>0 and self.alien_dir<0) or (np.sum(alien_map[:,9])>0 and self.alien_dir>0)):
+            horiz = 0
+        dx = horiz*self.alien_dir*offset
+        dy = (1 - horiz)*offset
+        grid_objects(coords, mask, self.channels['alien'], alien_map, dx, dy)
+        grid_objects(coords, mask, self.channels['alien_left' if self.alien_dir<0 else 'alien_right'], alien_map, dx, dy)
+        grid_objects(coords, mask, self.channels['friendly_bullet'], self.f_bullet_map)
+        grid_objects(coords, mask, self.channels['enemy_bullet'], self.e_bullet_map)
+        return coords, mask
+
+    # Return an in-memory copy of the game state, including the RNG state, that can be passed to restore any number of
+    # times. Cheaper than save_state/load_state since nothing is serialized.
+    def clone(self):
+        return (self.pos, self.f_bullet_map.copy(), self.e_bullet_map.copy(), self.alien_map.copy(), self.alien_dir,
+                self.enemy_move_interval, self.alien_move_timer, self.alien_shot_timer, self.ramp_index, self.shot_timer,
+                self.terminal, rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.pos, f_bullet_map, e_bullet_map, alien_map, self.alien_dir, self.enemy_move_interval, \
+            self.alien_move_timer, self.alien_shot_timer, self.ramp_index, self.shot_timer, self.terminal, rng = snapshot
+        self.f_bullet_map = f_bullet_map.copy()
+        self.e_bullet_map = e_bullet_map.copy()
+        self.alien_map = alien_map.copy()
+        set_rng_state(self.random, rng)
+
+    # Return a string that represents the current state of the game (not including the RNG state), or if binary is
+    # True a compact binary snapshot (see minatar.snapshot) that also includes the RNG state
+    def save_state(self, binary=False):
+        if(binary):
+            ints = [self.pos, self.alien_dir, self.enemy_move_interval, self.alien_move_timer, self.alien_shot_timer,
+                    self.ramp_index, self.shot_timer, self.terminal]
+            return pack_snapshot(b'i', ints, [self.f_bullet_map, self.e_bullet_map, self.alien_map], self.random)
         state_str  = str(self.pos) + " "
         for r in range(10):
             for c in range(10):
@@ -199,22 +272,31 @@ class Env:
         state_str += str(int(self.terminal))
         return state_str
 
+    # Restore a state returned by save_state, binary snapshots also restore the RNG state
     def load_state(self, state_str):
+        if(is_snapshot(state_str)):
+            ints, maps, _ = unpack_snapshot(b'i', state_str, self.random)
+            self.pos, self.alien_dir, self.enemy_move_interval, self.alien_move_timer, self.alien_shot_timer, \
+                self.ramp_index, self.shot_timer, terminal = ints
+            self.terminal = bool(terminal)
+            self.f_bullet_map, self.e_bullet_map, self.alien_map = [m.astype(float) for m in maps]
+            return
         state_lst = state_str.split()
         state_iter = iter(state_lst)
-        self.pos = int(next(state_iter))        
-        self.f_bullet_map = np.zeros((10,10))
+        self.pos = int(next(state_iter))
+        f_bullet_map = np.zeros((10,10))
         for r in range(10):
             for c in range(10):
-                self.f_bullet_map[r, c] = float(next(state_iter))
-        self.e_bullet_map = np.zeros((10,10))
+                f_bullet_map[r, c] = float(next(state_iter))
+        e_bullet_map = np.zeros((10,10))
         for r in range(10):
             for c in range(10):
-                self.e_bullet_map[r, c] = float(next(state_iter))
-        self.alien_map = np.zeros((10,10))
+                e_bullet_map[r, c] = float(next(state_iter))
+        alien_map = np.zeros((10,10))
         for r in range(10):
             for c in range(10):
-                self.alien_map[r, c] = float(next(state_iter))
+                alien_map[r, c] = float(next(state_iter))
+        self.f_bullet_map, self.e_bullet_map, self.alien_map = f_bullet_map, e_bullet_map, alien_map
         self.alien_dir = int(next(state_iter))
         self.enemy_move_interval = int(next(state_iter))
         self.alien_move_timer = int(next(state_iter))
@@ -224,3 +306,410 @@ class Env:
         self.terminal = bool(int(next(state_iter)))
         
         
+
+
+# Bitboards of the alien formation at the start of a wave, of the cells that stay in place when a bitboard is shifted
+# one column left or right, and the columns searched by _nearest_alien for every cannon position
+initial_aliens = bitboard.rect(0, 4, 2, 8)
+keep_left = bitboard.full^bitboard.col_masks[9]
+keep_right = bitboard.full^bitboard.col_masks[0]
+search_orders = [sorted(range(10), key=lambda x: abs(x-pos)) for pos in range(10)]
+
+
+#####################################################################################################################
+# BitboardEnv
+#
+# Env with the alien, friendly bullet and enemy bullet maps held as 100 bit integers (see minatar.bitboard) instead
+# of float arrays. Bullets move by shifting a whole row, the formation moves by a row or column shift with wraparound
+# like np.roll, edge tests and kills are masks, alien counts are popcounts and the nearest alien in a column is the
+# highest set bit. Plays exactly like Env and produces the same states, snapshots and save_state strings. The three
+# maps are still available as properties that convert to and from the array layout of Env.
+#
+#####################################################################################################################
+class BitboardEnv(Env):
+    @property
+    def alien_map(self):
+        return bitboard.to_array(self.aliens)
+
+    @alien_map.setter
+    def alien_map(self, alien_map):
+        self.aliens = bitboard.to_bits(alien_map)
+
+    @property
+    def f_bullet_map(self):
+        return bitboard.to_array(self.f_bullets)
+
+    @f_bullet_map.setter
+    def f_bullet_map(self, f_bullet_map):
+        self.f_bullets = bitboard.to_bits(f_bullet_map)
+
+    @property
+    def e_bullet_map(self):
+        return bitboard.to_array(self.e_bullets)
+
+    @e_bullet_map.setter
+    def e_bullet_map(self, e_bullet_map):
+        self.e_bullets = bitboard.to_bits(e_bullet_map)
+
+    # Update environment according to agent action
+    def act(self, a):
+        r = 0
+        if(self.terminal):
+            return r, self.terminal
+
+        timer = self.timer
+        if(timer is not None):
+            timer.start()
+
+        a = self.action_map[a]
+        cannon = 1<<(90+self.pos)
+
+        # Resolve player action
+        if(a=='f' and self.shot_timer == 0):
+            self.f_bullets |= cannon
+            self.shot_timer = shot_cool_down
+        elif(a=='l'):
+            self.pos = max(0, self.pos-1)
+        elif(a=='r'):
+            self.pos = min(9, self.pos+1)
+        cannon = 1<<(90+self.pos)
+        if(timer is not None):
+            timer.lap('player_move')
+
+        # Update Friendly Bullets, the top row is shifted out
+        self.f_bullets >>= 10
+
+        # Update Enemy Bullets, the bottom row is shifted out
+        self.e_bullets = (self.e_bullets<<10)&bitboard.full
+        if(self.e_bullets&cannon):
+            self.terminal = True
+        if(timer is not None):
+            timer.lap('bullet_update')
+
+        # Update aliens
+        aliens = self.aliens
+        if(aliens&cannon):
+            self.terminal = True
+        if(self.alien_move_timer==0):
+            self.alien_move_timer = min(bitboard.popcount(aliens),self.enemy_move_interval)
+            if((aliens&bitboard.col_masks[0] and self.alien_dir<0) or (aliens&bitboard.col_masks[9] and self.alien_dir>0)):
+                self.alien_dir = -self.alien_dir
+                if(aliens&bitboard.row_masks[9]):
+                    self.terminal = True
+                aliens = ((aliens<<10)&bitboard.full)|(aliens>>90)
+            elif(self.alien_dir<0):
+                aliens = ((aliens>>1)&keep_left)|((aliens&bitboard.col_masks[0])<<9)
+            else:
+                aliens = ((aliens<<1)&keep_right)|((aliens&bitboard.col_masks[9])>>9)
+            if(aliens&cannon):
+                self.terminal = True
+        if(timer is not None):
+            timer.lap('alien_move')
+        if(self.alien_shot_timer==0):
+            self.alien_shot_timer = enemy_shot_interval
+            self.aliens = aliens
+            nearest_alien = self._nearest_alien(self.pos)
+            self.e_bullets |= 1<<(10*nearest_alien[0]+nearest_alien[1])
+
+        if(timer is not None):
+            timer.lap('alien_shot')
+        kill_locations = aliens&self.f_bullets
+
+        r+=bitboard.popcount(kill_locations)
+        aliens ^= kill_locations
+        self.f_bullets ^= kill_locations
+
+        # Update various timers
+        self.shot_timer -= self.shot_timer>0
+        self.alien_move_timer-=1
+        self.alien_shot_timer-=1
+        if(aliens==0):
+            if(self.enemy_move_interval>6 and self.ramping):
+                self.enemy_move_interval-=1
+                self.ramp_index+=1
+            aliens = initial_aliens
+        self.aliens = aliens
+        if(timer is not None):
+            timer.lap('collision_and_ramp')
+        return r, self.terminal
+
+    # Find the alien closest to player in manhattan distance, the lowest alien of the nearest non-empty column
+    def _nearest_alien(self, pos):
+        for i in search_orders[pos]:
+            column = self.aliens&bitboard.col_masks[i]
+            if(column):
+                return [(column.bit_length()-1)//10,i]
+        return None
+
+    # Set the cells of the zeroed state occupied by the current game objects, see Env._paint
+    def _paint(self, state):
+        state[9,self.pos,self.channels['cannon']] = 1
+        alien_map, f_bullet_map, e_bullet_map = bitboard.to_planes([self.aliens, self.f_bullets, self.e_bullets])
+        state[:,:, self.channels['alien']] = alien_map
+        if(self.alien_dir<0):
+            state[:,:, self.channels['alien_left']] = alien_map
+        else:
+            state[:,:, self.channels['alien_right']] = alien_map
+        state[:,:, self.channels['friendly_bullet']] = f_bullet_map
+        state[:,:, self.channels['enemy_bullet']] = e_bullet_map
+
+    # Paint the state from scratch into the 10x10xn array state and remember what was painted for _paint_changes
+    def _repaint(self, state):
+        self.state(out=state)
+        self.painted = (self.pos, self.aliens, self.alien_dir<0, self.f_bullets, self.e_bullets)
+
+    # Bring flat, the flattened array last painted by _repaint or _paint_changes, up to date with the current
+    # game-state. Only the cells where a map differs from the painted one are written, so the alien planes are left
+    # alone between formation moves and kills and a bullet step touches just the bullets that moved.
+    def _paint_changes(self, flat):
+        n = len(self.channels)
+        pos, aliens, left, f_bullets, e_bullets = self.painted
+        if(self.pos!=pos):
+            channel = self.channels['cannon']
+            flat[(90+pos)*n+channel] = 0
+            flat[(90+self.pos)*n+channel] = 1
+        new_left = self.alien_dir<0
+        if(self.aliens!=aliens or new_left!=left):
+            bitboard.paint_changes(flat, n, self.channels['alien'], aliens, self.aliens)
+            bitboard.paint_changes(flat, n, self.channels['alien_left'], aliens if left else 0,
+                                   self.aliens if new_left else 0)
+            bitboard.paint_changes(flat, n, self.channels['alien_right'], 0 if left else aliens,
+                                   0 if new_left else self.aliens)
+        if(self.f_bullets!=f_bullets):
+            bitboard.paint_changes(flat, n, self.channels['friendly_bullet'], f_bullets, self.f_bullets)
+        if(self.e_bullets!=e_bullets):
+            bitboard.paint_changes(flat, n, self.channels['enemy_bullet'], e_bullets, self.e_bullets)
+        self.painted = (self.pos, self.aliens, new_left, self.f_bullets, self.e_bullets)
+
+    # Reset to start state for new episode
+    def reset(self):
+        self.pos = 5
+        self.f_bullets = 0
+        self.e_bullets = 0
+        self.aliens = initial_aliens
+        self.alien_dir = -1
+        self.enemy_move_interval = enemy_move_interval
+        self.alien_move_timer = self.enemy_move_interval
+        self.alien_shot_timer = enemy_shot_interval
+        self.ramp_index = 0
+        self.shot_timer = 0
+        self.terminal = False
+
+    def continuous_state(self):
+        objByColor = [[] for i in range(len(self.channels))]
+        objByColor[self.channels['cannon']].append((float(self.pos), 9.0))
+        offset = 1 - self.alien_move_timer/min(bitboard.popcount(self.aliens),self.enemy_move_interval)
+        horiz = 1
+        if((self.aliens&bitboard.col_masks[0] and self.alien_dir<0) or (self.aliens&bitboard.col_masks[9] and self.alien_dir>0)):
+            horiz = 0
+        for c, r in bitboard.cells(self.aliens):
+            alienX = c + horiz*self.alien_dir*offset
+            alienY = r + (1 - horiz)*offset
+            objByColor[self.channels['alien']].append((float(alienX), float(alienY)))
+            if self.alien_dir < 0:
+                objByColor[self.channels['alien_left']].append((float(alienX), float(alienY)))
+            else:
+                objByColor[self.channels['alien_right']].append((float(alienX), float(alienY)))
+        for c, r in bitboard.cells(self.f_bullets):
+            objByColor[self.channels['friendly_bullet']].append((float(c), float(r)))
+        for c, r in bitboard.cells(self.e_bullets):
+            objByColor[self.channels['enemy_bullet']].append((float(c), float(r)))
+        return objByColor
+
+    # Return an in-memory copy of the game state, see Env.clone
+    def clone(self):
+        return (self.pos, self.f_bullets, self.e_bullets, self.aliens, self.alien_dir, self.enemy_move_interval,
+                self.alien_move_timer, self.alien_shot_timer, self.ramp_index, self.shot_timer, self.terminal,
+                rng_state(self.random))
+
+    # Restore a copy of the game state returned by clone
+    def restore(self, snapshot):
+        self.pos, self.f_bullets, self.e_bullets, self.aliens, self.alien_dir, self.enemy_move_interval, \
+            self.alien_move_timer, self.alien_shot_timer, self.ramp_index, self.shot_timer, self.terminal, rng = snapshot
+        set_rng_state(self.random, rng)
+
+
+#####################################################################################################################
+# BatchEnv
+#
+# Steps num_envs games of Space Invaders at once. The alien, friendly bullet and enemy bullet maps of every game are
+# stacked into boolean arrays of shape (num_envs,10,10), and the cannon position, alien direction, alien timers and
+# enemy_move_interval are held per game in arrays of shape (num_envs,). Bullet shifts, formation moves, edge
+# detection, kill resolution and wave respawns are done for all games at once so that the NumPy call overhead is
+# amortized over the batch. This game draws no random numbers, seeds are accepted for consistency with the other
+# games. Game i reproduces Env() frame for frame given the same actions.
+#
+#####################################################################################################################
+class BatchEnv:
+    def __init__(self, num_envs, ramping = True, seeds = None):
+        self.channels ={
+            'cannon':0,
+            'alien':1,
+            'alien_left':2,
+            'alien_right':3,
+            'friendly_bullet':4,
+            'enemy_bullet':5
+        }
+        self.action_map = ['n','l','u','r','d','f']
+        self.ramping = ramping
+        self.num_envs = num_envs
+        if(seeds is None):
+            seeds = [None]*num_envs
+        self.randoms = [np.random.RandomState(s) for s in seeds]
+        self.index = np.arange(num_envs)
+        self.pos = np.zeros(num_envs, dtype=np.int64)
+        self.f_bullet_map = np.zeros((num_envs,10,10), dtype=bool)
+        self.e_bullet_map = np.zeros((num_envs,10,10), dtype=bool)
+        self.alien_map = np.zeros((num_envs,10,10), dtype=bool)
+        self.alien_dir = np.zeros(num_envs, dtype=np.int64)
+        self.enemy_move_interval = np.zeros(num_envs, dtype=np.int64)
+        self.alien_move_timer = np.zeros(num_envs, dtype=np.int64)
+        self.alien_shot_timer = np.zeros(num_envs, dtype=np.int64)
+        self.ramp_index = np.zeros(num_envs, dtype=np.int64)
+        self.shot_timer = np.zeros(num_envs, dtype=np.int64)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        # Order in which _nearest_alien searches the columns: by distance from the cannon, lower column first on ties
+        self.search_key = np.abs(np.arange(10)[None,:]-np.arange(10)[:,None])*10+np.arange(10)[None,:]
+        self.reset()
+
+    # Update every game according to the corresponding entry of a, returns (rewards, terminals)
+    def act(self, a):
+        a = np.asarray(a)
+        live = ~self.terminal
+        alien_map = self.alien_map
+
+        # Resolve player action
+        fire = live&(a==5)&(self.shot_timer==0)
+        self.f_bullet_map[self.index[fire],9,self.pos[fire]] = True
+        self.shot_timer = np.where(fire, shot_cool_down, self.shot_timer)
+        self.pos = np.where(live&(a==1), np.maximum(0, self.pos-1), self.pos)
+        self.pos = np.where(live&(a==3), np.minimum(9, self.pos+1), self.pos)
+
+        # Update Friendly Bullets
+        self.f_bullet_map[live,:9] = self.f_bullet_map[live,1:]
+        self.f_bullet_map[live,9] = False
+
+        # Update Enemy Bullets
+        self.e_bullet_map[live,1:] = self.e_bullet_map[live,:9]
+        self.e_bullet_map[live,0] = False
+        self.terminal |= live&self.e_bullet_map[self.index,9,self.pos]
+
+        # Update aliens
+        self.terminal |= live&alien_map[self.index,9,self.pos]
+        move = live&(self.alien_move_timer==0)
+        if(move.any()):
+            count = np.count_nonzero(alien_map.reshape(self.num_envs,100), axis=1)
+            self.alien_move_timer = np.where(move, np.minimum(count, self.enemy_move_interval), self.alien_move_timer)
+            edge = (alien_map[:,:,0].any(axis=1)&(self.alien_dir<0))|(alien_map[:,:,9].any(axis=1)&(self.alien_dir>0))
+            down = move&edge
+            self.alien_dir = np.where(down, -self.alien_dir, self.alien_dir)
+            self.terminal |= down&alien_map[:,9,:].any(axis=1)
+            alien_map[down] = np.roll(alien_map[down], 1, axis=1)
+            left = move&~edge&(self.alien_dir<0)
+            alien_map[left] = np.roll(alien_map[left], -1, axis=2)
+            right = move&~edge&(self.alien_dir>0)
+            alien_map[right] = np.roll(alien_map[right], 1, axis=2)
+            self.terminal |= move&alien_map[self.index,9,self.pos]
+        shoot = live&(self.alien_shot_timer==0)
+        if(shoot.any()):
+            self.alien_shot_timer = np.where(shoot, enemy_shot_interval, self.alien_shot_timer)
+            games = self.index[shoot]
+            row, col = self._nearest_alien(games)
+            self.e_bullet_map[games,row,col] = True
+
+        kill_locations = alien_map&self.f_bullet_map
+        kill_locations[~live] = False
+        r = np.count_nonzero(kill_locations.reshape(self.num_envs,100), axis=1)
+        alien_map &= ~kill_locations
+        self.f_bullet_map &= ~kill_locations
+
+        # Update various timers
+        self.shot_timer -= live&(self.shot_timer>0)
+        self.alien_move_timer -= live
+        self.alien_shot_timer -= live
+        cleared = live&~alien_map.any(axis=(1,2))
+        if(cleared.any()):
+            if(self.ramping):
+                ramp = cleared&(self.enemy_move_interval>6)
+                self.enemy_move_interval -= ramp
+                self.ramp_index += ramp
+            alien_map[cleared,0:4,2:8] = True
+        return r, self.terminal.copy()
+
+    # Find the alien closest to the cannon in manhattan distance for each of the given games, currently used to
+    # decide which alien shoots, returns the rows and columns of the selected aliens
+    def _nearest_alien(self, games):
+        columns = self.alien_map[games].any(axis=1)
+        key = np.where(columns, self.search_key[self.pos[games]], 100)
+        col = np.argmin(key, axis=1)
+        row = 9-np.argmax(self.alien_map[games,::-1,col], axis=1)
+        return row, col
+
+    # Query the current level of the difficulty ramp of every game
+    def difficulty_ramp(self):
+        return self.ramp_index.copy()
+
+    # Process the game-states into the num_envsx10x10xn states provided to the agent, writing into out if given
+    def state(self, out=None):
+        if(out is None):
+            state = np.zeros((self.num_envs,10,10,len(self.channels)),dtype=bool)
+        else:
+            state = out
+            state[...,self.channels['cannon']] = 0
+        state[self.index,9,self.pos,self.channels['cannon']] = 1
+        state[...,self.channels['alien']] = self.alien_map
+        state[...,self.channels['alien_left']] = self.alien_map&(self.alien_dir<0)[:,None,None]
+        state[...,self.channels['alien_right']] = self.alien_map&(self.alien_dir>0)[:,None,None]
+        state[...,self.channels['friendly_bullet']] = self.f_bullet_map
+        state[...,self.channels['enemy_bullet']] = self.e_bullet_map
+        return state
+
+    # Fixed size array form of continuous_state for every game (see minatar.objects), returns float32 coordinates of
+    # shape (num_envs,n,max_objects,2) and a boolean mask of shape (num_envs,n,max_objects)
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        n = self.num_envs
+        cells = np.arange(100)
+        aliens = self.alien_map.reshape(n,100)
+        offset = 1 - self.alien_move_timer/np.minimum(np.count_nonzero(aliens, axis=1), self.enemy_move_interval)
+        edge = (self.alien_map[:,:,0].any(axis=1)&(self.alien_dir<0))|(self.alien_map[:,:,9].any(axis=1)&(self.alien_dir>0))
+        horiz = (~edge).astype(np.int64)
+        alien_x = cells%10+(horiz*self.alien_dir*offset)[:,None]
+        alien_y = cells//10+((1 - horiz)*offset)[:,None]
+        grid_x = np.tile(cells%10, (n,1))
+        grid_y = np.tile(cells//10, (n,1))
+        dir_channel = np.where(self.alien_dir<0, self.channels['alien_left'], self.channels['alien_right'])
+        channel = np.concatenate([np.full((n,1), self.channels['cannon']), np.full((n,100), self.channels['alien']),
+                                  np.repeat(dir_channel[:,None], 100, axis=1),
+                                  np.full((n,100), self.channels['friendly_bullet']),
+                                  np.full((n,100), self.channels['enemy_bullet'])], axis=1)
+        x = np.concatenate([self.pos[:,None], alien_x, alien_x, grid_x, grid_x], axis=1)
+        y = np.concatenate([np.full((n,1), 9), alien_y, alien_y, grid_y, grid_y], axis=1)
+        valid = np.concatenate([np.ones((n,1), dtype=bool), aliens, aliens, self.f_bullet_map.reshape(n,100),
+                                self.e_bullet_map.reshape(n,100)], axis=1)
+        return scatter_objects(channel, x, y, valid, len(self.channels), max_objects, coords, mask)
+
+    # Reset the games selected by the boolean mask (all games if mask is None) to the start state for a new episode
+    def reset(self, mask=None):
+        if(mask is None):
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.pos[mask] = 5
+        self.f_bullet_map[mask] = False
+        self.e_bullet_map[mask] = False
+        self.alien_map[mask] = False
+        self.alien_map[mask,0:4,2:8] = True
+        self.alien_dir[mask] = -1
+        self.enemy_move_interval[mask] = enemy_move_interval
+        self.alien_move_timer[mask] = enemy_move_interval
+        self.alien_shot_timer[mask] = enemy_shot_interval
+        self.ramp_index[mask] = 0
+        self.shot_timer[mask] = 0
+        self.terminal[mask] = False
+
+    # Dimensionality of the game-state of a single game (10x10xn)
+    def state_shape(self):
+        return [10,10,len(self.channels)]
+
+    # Subset of actions that actually have a unique impact in this environment
+    def minimal_action_set(self):
+        minimal_actions = ['n','l','r','f']
+        return [self.action_map.index(x) for x in minimal_actions]
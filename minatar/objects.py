@@ -0,0 +1,103 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import numpy as np
+
+
+#####################################################################################################################
+# Object arrays
+#
+# Fixed size array form of continuous_state. The objects of a game are returned as float32 coordinates of shape
+# (n,max_objects,2), holding the (x,y) position of the k-th object of channel c at [c,k], together with a boolean
+# mask of shape (n,max_objects) marking the slots that hold an object. Objects are listed in the same order as in
+# continuous_state, unused slots are zero, and objects beyond max_objects in a channel are dropped. Batched versions
+# add a leading num_envs dimension.
+#
+#####################################################################################################################
+
+# Zeroed coordinate and mask arrays for n_channels channels with leading dimensions lead, or coords and mask zeroed in
+# place if they are given
+def object_arrays(n_channels, max_objects, coords=None, mask=None, lead=()):
+    if(max_objects<1):
+        raise ValueError('max_objects must be positive, got '+str(max_objects))
+    if(coords is None):
+        coords = np.zeros(lead+(n_channels,max_objects,2), dtype=np.float32)
+    else:
+        coords[...] = 0
+    if(mask is None):
+        mask = np.zeros(lead+(n_channels,max_objects), dtype=bool)
+    else:
+        mask[...] = False
+    return coords, mask
+
+
+# Object arrays of a single game from the per channel lists of (x,y) tuples returned by continuous_state
+def objects_to_array(objByColor, max_objects, coords=None, mask=None):
+    coords, mask = object_arrays(len(objByColor), max_objects, coords, mask)
+    # Indices of the slots in use and their coordinates, written with one assignment per array
+    channels, slots, values = [], [], []
+    for c, objects in enumerate(objByColor):
+        n = min(len(objects), max_objects)
+        channels.extend([c]*n)
+        slots.extend(range(n))
+        values.extend(objects[:n])
+    if(values):
+        coords[channels,slots] = np.array(values, dtype=np.float32)
+        mask[channels,slots] = True
+    return coords, mask
+
+
+# Write the object at (x,y) into the next free slot of channel c of the object arrays of a single game, where counts
+# holds the number of slots already used per channel. The object is dropped if the channel is full.
+def put_object(coords, mask, counts, c, x, y):
+    k = counts[c]
+    if(k<coords.shape[1]):
+        coords[c,k,0] = x
+        coords[c,k,1] = y
+        mask[c,k] = True
+        counts[c] = k+1
+
+
+# Write the objects of a single game lying on the nonzero cells of the 10x10 array grid into channel c, with
+# horizontal and vertical offsets added to their coordinates
+def grid_objects(coords, mask, c, grid, dx=0.0, dy=0.0):
+    ys, xs = np.nonzero(grid)
+    n = min(len(xs), coords.shape[1])
+    coords[c,:n,0] = xs[:n]+dx
+    coords[c,:n,1] = ys[:n]+dy
+    mask[c,:n] = True
+
+
+#####################################################################################################################
+# scatter_objects
+#
+# Batched object arrays from candidate objects. channel, x, y and valid are arrays of shape (num_envs,m) listing m
+# candidate objects per game, of which those with valid set are written. Within each game and channel the objects
+# take consecutive slots in the order of the m axis, which is the order of continuous_state when the candidates are
+# concatenated the way the game lists them. Returns the (num_envs,n_channels,max_objects,2) coordinates and
+# (num_envs,n_channels,max_objects) mask.
+#
+#####################################################################################################################
+def scatter_objects(channel, x, y, valid, n_channels, max_objects, coords=None, mask=None):
+    coords, mask = object_arrays(n_channels, max_objects, coords, mask, lead=channel.shape[:1])
+    games, objects = np.nonzero(valid)
+    c = channel[games,objects]
+    # Sorting the objects by game and channel, stably so that the order of the m axis is kept within each group, makes
+    # every group contiguous and the slot of an object its distance from the start of its group
+    group = games*n_channels+c
+    order = np.argsort(group, kind='stable')
+    group = group[order]
+    start = np.flatnonzero(np.concatenate([[True], group[1:]!=group[:-1]]))
+    slot = np.arange(len(group))-np.repeat(start, np.diff(np.append(start, len(group))))
+    keep = slot<max_objects
+    order = order[keep]
+    slot = slot[keep]
+    games = games[order]
+    objects = objects[order]
+    c = c[order]
+    coords[games,c,slot,0] = x[games,objects]
+    coords[games,c,slot,1] = y[games,objects]
+    mask[games,c,slot] = True
+    return coords, mask
@@ -0,0 +1,50 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import numpy as np
+
+
+#####################################################################################################################
+# Bit-packed states
+#
+# A game-state is a 10x10xn boolean array, which takes 100n bytes as bool but only 100n bits of information. These
+# functions convert single states or stacks of states (any number of leading dimensions) to and from uint8 arrays of
+# packed_size(n) bytes per state. Bits are laid out in channel first order, so the same packed bytes decode directly
+# into the nx10x10 layout expected by convolutional networks.
+#
+#####################################################################################################################
+
+# Number of bytes used to store one packed game-state with n_channels channels
+def packed_size(n_channels):
+    return (100*n_channels+7)//8
+
+
+# Pack a state of shape (...,10,10,n), or (...,n,10,10) if channels_first is True, into uint8 of shape
+# (...,packed_size(n))
+def pack_state(state, channels_first=False):
+    state = np.asarray(state)
+    lead = state.shape[:-3]
+    if(not channels_first):
+        d = len(lead)
+        state = state.transpose(tuple(range(d))+(d+2,d,d+1))
+    if(state.dtype!=bool):
+        state = state!=0
+    return np.packbits(state.reshape(lead+(100*state.shape[-3],)), axis=-1)
+
+
+# Unpack states packed by pack_state into shape (...,10,10,n_channels), or (...,n_channels,10,10) if channels_first
+# is True. The result has the given dtype and is written into out if given. With channels_first=True and a float32
+# dtype this is a single unpack and cast, suitable for decoding a sampled batch straight into a network input that
+# shares memory with a torch tensor.
+def unpack_state(packed, n_channels, channels_first=False, dtype=bool, out=None):
+    packed = np.asarray(packed, dtype=np.uint8)
+    lead = packed.shape[:-1]
+    bits = np.unpackbits(packed, axis=-1, count=100*n_channels).reshape(lead+(n_channels,10,10))
+    if(not channels_first):
+        bits = np.moveaxis(bits, -3, -1)
+    if(out is None):
+        return bits.astype(dtype)
+    np.copyto(out, bits, casting='unsafe')
+    return out
@@ -0,0 +1,43 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import time
+
+
+#####################################################################################################################
+# PhaseTimer
+#
+# Accumulates wall time and call counts per named phase of a game. The games call start() when act (or state) begins
+# and lap(phase) at the end of every phase, which charges the time since the previous start or lap to that phase.
+# Every Env has a timer attribute that is None unless profiling is enabled, so when it is off the cost is one
+# attribute lookup and a few "is not None" checks per frame.
+#
+#####################################################################################################################
+class PhaseTimer:
+    def __init__(self):
+        self.clock = time.perf_counter
+        self.reset()
+
+    # Discard all accumulated times and counts
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.last = self.clock()
+
+    # Mark the beginning of a timed section
+    def start(self):
+        self.last = self.clock()
+
+    # Charge the time since the last start or lap to phase
+    def lap(self, phase):
+        now = self.clock()
+        self.times[phase] = self.times.get(phase, 0.0)+now-self.last
+        self.calls[phase] = self.calls.get(phase, 0)+1
+        self.last = now
+
+    # Dictionary mapping every phase to its total time in seconds, number of calls and mean time per call
+    def stats(self):
+        return {phase: {'time': self.times[phase], 'calls': self.calls[phase],
+                        'mean': self.times[phase]/self.calls[phase]} for phase in self.times}
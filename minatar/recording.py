@@ -0,0 +1,254 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import json, os, queue, re, shutil, threading
+import numpy as np
+from minatar.packing import pack_state, unpack_state, packed_size
+
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+chunk_pattern = re.compile(r'^chunk_(\d+)(\.npz)?$')
+
+
+# Name, dtype and per row shape of the columns of a recording whose observations pack into packed bytes
+def column_layout(packed):
+    return [
+        ('observation', np.uint8, (packed,)),
+        ('action', np.uint8, ()),
+        ('reward', np.float32, ()),
+        ('terminal', bool, ()),
+        ('env', np.int32, ()),
+    ]
+
+
+# Write the columns of one chunk to directory, as a subdirectory of .npy files or as a compressed .npz shard. The
+# chunk is written under a temporary name and renamed when complete, so readers never see a partial chunk.
+def write_chunk(directory, index, chunk, compress):
+    name = os.path.join(directory, 'chunk_%06d' % index)
+    if(compress):
+        with open(name+'.tmp', 'wb') as f:
+            np.savez_compressed(f, **chunk)
+        os.replace(name+'.tmp', name+'.npz')
+        return
+    if(os.path.isdir(name+'.tmp')):
+        shutil.rmtree(name+'.tmp')
+    os.makedirs(name+'.tmp')
+    for column, values in chunk.items():
+        np.save(os.path.join(name+'.tmp', column+'.npy'), values)
+    os.replace(name+'.tmp', name)
+
+
+#####################################################################################################################
+# Recorder
+#
+# Wraps an Environment or a VecEnvironment (or SubprocVecEnvironment) and records every frame played through act or
+# step into a directory of column chunks. A row holds the bit-packed observation the action was taken in (see
+# minatar.packing), the action passed to act (before sticky actions are applied), the reward, whether the frame was
+# terminal, and the instance it belongs to, vectorized environments add num_envs rows per step. Every
+# snapshot_interval frames of an Environment the binary snapshot (see minatar.snapshot) taken before the frame is
+# stored as well, which restores the game, its RNG and the sticky action state exactly.
+#
+# Rows are accumulated in preallocated arrays of chunk_size rows. Full chunks are handed to a background thread that
+# writes them, so stepping only waits on disk if queue_size chunks are already waiting to be written. With
+# compress=False a chunk is a subdirectory of .npy files which RecordingReader memory-maps, with compress=True it is
+# a compressed .npz shard. Call close (or use the recorder as a context manager) to write the last partial chunk.
+# Every other attribute is forwarded to the wrapped environment.
+#
+#####################################################################################################################
+class Recorder:
+    def __init__(self, env, directory, chunk_size = 4096, compress = False, snapshot_interval = 1000, queue_size = 8):
+        self.env = env
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.vectorized = hasattr(env, 'num_envs')
+        self.num_envs = env.num_envs if self.vectorized else 1
+        self.n_channels = env.state_shape()[2]
+        self.snapshot_interval = snapshot_interval if hasattr(env, 'save_state') else 0
+        self.layout = column_layout(packed_size(self.n_channels))
+        self.env_index = np.arange(self.num_envs, dtype=np.int32)
+        self.rows = 0
+        self.frames = 0
+        self.chunk_index = 0
+        self.error = None
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        if(any(map(chunk_pattern.match, os.listdir(directory)))):
+            raise ValueError(directory+' already contains a recording')
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({'format': FORMAT_VERSION, 'game': env.game_name(), 'n_channels': self.n_channels,
+                       'num_envs': self.num_envs, 'chunk_size': chunk_size, 'compress': compress,
+                       'snapshot_interval': self.snapshot_interval}, f, indent=2)
+        self._new_chunk()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        if(name=='env'):
+            raise AttributeError(name)
+        return getattr(self.env, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Record and play one frame of a wrapped Environment, returns (reward, terminal)
+    def act(self, a):
+        if(self.closed):
+            raise RuntimeError('Recorder is closed')
+        if(self.snapshot_interval and self.frames%self.snapshot_interval==0):
+            self.snapshot_rows.append(self.rows)
+            self.snapshot_data.append(self.env.save_state(binary=True))
+        columns = self.columns
+        row = self.fill
+        columns['observation'][row] = pack_state(self.env.state())
+        reward, terminal = self.env.act(a)
+        columns['action'][row] = a
+        columns['reward'][row] = reward
+        columns['terminal'][row] = terminal
+        self.fill += 1
+        self.rows += 1
+        self.frames += 1
+        if(self.fill==self.chunk_size):
+            self._flush()
+        return reward, terminal
+
+    # Record and play one step of a wrapped vectorized environment, returns (observations, rewards, terminals)
+    def step(self, actions):
+        observations = pack_state(self.env.state())
+        result = self.env.step(actions)
+        self._append(observations, actions, result[1], result[2])
+        self.frames += 1
+        return result
+
+    # Wrapper for env.reset
+    def reset(self, *args):
+        return self.env.reset(*args)
+
+    # Write the last partial chunk, wait for the background writer to finish and raise any error it hit
+    def close(self):
+        if(self.closed):
+            return
+        self.closed = True
+        self._flush()
+        self.queue.put(None)
+        self.thread.join()
+        self._check_error()
+
+    # Copy rows into the current chunk, handing it to the writer whenever it fills up
+    def _append(self, observations, actions, rewards, terminals):
+        if(self.closed):
+            raise RuntimeError('Recorder is closed')
+        n = len(observations)
+        start = 0
+        while(start<n):
+            count = min(n-start, self.chunk_size-self.fill)
+            rows = slice(self.fill, self.fill+count)
+            self.columns['observation'][rows] = observations[start:start+count]
+            self.columns['action'][rows] = actions[start:start+count]
+            self.columns['reward'][rows] = rewards[start:start+count]
+            self.columns['terminal'][rows] = terminals[start:start+count]
+            self.columns['env'][rows] = self.env_index[start:start+count]
+            self.fill += count
+            self.rows += count
+            start += count
+            if(self.fill==self.chunk_size):
+                self._flush()
+
+    # Hand the rows and snapshots accumulated so far to the writer and start a new chunk
+    def _flush(self):
+        self._check_error()
+        if(self.fill==0 and not self.snapshot_data):
+            return
+        chunk = {name: values[:self.fill] for name, values in self.columns.items()}
+        chunk['snapshot_row'] = np.array(self.snapshot_rows, dtype=np.int64)
+        chunk['snapshot_offset'] = np.cumsum([0]+[len(s) for s in self.snapshot_data], dtype=np.int64)
+        chunk['snapshot_data'] = np.frombuffer(b''.join(self.snapshot_data), dtype=np.uint8)
+        self.queue.put((self.chunk_index, chunk))
+        self.chunk_index += 1
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self.columns = {name: np.zeros((self.chunk_size,)+shape, dtype=dtype) for name, dtype, shape in self.layout}
+        self.fill = 0
+        self.snapshot_rows = []
+        self.snapshot_data = []
+
+    def _check_error(self):
+        if(self.error is not None):
+            raise RuntimeError('Writing the recording failed') from self.error
+
+    # Body of the background thread, keeps draining the queue after an error so that the recorder never deadlocks
+    def _write_chunks(self):
+        while True:
+            item = self.queue.get()
+            if(item is None):
+                break
+            if(self.error is None):
+                try:
+                    write_chunk(self.directory, item[0], item[1], self.compress)
+                except Exception as e:
+                    self.error = e
+
+
+#####################################################################################################################
+# RecordingReader
+#
+# Read back a directory written by Recorder. The chunks of .npy files are memory-mapped, so opening a recording is
+# cheap and only the rows that are accessed are read from disk, compressed .npz shards are decompressed when opened.
+# Rows are numbered across chunks in the order they were recorded.
+#
+#####################################################################################################################
+class RecordingReader:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta = json.load(f)
+        if(self.meta['format']!=FORMAT_VERSION):
+            raise ValueError('Unsupported recording format '+str(self.meta['format']))
+        self.n_channels = self.meta['n_channels']
+        names = sorted((int(m.group(1)), m.group(0)) for m in map(chunk_pattern.match, os.listdir(directory)) if m)
+        self.chunks = [self._open_chunk(os.path.join(directory, name)) for _, name in names]
+        self.offsets = np.cumsum([0]+[len(c['action']) for c in self.chunks])
+
+    def _open_chunk(self, path):
+        if(path.endswith('.npz')):
+            with np.load(path) as npz:
+                return dict(npz)
+        return {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r') for name in os.listdir(path)}
+
+    # Total number of rows
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    # Rows [start,stop) of the named column as one array
+    def column(self, name, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        first = max(np.searchsorted(self.offsets, start, side='right')-1, 0)
+        parts = []
+        for i in range(first, len(self.chunks)):
+            if(self.offsets[i]>=stop):
+                break
+            parts.append(self.chunks[i][name][max(start-self.offsets[i], 0):stop-self.offsets[i]])
+        if(not parts):
+            return self.chunks[0][name][:0] if self.chunks else np.zeros(0)
+        return np.concatenate(parts)
+
+    # Unpacked observations of rows [start,stop), see minatar.packing.unpack_state
+    def observations(self, start=0, stop=None, channels_first=False, dtype=bool):
+        return unpack_state(self.column('observation', start, stop), self.n_channels, channels_first, dtype)
+
+    # List of (row, snapshot) pairs, each snapshot restores the game to the frame of its row with load_state
+    def snapshots(self):
+        result = []
+        for chunk in self.chunks:
+            data = chunk['snapshot_data']
+            offset = chunk['snapshot_offset']
+            for i, row in enumerate(chunk['snapshot_row']):
+                result.append((int(row), bytes(data[offset[i]:offset[i+1]])))
+        return result
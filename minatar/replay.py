@@ -0,0 +1,159 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import numpy as np
+from minatar.environment import Environment
+from minatar.environments import load_game
+from minatar.packing import pack_state, unpack_state, packed_size
+
+
+# Play actions[start:stop] in env, resetting after a terminal frame unless it is the last one when reset_on_terminal
+# is True. If out is given, the state before each action is written into the corresponding row of out, and the state
+# after the last action into the row after that if there is one.
+def play(env, actions, start, stop, reset_on_terminal=True, out=None, rewards=None, terminals=None):
+    last = len(actions)
+    for t in range(start, stop):
+        if(out is not None):
+            env.state(out=out[t-start])
+        reward, terminal = env.act(actions[t])
+        if(rewards is not None):
+            rewards[t] = reward
+            terminals[t] = terminal
+        if(terminal and reset_on_terminal and t+1<last):
+            env.reset()
+    if(out is not None and len(out)>stop-start):
+        env.state(out=out[stop-start])
+
+
+# Worker for decoding in parallel, returns the packed states of frames [start,stop) played from a checkpoint at start
+def decode_segment(args):
+    env_name, env_kwargs, checkpoint, actions, start, stop, reset_on_terminal = args
+    env = Environment(env_name, **env_kwargs)
+    env.restore(checkpoint)
+    out = np.zeros((stop-start,10,10,env.n_channels), dtype=bool)
+    play(env, actions, start, min(stop, len(actions)), reset_on_terminal, out)
+    return pack_state(out)
+
+
+#####################################################################################################################
+# Replay
+#
+# Deterministic replay of a trajectory given by the seed of an Environment and the list of actions passed to act.
+# Frame t is the game before actions[t] is taken, so a trajectory of n actions has n+1 frames, the last one after the
+# final action. With reset_on_terminal=True the game is reset after every terminal frame except the last, as in the
+# usual act/reset loop, so a trajectory may span several episodes.
+#
+# The trajectory is simulated once on construction, which records the reward and terminal flag of every action and
+# keeps an exact checkpoint (Environment.clone, which includes the game's RNG and the sticky action state) every
+# checkpoint_interval frames. Any frame can then be reached by restoring at most one checkpoint and playing fewer than
+# checkpoint_interval actions. Seeking forward from the current frame within the same interval plays on without a
+# restore, so sequential access costs one act per frame.
+#
+# Since all backends play identically, by default the game is replayed with the bitboard backend where there is one.
+#
+# states decodes a range of frames in bulk by seeking to the first and writing every state straight into one
+# preallocated array while playing on, avoiding an allocation and a copy per frame. With num_workers>1 the intervals
+# between checkpoints are decoded independently in worker processes, which return them bit-packed.
+#
+#####################################################################################################################
+class Replay:
+    def __init__(self, env_name, actions, random_seed, checkpoint_interval = 1000, sticky_action_prob = 0.1,
+                 difficulty_ramping = True, backend = None, reset_on_terminal = True):
+        if(checkpoint_interval<1):
+            raise ValueError('checkpoint_interval must be positive, got '+str(checkpoint_interval))
+        if(backend is None):
+            backend = 'bitboard' if hasattr(load_game(env_name), 'BitboardEnv') else 'numpy'
+        self.env_name = env_name
+        self.env_kwargs = {'sticky_action_prob': sticky_action_prob, 'difficulty_ramping': difficulty_ramping,
+                           'random_seed': random_seed, 'backend': backend}
+        self.actions = np.asarray(actions, dtype=np.int64)
+        self.checkpoint_interval = checkpoint_interval
+        self.reset_on_terminal = reset_on_terminal
+        self.env = Environment(env_name, **self.env_kwargs)
+        self.n_channels = self.env.n_channels
+        n = len(self.actions)
+        self.rewards = np.zeros(n, dtype=np.float32)
+        self.terminals = np.zeros(n, dtype=bool)
+        self.checkpoints = []
+        for start in range(0, n+1, checkpoint_interval):
+            self.checkpoints.append(self.env.clone())
+            play(self.env, self.actions, start, min(start+checkpoint_interval, n), reset_on_terminal,
+                 rewards=self.rewards, terminals=self.terminals)
+        self.position = n
+
+    # Number of frames, one more than the number of actions
+    def __len__(self):
+        return len(self.actions)+1
+
+    # Move the internal environment to frame
+    def _seek(self, frame):
+        if(frame<0 or frame>len(self.actions)):
+            raise IndexError('Frame '+str(frame)+' out of range for a replay of '+str(len(self))+' frames')
+        start = frame-frame%self.checkpoint_interval
+        if(not start<=self.position<=frame):
+            self.env.restore(self.checkpoints[start//self.checkpoint_interval])
+            self.position = start
+        play(self.env, self.actions, self.position, frame, self.reset_on_terminal)
+        self.position = frame
+
+    # State of frame as a 10x10xn array (nx10x10 if channels_first is True), written into out if given
+    def state(self, frame, out=None, channels_first=False):
+        self._seek(frame)
+        return self.env.state(out=out, channels_first=channels_first)
+
+    # In-memory copy of the environment at frame, for Environment.restore. Like Environment.clone it can only be
+    # restored into an Environment of the same backend as the replay (env_kwargs['backend']), use snapshot otherwise.
+    def clone(self, frame):
+        self._seek(frame)
+        return self.env.clone()
+
+    # Binary snapshot of the environment at frame (see Environment.save_state), which can be stored and loaded into
+    # any Environment of the same game to continue the trajectory exactly
+    def snapshot(self, frame):
+        self._seek(frame)
+        return self.env.save_state(binary=True)
+
+    # Decode the states of frames [start,stop) into an array of shape (stop-start,10,10,n), written into out if given.
+    # With packed=True the states are returned bit-packed instead (see minatar.packing). With num_workers>1 the
+    # intervals between checkpoints are decoded in that many worker processes.
+    def states(self, start=0, stop=None, out=None, packed=False, num_workers=1):
+        stop = len(self) if stop is None else stop
+        if(not 0<=start<=stop<=len(self)):
+            raise IndexError('Frames ['+str(start)+','+str(stop)+') out of range for a replay of '+str(len(self))+
+                             ' frames')
+        if(packed and out is None):
+            out = np.zeros((stop-start, packed_size(self.n_channels)), dtype=np.uint8)
+        elif(out is None):
+            out = np.zeros((stop-start,10,10,self.n_channels), dtype=bool)
+        if(stop==start):
+            return out
+        if(num_workers>1):
+            self._decode_parallel(start, stop, out, packed, num_workers)
+        elif(packed):
+            out[...] = pack_state(self.states(start, stop))
+        else:
+            # Only the first frame needs a seek, from there every state is written in place while playing on
+            self._seek(start)
+            end = min(stop, len(self.actions))
+            play(self.env, self.actions, start, end, self.reset_on_terminal, out)
+            self.position = end
+        return out
+
+    def _decode_parallel(self, start, stop, out, packed, num_workers):
+        from multiprocessing import get_context
+        interval = self.checkpoint_interval
+        first = start//interval
+        tasks = [(self.env_name, self.env_kwargs, self.checkpoints[k], self.actions, k*interval,
+                  min((k+1)*interval, len(self)), self.reset_on_terminal)
+                 for k in range(first, (stop-1)//interval+1)]
+        with get_context().Pool(min(num_workers, len(tasks))) as pool:
+            for k, segment in enumerate(pool.imap(decode_segment, tasks), first):
+                lo = max(start, k*interval)
+                hi = min(stop, (k+1)*interval)
+                segment = segment[lo-k*interval:hi-k*interval]
+                if(packed):
+                    out[lo-start:hi-start] = segment
+                else:
+                    unpack_state(segment, self.n_channels, out=out[lo-start:hi-start])
@@ -0,0 +1,109 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import ctypes
+import struct
+import numpy as np
+
+
+#####################################################################################################################
+# Binary snapshots
+#
+# Compact binary format used by save_state(binary=True) and load_state. A snapshot is laid out as
+#
+#   header: magic b'MNA', format version, one byte game tag, number of ints, number of maps
+#   ints:   the scalar fields of the game as little endian int32
+#   maps:   each 10x10 map as 100 bytes of booleans
+#   rng:    a flag, followed if set by the MT19937 state of the game's RandomState
+#
+# The MT19937 state (624 key words and the position) is copied directly out of and into the bit generator's C struct,
+# which is over 50x faster than RandomState.get_state/set_state. The cached Gaussian of the legacy RandomState is
+# not part of that struct and is not saved, none of the games draw from the normal distribution.
+#
+# Snapshots can be concatenated, unpack_snapshot returns the offset at which the next one starts.
+#
+#####################################################################################################################
+MAGIC = b'MNA'
+VERSION = 1
+header = struct.Struct('<3sBcHB')
+map_bytes = 100
+rng_bytes = 2500
+
+# Compiled struct for the header followed by n ints, cached per n since seaquest snapshots vary in length
+structs = {}
+def header_struct(n_ints):
+    if(n_ints not in structs):
+        structs[n_ints] = struct.Struct('<3sBcHB%di' % n_ints)
+    return structs[n_ints]
+
+
+# Raw MT19937 state of random, see above
+def rng_state(random):
+    return ctypes.string_at(random._bit_generator.ctypes.state_address, rng_bytes)
+
+
+# Restore a raw MT19937 state returned by rng_state into random
+def set_rng_state(random, raw):
+    ctypes.memmove(random._bit_generator.ctypes.state_address, raw, rng_bytes)
+
+
+# Split the state of a PCG64 bit generator (the dictionary of its state property) into 16 bit ints for pack_snapshot
+def pcg64_to_ints(state):
+    ints = [state['has_uint32']]
+    for value in [state['state']['state'], state['state']['inc'], state['uinteger']]:
+        ints.extend((value>>(16*k))&0xffff for k in range(8))
+    return ints
+
+
+# Inverse of pcg64_to_ints
+def ints_to_pcg64(ints):
+    values = [sum(ints[1+8*i+k]<<(16*k) for k in range(8)) for i in range(3)]
+    return {'bit_generator': 'PCG64', 'state': {'state': values[0], 'inc': values[1]}, 'has_uint32': ints[0],
+            'uinteger': values[2]}
+
+
+# True if state is a binary snapshot rather than a string from the original save_state format
+def is_snapshot(state):
+    return isinstance(state, (bytes, bytearray, memoryview))
+
+
+# Pack the given int fields, 10x10 maps and RandomState (if not None) into a snapshot tagged with tag. The fields must
+# be Python ints or bools, the games convert values drawn from their RandomState when storing them.
+def pack_snapshot(tag, ints, maps=(), random=None):
+    parts = [header_struct(len(ints)).pack(MAGIC, VERSION, tag, len(ints), len(maps), *ints)]
+    for m in maps:
+        parts.append(m.astype(bool).tobytes())
+    if(random is None):
+        parts.append(b'\x00')
+    else:
+        parts.append(b'\x01')
+        parts.append(rng_state(random))
+    return b''.join(parts)
+
+
+# Unpack a snapshot starting at offset in data, checking that it carries the expected tag. If the snapshot includes an
+# RNG state it is restored into random. Returns the int fields, a list of 10x10 boolean maps and the offset just past
+# the end of the snapshot.
+def unpack_snapshot(tag, data, random=None, offset=0):
+    magic, version, found_tag, n_ints, n_maps = header.unpack_from(data, offset)
+    if(magic!=MAGIC):
+        raise ValueError('Not a MinAtar snapshot')
+    if(version!=VERSION):
+        raise ValueError('Unsupported MinAtar snapshot version '+str(version))
+    if(found_tag!=tag):
+        raise ValueError('Snapshot is for '+repr(found_tag)+', expected '+repr(tag))
+    ints = header_struct(n_ints).unpack_from(data, offset)[5:]
+    offset += header.size+4*n_ints
+    maps = []
+    for _ in range(n_maps):
+        maps.append(np.frombuffer(data, dtype=bool, count=map_bytes, offset=offset).reshape(10,10))
+        offset += map_bytes
+    has_rng = data[offset]
+    offset += 1
+    if(has_rng):
+        if(random is not None):
+            set_rng_state(random, bytes(data[offset:offset+rng_bytes]))
+        offset += rng_bytes
+    return ints, maps, offset
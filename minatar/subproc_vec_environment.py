@@ -0,0 +1,346 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+import os, pickle, traceback
+import numpy as np
+from minatar.environments import load_game
+
+from .vec_environment import VecEnvironment
+
+
+# Single byte commands sent from the parent to the workers
+STEP = b's'
+RESET = b'r'
+CALL = b'm'
+CLOSE = b'c'
+
+# Arrays of the VecEnvironment of a worker that live in shared memory, and are exposed by SubprocVecEnvironment
+vec_arrays = ['observations', 'rewards', 'terminals', 'running_returns', 'running_lengths', 'final_observations',
+              'episode_returns', 'episode_lengths', 'episode_ramps']
+
+
+#####################################################################################################################
+# shared_arrays
+#
+# Lay out the arrays exchanged between the parent and the workers in one shared memory buffer. Returns a dict of
+# NumPy views over buf, or the number of bytes needed if buf is None.
+#
+#####################################################################################################################
+def shared_arrays(buf, num_envs, n_channels):
+    layout = [
+        ('actions', np.int64, (num_envs,)),
+        ('rewards', np.float32, (num_envs,)),
+        ('terminals', bool, (num_envs,)),
+        ('reset_mask', bool, (num_envs,)),
+        ('observations', bool, (num_envs,10,10,n_channels)),
+        ('running_returns', np.float32, (num_envs,)),
+        ('running_lengths', np.int64, (num_envs,)),
+        ('final_observations', bool, (num_envs,10,10,n_channels)),
+        ('episode_returns', np.float32, (num_envs,)),
+        ('episode_lengths', np.int64, (num_envs,)),
+        ('episode_ramps', np.int64, (num_envs,)),
+    ]
+    arrays = {}
+    offset = 0
+    for name, dtype, shape in layout:
+        offset = -(-offset//8)*8
+        if(buf is not None):
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += int(np.prod(shape))*np.dtype(dtype).itemsize
+    return arrays if buf is not None else offset
+
+
+#####################################################################################################################
+# worker
+#
+# Entry point of a worker process. Runs a VecEnvironment over the games [start,stop) whose returned arrays
+# (observations, rewards, terminals and the episode statistics) are the corresponding slices of the shared memory
+# block, so that stepping writes straight into memory the parent reads. Every command is answered with an empty message on success or a pickled traceback on failure.
+#
+#####################################################################################################################
+def worker(conn, shm_name, num_envs, n_channels, start, stop, env_name, env_kwargs):
+    shm = SharedMemory(name=shm_name)
+    arrays = shared_arrays(shm.buf, num_envs, n_channels)
+    try:
+        try:
+            env = VecEnvironment(env_name, stop-start, **env_kwargs)
+            for name in vec_arrays:
+                setattr(env, name, arrays[name][start:stop])
+            env.env.state(out=env.observations)
+            conn.send_bytes(b'')
+        except Exception:
+            conn.send_bytes(pickle.dumps(RuntimeError(traceback.format_exc())))
+            return
+        while True:
+            command = conn.recv_bytes()
+            if(command==CLOSE):
+                break
+            try:
+                if(command==STEP):
+                    env.step(arrays['actions'][start:stop])
+                    conn.send_bytes(b'')
+                elif(command==RESET):
+                    env.reset(arrays['reset_mask'][start:stop].copy())
+                    conn.send_bytes(b'')
+                elif(command[:1]==CALL):
+                    result = getattr(env, command[1:].decode())()
+                    conn.send_bytes(pickle.dumps(result))
+            except Exception:
+                conn.send_bytes(pickle.dumps(RuntimeError(traceback.format_exc())))
+    except (KeyboardInterrupt, EOFError, BrokenPipeError):
+        pass
+    finally:
+        env = arrays = None
+        shm.close()
+        conn.close()
+
+
+#####################################################################################################################
+# SubprocVecEnvironment
+#
+# Shards num_envs instances of one MinAtar game across worker processes, each running a VecEnvironment on its shard.
+# Actions, observations, rewards and terminals live in a single multiprocessing.shared_memory block that the parent
+# reads and writes as NumPy arrays, so nothing is pickled on the hot path: the parent writes the actions into shared
+# memory and sends a one byte command down a Pipe to each worker. The returned arrays are views of shared memory which
+# are overwritten by the next call to step or reset and become invalid after close. Seeding follows VecEnvironment,
+# instance i is seeded with random_seed+i and plays identically whatever the number of workers. If a worker dies, the
+# remaining workers are shut down and a RuntimeError is raised. auto_reset and the episode statistics
+# (running_returns, final_observations, episode_returns and so on) behave as in VecEnvironment, the arrays are views
+# of shared memory as well. engine is passed on to the VecEnvironment of every worker, so by default the engine is
+# picked by the size of each shard.
+#
+# Stepping can be split into step_async and step_wait so that the caller can do other work, such as running the
+# policy, while the workers simulate. The workers are divided into num_groups groups of contiguous instances that can
+# be stepped independently, which allows double buffering: with two groups, one half of the batch is simulated while
+# the network scores the observations of the other half. astep is an awaitable variant for asyncio code.
+#
+#####################################################################################################################
+class SubprocVecEnvironment:
+    def __init__(self, env_name, num_envs, num_workers = None, sticky_action_prob = 0.1, difficulty_ramping = True,
+                 random_seed = None, start_method = None, num_groups = 1, auto_reset = False,
+                 engine = None):
+        env_module = load_game(env_name)
+        self.env_name = env_name
+        self.num_envs = num_envs
+        self.n_channels = env_module.Env(ramping = difficulty_ramping).state_shape()[2]
+        if(num_workers is None):
+            num_workers = os.cpu_count() or 1
+        num_workers = max(1, min(num_workers, num_envs))
+        self.num_workers = num_workers
+        if(random_seed is None):
+            seeds = [None]*num_envs
+        elif(np.ndim(random_seed)==0):
+            seeds = [random_seed+i for i in range(num_envs)]
+        else:
+            seeds = list(random_seed)
+            if(len(seeds)!=num_envs):
+                raise ValueError('Expected '+str(num_envs)+' seeds, got '+str(len(seeds)))
+
+        self.closed = True
+        self.shm = SharedMemory(create=True, size=shared_arrays(None, num_envs, self.n_channels))
+        arrays = shared_arrays(self.shm.buf, num_envs, self.n_channels)
+        self.actions = arrays['actions']
+        self.reset_mask = arrays['reset_mask']
+        for name in vec_arrays:
+            setattr(self, name, arrays[name])
+        self.auto_reset = auto_reset
+
+        bounds = np.linspace(0, num_envs, num_workers+1).astype(int).tolist()
+        self.slices = [slice(bounds[w], bounds[w+1]) for w in range(num_workers)]
+        if(not 1<=num_groups<=num_workers):
+            raise ValueError('num_groups must be between 1 and the number of workers ('+str(num_workers)+')')
+        self.num_groups = num_groups
+        self.groups = [list(g) for g in np.array_split(np.arange(num_workers), num_groups)]
+        self.group_slices = [slice(bounds[g[0]], bounds[g[-1]+1]) for g in self.groups]
+        self.waiting = [False]*num_groups
+        context = get_context(start_method)
+        self.conns = []
+        self.processes = []
+        self.closed = False
+        for s in self.slices:
+            env_kwargs = {'sticky_action_prob':sticky_action_prob, 'difficulty_ramping':difficulty_ramping,
+                          'random_seed':seeds[s], 'auto_reset':auto_reset,
+                          'engine':engine}
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=worker, daemon=True,
+                                      args=(child_conn, self.shm.name, num_envs, self.n_channels, s.start, s.stop,
+                                            env_name, env_kwargs))
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+        self._wait(range(num_workers))
+
+    # Raise an error if the workers have been shut down
+    def _check_open(self):
+        if(self.closed):
+            raise RuntimeError('SubprocVecEnvironment has been closed')
+
+    # Send command to the given workers
+    def _send(self, workers, command):
+        for w in workers:
+            try:
+                self.conns[w].send_bytes(command)
+            except OSError:
+                self._died(w)
+
+    # Wait for the replies of the given workers and return them, shutting everything down if a worker has died
+    def _wait(self, workers):
+        replies = {}
+        pending = set(workers)
+        while pending:
+            ready = wait([self.conns[w] for w in pending]+[self.processes[w].sentinel for w in pending])
+            for w in list(pending):
+                if(self.conns[w].poll()):
+                    try:
+                        reply = self.conns[w].recv_bytes()
+                    except (EOFError, OSError):
+                        self._died(w)
+                    replies[w] = pickle.loads(reply) if reply else None
+                    pending.remove(w)
+                elif(self.processes[w].sentinel in ready):
+                    self._died(w)
+        for reply in replies.values():
+            if(isinstance(reply, Exception)):
+                self.close()
+                raise reply
+        return [replies[w] for w in workers]
+
+    # Shut everything down after worker w has died and report it
+    def _died(self, w):
+        self.processes[w].join(timeout=1)
+        exitcode = self.processes[w].exitcode
+        self.close()
+        raise RuntimeError('MinAtar worker '+str(w)+' died with exit code '+str(exitcode))
+
+    # Step every instance with the corresponding entry of actions, returns (observations, rewards, terminals)
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    # Start stepping the instances of group (all instances if group is None) with actions, which holds one entry per
+    # instance of the group, and return without waiting for the workers
+    def step_async(self, actions, group=None):
+        groups = range(self.num_groups) if group is None else [group]
+        s = slice(0, self.num_envs) if group is None else self.group_slices[group]
+        actions = np.asarray(actions, dtype=np.int64)
+        if(actions.shape!=(s.stop-s.start,)):
+            raise ValueError('Expected actions of shape ('+str(s.stop-s.start)+',), got '+str(actions.shape))
+        self._check_open()
+        if(any(self.waiting[g] for g in groups)):
+            raise RuntimeError('step_async called while a step is already in progress')
+        self.actions[s] = actions
+        for g in groups:
+            self._send(self.groups[g], STEP)
+            self.waiting[g] = True
+
+    # Wait for the step started by step_async on group (all instances if group is None) to finish and return the
+    # (observations, rewards, terminals) of its instances
+    def step_wait(self, group=None):
+        groups = range(self.num_groups) if group is None else [group]
+        s = slice(0, self.num_envs) if group is None else self.group_slices[group]
+        if(not all(self.waiting[g] for g in groups)):
+            raise RuntimeError('step_wait called without a matching step_async')
+        self._wait([w for g in groups for w in self.groups[g]])
+        for g in groups:
+            self.waiting[g] = False
+        return self.observations[s], self.rewards[s], self.terminals[s]
+
+    # Awaitable version of step for asyncio code, the wait for the workers runs in the default executor so the event
+    # loop stays free while the group is simulated
+    async def astep(self, actions, group=None):
+        import asyncio
+        self.step_async(actions, group)
+        return await asyncio.get_running_loop().run_in_executor(None, self.step_wait, group)
+
+    # Stacked states of all instances, shape (num_envs,10,10,n). If out is given the states are copied into it
+    # instead, out can have any numeric dtype and shape (num_envs,10,10,n), or (num_envs,n,10,10) if channels_first
+    # is True.
+    def state(self, out=None, channels_first=False):
+        observations = self.observations.transpose(0,3,1,2) if channels_first else self.observations
+        if(out is None):
+            return observations
+        np.copyto(out, observations)
+        return out
+
+    # Reset the instances selected by the boolean mask (all instances if mask is None) to the start of a new episode
+    # and return the stacked states
+    def reset(self, mask=None):
+        if(mask is None):
+            mask = np.ones(self.num_envs, dtype=bool)
+        self._check_open()
+        if(any(self.waiting)):
+            raise RuntimeError('reset called while a step is in progress')
+        self.reset_mask[:] = mask
+        workers = [w for w, s in enumerate(self.slices) if self.reset_mask[s].any()]
+        self._send(workers, RESET)
+        self._wait(workers)
+        return self.observations
+
+    # Call the named method of the VecEnvironment of every worker and return the list of results
+    def _call(self, name):
+        self._check_open()
+        if(any(self.waiting)):
+            raise RuntimeError(name+' called while a step is in progress')
+        workers = range(self.num_workers)
+        self._send(workers, CALL+name.encode())
+        return self._wait(workers)
+
+    # Dimensionality of the game-state of a single instance (10x10xn)
+    def state_shape(self):
+        return [10,10,self.n_channels]
+
+    # All MinAtar environments have 6 actions
+    def num_actions(self):
+        return 6
+
+    # Name of the MinAtar game associated with this environment
+    def game_name(self):
+        return self.env_name
+
+    # Subset of actions that actually have a unique impact, shared by every instance of the game
+    def minimal_action_set(self):
+        return self._call('minimal_action_set')[0]
+
+    # Current level of the difficulty ramp of every instance, None for games that do not ramp
+    def difficulty_ramp(self):
+        ramps = self._call('difficulty_ramp')
+        if(ramps[0] is None):
+            return None
+        return np.concatenate(ramps)
+
+    # Shut down the workers and release the shared memory
+    def close(self):
+        if(self.closed):
+            return
+        self.closed = True
+        for conn, process in zip(self.conns, self.processes):
+            try:
+                if(process.is_alive()):
+                    conn.send_bytes(CLOSE)
+            except (BrokenPipeError, OSError):
+                pass
+        for conn, process in zip(self.conns, self.processes):
+            process.join(timeout=1)
+            if(process.is_alive()):
+                process.terminate()
+                process.join()
+            conn.close()
+        del self.actions, self.reset_mask
+        for name in vec_arrays:
+            delattr(self, name)
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views of the observations are still held by the caller, the mapping is released when they are
+            pass
+        self.shm.unlink()
+
+    def __del__(self):
+        if(not getattr(self, 'closed', True)):
+            self.close()
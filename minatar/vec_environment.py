@@ -0,0 +1,252 @@
+################################################################################################################
+# Authors:                                                                                                     #
+# Kenny Young (kjyoung@ualberta.ca)                                                                            #
+# Tian Tian (ttian@ualberta.ca)                                                                                #
+################################################################################################################
+import numpy as np
+from minatar.environments import load_game
+from minatar.environment import sticky_block_size
+from minatar.objects import object_arrays
+
+# Smallest number of instances at which the vectorized BatchEnv of a game steps faster than one Env per instance. Below
+# it the per call overhead of the NumPy operations outweighs the work saved by batching.
+batch_crossover = {
+    'asterix': 32,
+    'breakout': 32,
+    'freeway': 8,
+    'seaquest': 256,
+    'space_invaders': 4,
+}
+
+
+#####################################################################################################################
+# VecEnvironment
+#
+# Steps num_envs independent instances of a single MinAtar game with one call. Actions are given as an int array of
+# shape (num_envs,) and observations, rewards and terminals are returned as stacked arrays of shape
+# (num_envs,10,10,n), (num_envs,) and (num_envs,). The returned arrays are preallocated and overwritten in place by
+# the next call to step or reset, copy them if they need to be kept. If random_seed is an int, instance i is seeded
+# with random_seed+i, a sequence of num_envs seeds can also be given directly. Every instance decides sticky actions
+# with its own generator, drawn in blocks of sticky_block_size as Environment does, and like Environment.reset a reset
+# keeps the last action of the instance for the next sticky decision. Given the same actions, instance i therefore
+# plays the same trajectory as Environment(env_name, random_seed=random_seed+i) that is reset whenever the instance
+# is, and its trajectory does not depend on the number of instances or on how SubprocVecEnvironment shards them.
+#
+# engine selects how the instances are stepped. 'batch' uses the vectorized BatchEnv of the game, 'serial' loops over
+# one Env per instance, and None (the default) uses BatchEnv only from num_envs instances on as listed in
+# batch_crossover (4 for space_invaders, 8 for freeway, 32 for asterix and breakout, 256 for seaquest). Both engines
+# play identically.
+#
+# The return and length of the current episode of every instance are kept in running_returns and running_lengths,
+# they stop changing once the instance is terminal until it is reset.
+# With auto_reset=True, instances that reach a terminal state are reset within step, so the returned observations
+# are already those of the new episodes and the actor loop never has to call reset. For every instance whose
+# terminals entry is set, the last observation of the finished episode is written to final_observations, and its
+# return, length and level of the difficulty ramp (zero for games that do not ramp) to episode_returns,
+# episode_lengths and episode_ramps. Like the other returned arrays these are overwritten by the next step, and only
+# the entries of instances that just finished are updated.
+#
+#####################################################################################################################
+class VecEnvironment:
+    def __init__(self, env_name, num_envs, sticky_action_prob = 0.1, difficulty_ramping = True, random_seed = None,
+                 auto_reset = False, engine = None):
+        env_module = load_game(env_name)
+        self.env_name = env_name
+        self.num_envs = num_envs
+        if(random_seed is None):
+            seeds = [None]*num_envs
+        elif(np.ndim(random_seed)==0):
+            seeds = [random_seed+i for i in range(num_envs)]
+        else:
+            seeds = list(random_seed)
+            if(len(seeds)!=num_envs):
+                raise ValueError('Expected '+str(num_envs)+' seeds, got '+str(len(seeds)))
+        if(engine is None):
+            batched = hasattr(env_module, 'BatchEnv') and num_envs>=batch_crossover.get(env_name, 1)
+            engine = 'batch' if batched else 'serial'
+        if(engine=='batch' and hasattr(env_module, 'BatchEnv')):
+            self.env = env_module.BatchEnv(num_envs, ramping = difficulty_ramping, seeds = seeds)
+        elif(engine=='serial'):
+            self.env = SerialBatchEnv(env_module.Env, num_envs, ramping = difficulty_ramping, seeds = seeds)
+        else:
+            raise ValueError('Engine '+repr(engine)+' is not available for '+env_name)
+        self.engine = engine
+        self.n_channels = self.env.state_shape()[2]
+        self.sticky_action_prob = sticky_action_prob
+        self.sticky_randoms = [np.random.default_rng(seed) for seed in seeds]
+        self.sticky_draws = np.zeros((num_envs,sticky_block_size))
+        self.sticky_index = sticky_block_size
+        self.last_actions = np.zeros(num_envs, dtype=np.int64)
+        self.observations = np.zeros((num_envs,10,10,self.n_channels), dtype=bool)
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.terminals = np.zeros(num_envs, dtype=bool)
+        self.auto_reset = auto_reset
+        self.running_returns = np.zeros(num_envs, dtype=np.float32)
+        self.running_lengths = np.zeros(num_envs, dtype=np.int64)
+        self.final_observations = np.zeros((num_envs,10,10,self.n_channels), dtype=bool)
+        self.episode_returns = np.zeros(num_envs, dtype=np.float32)
+        self.episode_lengths = np.zeros(num_envs, dtype=np.int64)
+        self.episode_ramps = np.zeros(num_envs, dtype=np.int64)
+        self.pending_actions = None
+        self.env.state(out=self.observations)
+
+    # Step every instance with the corresponding entry of actions, returns (observations, rewards, terminals)
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64)
+        if(actions.shape!=(self.num_envs,)):
+            raise ValueError('Expected actions of shape ('+str(self.num_envs)+',), got '+str(actions.shape))
+        if(self.sticky_index==sticky_block_size):
+            for i, random in enumerate(self.sticky_randoms):
+                random.random(out=self.sticky_draws[i])
+            self.sticky_index = 0
+        sticky = self.sticky_draws[:,self.sticky_index]<self.sticky_action_prob
+        self.sticky_index += 1
+        self.last_actions[:] = np.where(sticky, self.last_actions, actions)
+        # Without auto_reset, instances that were already terminal stay so and their episode statistics are frozen
+        live = True if self.auto_reset else ~self.terminals
+        self.rewards[:], self.terminals[:] = self.env.act(self.last_actions)
+        self.running_returns += self.rewards*live
+        self.running_lengths += live
+        self.env.state(out=self.observations)
+        if(self.auto_reset and self.terminals.any()):
+            self._finish_episodes(self.terminals.copy())
+        return self.observations, self.rewards, self.terminals
+
+    # Hand back the final observation and statistics of the episodes of the instances selected by done and reset them
+    def _finish_episodes(self, done):
+        self.final_observations[done] = self.observations[done]
+        self.episode_returns[done] = self.running_returns[done]
+        self.episode_lengths[done] = self.running_lengths[done]
+        ramps = self.env.difficulty_ramp()
+        if(ramps is not None):
+            self.episode_ramps[done] = ramps[done]
+        self.env.reset(done)
+        self.running_returns[done] = 0
+        self.running_lengths[done] = 0
+        self.env.state(out=self.observations)
+
+    # Split-phase version of step for code written against SubprocVecEnvironment. Everything runs in this process, so
+    # step_async only records a copy of the actions, so the caller may reuse its array, and the work is done by
+    # step_wait.
+    def step_async(self, actions):
+        actions = np.array(actions, dtype=np.int64)
+        if(actions.shape!=(self.num_envs,)):
+            raise ValueError('Expected actions of shape ('+str(self.num_envs)+',), got '+str(actions.shape))
+        self.pending_actions = actions
+
+    def step_wait(self):
+        if(self.pending_actions is None):
+            raise RuntimeError('step_wait called without a matching step_async')
+        actions = self.pending_actions
+        self.pending_actions = None
+        return self.step(actions)
+
+    # Stacked states of all instances, shape (num_envs,10,10,n). If out is given the states are written into it in
+    # place instead, out can have any numeric dtype and shape (num_envs,10,10,n), or (num_envs,n,10,10) if
+    # channels_first is True.
+    def state(self, out=None, channels_first=False):
+        if(out is None):
+            return self.observations.transpose(0,3,1,2) if channels_first else self.observations
+        self.env.state(out=out.transpose(0,2,3,1) if channels_first else out)
+        return out
+
+    # Objects of every instance in the fixed size array form of continuous_state (see minatar.objects), returns float32
+    # coordinates of shape (num_envs,n,max_objects,2) and a boolean mask of shape (num_envs,n,max_objects), written
+    # into coords and mask if given
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        return self.env.continuous_state_array(max_objects, coords, mask)
+
+    # Reset the instances selected by the boolean mask (all instances if mask is None) to the start of a new episode
+    # and return the stacked states
+    def reset(self, mask=None):
+        if(mask is None):
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.env.reset(mask)
+        self.rewards[mask] = 0
+        self.terminals[mask] = False
+        self.running_returns[mask] = 0
+        self.running_lengths[mask] = 0
+        self.env.state(out=self.observations)
+        return self.observations
+
+    # Dimensionality of the game-state of a single instance (10x10xn)
+    def state_shape(self):
+        return self.env.state_shape()
+
+    # All MinAtar environments have 6 actions
+    def num_actions(self):
+        return 6
+
+    # Name of the MinAtar game associated with this environment
+    def game_name(self):
+        return self.env_name
+
+    # Subset of actions that actually have a unique impact, shared by every instance of the game
+    def minimal_action_set(self):
+        return self.env.minimal_action_set()
+
+    # Current level of the difficulty ramp of every instance, None for games that do not ramp
+    def difficulty_ramp(self):
+        return self.env.difficulty_ramp()
+
+
+#####################################################################################################################
+# SerialBatchEnv
+#
+# Fallback batch engine for games that do not provide a vectorized BatchEnv. Holds one Env per game and exposes the
+# same interface as the BatchEnv classes in minatar.environments by looping over them.
+#
+#####################################################################################################################
+class SerialBatchEnv:
+    def __init__(self, env_class, num_envs, ramping = True, seeds = None):
+        if(seeds is None):
+            seeds = [None]*num_envs
+        self.num_envs = num_envs
+        self.envs = [env_class(ramping = ramping, seed = s) for s in seeds]
+        self.channels = self.envs[0].channels
+        self.action_map = self.envs[0].action_map
+        self.rewards = np.zeros(num_envs, dtype=np.int64)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+
+    # Update every game according to the corresponding entry of a, returns (rewards, terminals)
+    def act(self, a):
+        for i, env in enumerate(self.envs):
+            self.rewards[i], self.terminal[i] = env.act(a[i])
+        return self.rewards.copy(), self.terminal.copy()
+
+    # Current level of the difficulty ramp of every game, None for games that do not ramp
+    def difficulty_ramp(self):
+        ramps = [env.difficulty_ramp() for env in self.envs]
+        if(ramps[0] is None):
+            return None
+        return np.array(ramps)
+
+    # Stack the game-states into a num_envsx10x10xn array, writing into out if given
+    def state(self, out=None):
+        if(out is None):
+            out = np.zeros([self.num_envs]+self.state_shape(), dtype=bool)
+        for i, env in enumerate(self.envs):
+            env.state(out=out[i])
+        return out
+
+    # Stack the object arrays of the games, see minatar.objects
+    def continuous_state_array(self, max_objects, coords=None, mask=None):
+        coords, mask = object_arrays(len(self.channels), max_objects, coords, mask, lead=(self.num_envs,))
+        for i, env in enumerate(self.envs):
+            env.continuous_state_array(max_objects, coords[i], mask[i])
+        return coords, mask
+
+    # Reset the games selected by the boolean mask (all games if mask is None) to the start state for a new episode
+    def reset(self, mask=None):
+        for i, env in enumerate(self.envs):
+            if(mask is None or mask[i]):
+                env.reset()
+                self.terminal[i] = False
+
+    # Dimensionality of the game-state of a single game (10x10xn)
+    def state_shape(self):
+        return self.envs[0].state_shape()
+
+    # Subset of actions that actually have a unique impact in this environment
+    def minimal_action_set(self):
+        return self.envs[0].minimal_action_set()
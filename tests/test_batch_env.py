@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from minatar.environments import load_game
+
+GAMES = ['asterix', 'breakout', 'freeway', 'seaquest', 'space_invaders']
+
+
+# Every BatchEnv reproduces the reference Env of its game frame for frame, given the same seeds and actions
+@pytest.mark.parametrize('ramping', [True, False])
+@pytest.mark.parametrize('game', GAMES)
+def test_random_play_parity(game, ramping):
+    env_module = load_game(game)
+    num_envs = 32
+    envs = [env_module.Env(ramping=ramping, seed=s) for s in range(num_envs)]
+    batch = env_module.BatchEnv(num_envs, ramping=ramping, seeds=list(range(num_envs)))
+    rng = np.random.default_rng(0)
+    for t in range(3000):
+        a = rng.integers(6, size=num_envs)
+        rs, terminals = batch.act(a)
+        for i, env in enumerate(envs):
+            r, terminal = env.act(a[i])
+            assert r==rs[i] and terminal==terminals[i], (t, i)
+            if(terminal):
+                env.reset()
+        batch.reset(terminals)
+        ramps = batch.difficulty_ramp()
+        if(ramps is not None):
+            assert list(ramps)==[env.difficulty_ramp() for env in envs], t
+        states = batch.state()
+        for i, env in enumerate(envs):
+            assert np.array_equal(env.state(), states[i]), (t, i)
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from minatar import Environment
+
+
+# The bitboard backend plays like the reference Env and produces the same states
+@pytest.mark.parametrize('game', ['breakout', 'space_invaders'])
+def test_bitboard_matches_numpy(game):
+    envs = [Environment(game, random_seed=0, backend=b) for b in ['numpy', 'bitboard']]
+    rng = np.random.default_rng(0)
+    for t in range(5000):
+        a = int(rng.integers(6))
+        results = [env.act(a) for env in envs]
+        assert results[0]==results[1], t
+        assert np.array_equal(envs[0].state(), envs[1].state()), t
+        if(results[0][1]):
+            for env in envs:
+                env.reset()
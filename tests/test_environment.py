@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from minatar import Environment
+
+GAMES = ['asterix', 'breakout', 'freeway', 'seaquest', 'space_invaders']
+
+
+# state(out=...) and channels_first agree with a fresh state() after long random play, for any dtype of out
+@pytest.mark.parametrize('game', GAMES)
+def test_state_out_after_long_play(game):
+    env = Environment(game, random_seed=0)
+    out = np.zeros(env.state_shape(), dtype=np.float32)
+    out_first = np.zeros([env.n_channels,10,10], dtype=bool)
+    rng = np.random.default_rng(0)
+    for t in range(5000):
+        if(env.act(int(rng.integers(6)))[1]):
+            env.reset()
+        state = env.state()
+        assert env.state(out=out) is out
+        assert np.array_equal(out, state), t
+        assert np.array_equal(env.state(out=out_first, channels_first=True), state.transpose(2,0,1)), t
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from minatar import Environment
+from minatar.objects import objects_to_array
+
+GAMES = ['asterix', 'breakout', 'freeway', 'seaquest', 'space_invaders']
+
+
+# continuous_state_array holds the objects of continuous_state in the same order after long random play, including
+# when a channel has more objects than max_objects
+@pytest.mark.parametrize('max_objects', [2, 40])
+@pytest.mark.parametrize('game', GAMES)
+def test_continuous_state_array_matches_continuous_state(game, max_objects):
+    env = Environment(game, random_seed=0)
+    coords = np.ones((env.n_channels,max_objects,2), dtype=np.float32)
+    mask = np.ones((env.n_channels,max_objects), dtype=bool)
+    rng = np.random.default_rng(0)
+    for t in range(3000):
+        if(env.act(int(rng.integers(6)))[1]):
+            env.reset()
+        expected = objects_to_array(env.continuous_state(), max_objects)
+        result = env.continuous_state_array(max_objects, coords, mask)
+        assert result[0] is coords and result[1] is mask
+        assert np.array_equal(coords, expected[0]), t
+        assert np.array_equal(mask, expected[1]), t
@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from minatar import pack_state, unpack_state, packed_size
+
+
+# States of any leading shape, including empty batches, survive a pack/unpack round trip in both layouts
+@pytest.mark.parametrize('lead', [(), (5,), (2,3), (0,)])
+def test_round_trip(lead):
+    states = np.random.default_rng(0).random(lead+(10,10,7))<0.3
+    packed = pack_state(states)
+    assert packed.shape==lead+(packed_size(7),)
+    assert np.array_equal(unpack_state(packed, 7), states)
+    first = states.reshape((-1,10,10,7)).transpose(0,3,1,2).reshape(lead+(7,10,10))
+    assert np.array_equal(pack_state(first, channels_first=True), packed)
+    assert np.array_equal(unpack_state(packed, 7, channels_first=True, dtype=np.float32), first)
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+from minatar import Environment, VecEnvironment, Recorder, RecordingReader
+
+
+# An Environment recorded across several chunks reads back frame for frame, and every stored snapshot restores the
+# game so that the recorded actions reproduce the rest of the recording
+@pytest.mark.parametrize('compress', [False, True])
+def test_environment_round_trip(tmp_path, compress):
+    directory = str(tmp_path/'run')
+    env = Environment('breakout', random_seed=0)
+    rng = np.random.default_rng(0)
+    observations, actions, rewards, terminals = [], [], [], []
+    with Recorder(env, directory, chunk_size=100, compress=compress, snapshot_interval=64) as recorder:
+        for t in range(1000):
+            a = int(rng.integers(6))
+            observations.append(env.state().copy())
+            reward, terminal = recorder.act(a)
+            actions.append(a)
+            rewards.append(reward)
+            terminals.append(terminal)
+            if(terminal):
+                recorder.reset()
+    names = [name for name in os.listdir(directory) if name.startswith('chunk_')]
+    assert len(names)==10
+    assert all(name.endswith('.npz')==compress for name in names)
+
+    reader = RecordingReader(directory)
+    assert len(reader)==1000
+    assert np.array_equal(reader.observations(), np.array(observations))
+    assert np.array_equal(reader.observations(150, 260), np.array(observations[150:260]))
+    assert np.array_equal(reader.column('action'), actions)
+    assert np.array_equal(reader.column('reward'), rewards)
+    assert np.array_equal(reader.column('terminal'), terminals)
+    assert not reader.column('env').any()
+
+    snapshots = reader.snapshots()
+    assert [row for row, _ in snapshots]==list(range(0, 1000, 64))
+    for row, snapshot in snapshots[::3]:
+        replay = Environment('breakout', random_seed=1)
+        replay.load_state(snapshot)
+        for t in range(row, min(row+150, 1000)):
+            assert np.array_equal(replay.state(), observations[t]), (row, t)
+            assert replay.act(actions[t])==(rewards[t], terminals[t]), (row, t)
+            if(terminals[t]):
+                replay.reset()
+
+
+# Steps of a vectorized environment are recorded as num_envs rows each, also when a step straddles two chunks
+@pytest.mark.parametrize('compress', [False, True])
+def test_vec_environment_round_trip(tmp_path, compress):
+    directory = str(tmp_path/'run')
+    env = VecEnvironment('space_invaders', 3, random_seed=0, auto_reset=True)
+    rng = np.random.default_rng(0)
+    observations, actions, rewards, terminals = [], [], [], []
+    with Recorder(env, directory, chunk_size=7, compress=compress) as recorder:
+        for t in range(200):
+            a = rng.integers(6, size=3)
+            observations.append(env.state().copy())
+            _, reward, terminal = recorder.step(a)
+            actions.append(a)
+            rewards.append(reward.copy())
+            terminals.append(terminal.copy())
+
+    reader = RecordingReader(directory)
+    assert len(reader)==600
+    assert len(reader.chunks)==86
+    assert np.array_equal(reader.observations(), np.concatenate(observations))
+    assert np.array_equal(reader.observations(5, 23, channels_first=True),
+                          np.concatenate(observations)[5:23].transpose(0,3,1,2))
+    assert np.array_equal(reader.column('action'), np.concatenate(actions))
+    assert np.array_equal(reader.column('reward'), np.concatenate(rewards))
+    assert np.array_equal(reader.column('terminal'), np.concatenate(terminals))
+    assert np.array_equal(reader.column('env'), np.tile(np.arange(3), 200))
+    assert reader.snapshots()==[]
+
+
+def test_directory_with_recording_is_refused(tmp_path):
+    directory = str(tmp_path/'run')
+    env = Environment('freeway', random_seed=0)
+    with Recorder(env, directory, chunk_size=10) as recorder:
+        for t in range(25):
+            recorder.act(0)
+    with pytest.raises(ValueError):
+        Recorder(env, directory)
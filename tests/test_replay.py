@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from minatar import Environment, Replay, pack_state
+
+
+# Play actions in an Environment the way Replay models a trajectory, returns the n+1 states and the n rewards and
+# terminal flags
+def play_directly(game, actions, seed):
+    env = Environment(game, random_seed=seed)
+    states, rewards, terminals = [], [], []
+    for t, a in enumerate(actions):
+        states.append(env.state().copy())
+        reward, terminal = env.act(int(a))
+        rewards.append(reward)
+        terminals.append(terminal)
+        if(terminal and t+1<len(actions)):
+            env.reset()
+    states.append(env.state().copy())
+    return np.array(states), np.array(rewards, dtype=np.float32), np.array(terminals)
+
+
+@pytest.fixture(params=['breakout', 'seaquest'], scope='module')
+def trajectory(request):
+    actions = np.random.default_rng(0).integers(6, size=1500)
+    replay = Replay(request.param, actions, random_seed=3, checkpoint_interval=200)
+    return (request.param, actions, replay)+play_directly(request.param, actions, 3)
+
+
+# Random access in any order, including backwards across checkpoints and the frame after the final action, returns the
+# states of the directly played Environment
+def test_seek_matches_direct_play(trajectory):
+    game, actions, replay, states, rewards, terminals = trajectory
+    assert terminals.any()
+    assert len(replay)==len(actions)+1
+    assert np.array_equal(replay.rewards, rewards)
+    assert np.array_equal(replay.terminals, terminals)
+    for frame in [1400, 37, 650, 651, 199, 200, 1500, 0, 1499, 1001, 1000]:
+        assert np.array_equal(replay.state(frame), states[frame]), frame
+    assert np.array_equal(replay.state(777, channels_first=True), states[777].transpose(2,0,1))
+    with pytest.raises(IndexError):
+        replay.state(len(replay))
+
+
+# Snapshots taken from the replay continue the trajectory in another Environment
+def test_snapshot_continues_trajectory(trajectory):
+    game, actions, replay, states, rewards, terminals = trajectory
+    for frame in [1250, 333]:
+        for load in ['restore', 'load_state']:
+            # A clone only restores into the backend it was taken from, a binary snapshot loads into any backend
+            backend = replay.env_kwargs['backend'] if load=='restore' else 'numpy'
+            env = Environment(game, random_seed=99, backend=backend)
+            if(load=='restore'):
+                env.restore(replay.clone(frame))
+            else:
+                env.load_state(replay.snapshot(frame))
+            for t in range(frame, frame+100):
+                assert np.array_equal(env.state(), states[t]), (load, t)
+                assert env.act(int(actions[t]))==(rewards[t], terminals[t]), (load, t)
+                if(terminals[t]):
+                    env.reset()
+
+
+# Bulk decoding, bit-packed or not and in worker processes or not, returns the directly played states
+@pytest.mark.parametrize('num_workers', [1, 2])
+@pytest.mark.parametrize('packed', [False, True])
+def test_states_match_direct_play(trajectory, packed, num_workers):
+    game, actions, replay, states, rewards, terminals = trajectory
+    for start, stop in [(0, 1501), (1301, 1501), (150, 620), (400, 400)]:
+        result = replay.states(start, stop, packed=packed, num_workers=num_workers)
+        expected = pack_state(states[start:stop]) if packed else states[start:stop]
+        assert np.array_equal(result, expected), (start, stop)
+    out = np.zeros((50,10,10,replay.n_channels), dtype=np.float32)
+    assert replay.states(1451, 1501, out=out, num_workers=num_workers) is out
+    assert np.array_equal(out, states[1451:])
@@ -0,0 +1,30 @@
+import numpy as np
+from minatar.environments import seaquest
+
+
+# Env and a single game BatchEnv in the same hand-made state, with spawning held off so that only the given entities
+# take part
+def stacked_games(f_bullets, e_subs, e_fish):
+    env = seaquest.Env(seed=0)
+    batch = seaquest.BatchEnv(1, seeds=[0])
+    env.e_spawn_timer = env.d_spawn_timer = 100
+    batch.e_spawn_timer[:] = batch.d_spawn_timer[:] = 100
+    for name, entities in [('f_bullets', f_bullets), ('e_subs', e_subs), ('e_fish', e_fish)]:
+        setattr(env, name, [list(e) for e in entities])
+        pool = getattr(batch, name)
+        for e in entities:
+            pool.add(0, **dict(zip(pool.fields, e)))
+    return env, batch
+
+
+# A sub and a fish that move onto the same friendly bullet, the sub is resolved first and takes the bullet
+def test_sub_and_fish_on_one_bullet():
+    # Bullet moves right onto (5,3), then the sub moves left and the fish moves right onto it
+    env, batch = stacked_games(f_bullets=[(4,3,True)], e_subs=[(6,3,False,0,5)], e_fish=[(4,3,True,0)])
+    r, terminal = env.act(0)
+    rs, terminals = batch.act(np.array([0]))
+    assert r==1 and rs[0]==1 and terminal==terminals[0]
+    assert len(env.e_subs)==0 and len(env.e_fish)==1
+    assert batch.e_subs.count[0]==0 and batch.e_fish.count[0]==1
+    assert np.array_equal(env.state(), batch.state()[0])
+
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from minatar import Environment
+
+GAMES = ['asterix', 'breakout', 'freeway', 'seaquest', 'space_invaders']
+
+
+# The continuation of the trajectory survives clone/restore and binary save_state/load_state into another Environment
+@pytest.mark.parametrize('game', GAMES)
+def test_restore_reproduces_trajectory(game):
+    env = Environment(game, random_seed=1)
+    other = Environment(game, random_seed=2)
+    rng = np.random.default_rng(1)
+    for t in range(500):
+        if(env.act(int(rng.integers(6)))[1]):
+            env.reset()
+    snapshot = env.clone()
+    binary = env.save_state(binary=True)
+    actions = rng.integers(6, size=200).tolist()
+    expected = [(env.act(a), env.state().copy()) for a in actions]
+    for load in [lambda e: e.restore(snapshot), lambda e: e.load_state(binary)]:
+        load(other)
+        for a, (result, state) in zip(actions, expected):
+            assert other.act(a)==result
+            assert np.array_equal(other.state(), state)
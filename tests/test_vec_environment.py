@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from minatar import Environment, VecEnvironment, SubprocVecEnvironment
+
+GAMES = ['asterix', 'breakout', 'freeway', 'seaquest', 'space_invaders']
+
+
+# Play steps random steps with auto_reset and return the stacked rewards, terminals and observations
+def trajectory(env, steps, seed=0):
+    rng = np.random.default_rng(seed)
+    rewards, terminals, observations = [], [], []
+    for _ in range(steps):
+        o, r, t = env.step(rng.integers(6, size=env.num_envs))
+        rewards.append(r.copy())
+        terminals.append(t.copy())
+        observations.append(o.copy())
+    return np.array(rewards), np.array(terminals), np.array(observations)
+
+
+# With sticky actions on, the trajectories do not depend on how the instances are split across workers, and match
+# those of a VecEnvironment stepping every instance in this process
+@pytest.mark.parametrize('game', GAMES)
+def test_sharding_does_not_change_trajectories(game):
+    results = [trajectory(VecEnvironment(game, 6, random_seed=0, sticky_action_prob=0.5, auto_reset=True), 600)]
+    for num_workers in [1, 3]:
+        env = SubprocVecEnvironment(game, 6, num_workers=num_workers, random_seed=0, sticky_action_prob=0.5,
+                                    auto_reset=True)
+        try:
+            results.append(trajectory(env, 600))
+        finally:
+            env.close()
+    for result in results[1:]:
+        for a, b in zip(results[0], result):
+            assert np.array_equal(a, b)
+
+
+# Instance i of a VecEnvironment plays the same trajectory as the Environment seeded like it across resets, whether
+# they come from reset(mask) or from auto_reset
+@pytest.mark.parametrize('engine', ['batch', 'serial'])
+@pytest.mark.parametrize('game', GAMES)
+def test_instances_match_environments(game, engine):
+    num_envs = 4
+    manual = VecEnvironment(game, num_envs, random_seed=10, sticky_action_prob=0.5, engine=engine)
+    auto = VecEnvironment(game, num_envs, random_seed=10, sticky_action_prob=0.5, engine=engine, auto_reset=True)
+    envs = [Environment(game, random_seed=10+i, sticky_action_prob=0.5) for i in range(num_envs)]
+    rng = np.random.default_rng(0)
+    num_resets = 0
+    for t in range(3000):
+        actions = rng.integers(6, size=num_envs)
+        results = [env.act(int(actions[i])) for i, env in enumerate(envs)]
+        expected = np.stack([env.state() for env in envs])
+        for vec_env in [manual, auto]:
+            _, rewards, terminals = vec_env.step(actions)
+            assert results==list(zip(rewards, terminals)), (t, vec_env.auto_reset)
+        assert np.array_equal(manual.state(), expected), t
+        assert np.array_equal(auto.final_observations[terminals], expected[terminals]), t
+        if(terminals.any()):
+            num_resets += terminals.sum()
+            for i in np.flatnonzero(terminals):
+                envs[i].reset()
+            manual.reset(terminals.copy())
+            expected = np.stack([env.state() for env in envs])
+            assert np.array_equal(manual.state(), expected), t
+            assert np.array_equal(auto.state(), expected), t
+    assert num_resets>0
+
+
+# Without auto_reset the episode statistics of an instance stop changing once it is terminal
+def test_running_statistics_freeze_at_terminal():
+    env = VecEnvironment('breakout', 4, random_seed=0)
+    rng = np.random.default_rng(0)
+    frozen = None
+    for _ in range(2000):
+        _, _, terminals = env.step(rng.integers(6, size=4))
+        if(terminals.all()):
+            if(frozen is None):
+                frozen = env.running_returns.copy(), env.running_lengths.copy()
+            else:
+                assert np.array_equal(env.running_returns, frozen[0])
+                assert np.array_equal(env.running_lengths, frozen[1])
+    assert frozen is not None